@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from django.db.models import F, Sum
 
+from backend.basket import update_order_totals
+from backend.catalog import update_entries
+from backend.importer import bump_catalog_version
 from backend.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
     Contact, ConfirmEmailToken
 
@@ -39,8 +41,33 @@ class ProductAdmin(admin.ModelAdmin):
     pass
 
 
+# изменение позиций каталога в панели управления увеличивает версию каталога магазина
+class CatalogVersionAdminMixin:
+    shop_id_field = 'shop_id'
+
+    def get_shop_ids(self, queryset):
+        return set(queryset.values_list(self.shop_id_field, flat=True))
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        for shop_id in self.get_shop_ids(self.model.objects.filter(pk=obj.pk)):
+            bump_catalog_version(shop_id)
+
+    def delete_model(self, request, obj):
+        shop_ids = self.get_shop_ids(self.model.objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+        for shop_id in shop_ids:
+            bump_catalog_version(shop_id)
+
+    def delete_queryset(self, request, queryset):
+        shop_ids = self.get_shop_ids(queryset)
+        super().delete_queryset(request, queryset)
+        for shop_id in shop_ids:
+            bump_catalog_version(shop_id)
+
+
 @admin.register(ProductInfo)
-class ProductInfoAdmin(admin.ModelAdmin):
+class ProductInfoAdmin(CatalogVersionAdminMixin, admin.ModelAdmin):
     pass
 
 
@@ -50,21 +77,27 @@ class ParameterAdmin(admin.ModelAdmin):
 
 
 @admin.register(ProductParameter)
-class ProductParameterAdmin(admin.ModelAdmin):
-    pass
+class ProductParameterAdmin(CatalogVersionAdminMixin, admin.ModelAdmin):
+    shop_id_field = 'product_info__shop_id'
+
+    # удаление параметра меняет документ позиции в каталоге (при сохранении запись обновляет сигнал)
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        update_entries([obj.product_info_id])
+
+    def delete_queryset(self, request, queryset):
+        product_info_ids = set(queryset.values_list('product_info_id', flat=True))
+        super().delete_queryset(request, queryset)
+        update_entries(product_info_ids)
 
 
 # список позиций заказа
 class OrderItemsInline(admin.TabularInline):
     model = OrderItem
-    list_display = ('product_info', 'get_item_price', 'quantity', 'get_item_shop',)
+    list_display = ('product_info', 'price', 'quantity', 'get_item_shop',)
     readonly_fields = list_display
     can_delete = False
 
-    @admin.display(description='Цена')
-    def get_item_price(self, obj):
-        return obj.product_info.price
-
     @admin.display(description='Магазин')
     def get_item_shop(self, obj):
         return obj.product_info.shop
@@ -73,19 +106,26 @@ class OrderItemsInline(admin.TabularInline):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     inlines = [OrderItemsInline, ]
-    list_display = ('user', 'dt', 'state', 'contact', 'order_sum')
-    readonly_fields = ('user', 'dt', 'contact', 'order_sum')
-
-    # итоговая сумма заказа
-    @admin.display(description='Сумма заказа (итого)')
-    def order_sum(self, obj):
-        total_sum = obj.ordered_items.aggregate(total_sum=Sum(F('quantity') * F('product_info__price')))
-        return total_sum.get('total_sum')
+    list_display = ('user', 'dt', 'state', 'contact', 'total_sum', 'items_count')
+    readonly_fields = ('user', 'dt', 'contact', 'total_sum', 'items_count', 'stock_reserved', 'reserved_until')
 
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
-    pass
+
+    # итоги заказа пересчитываются после изменения позиций
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        update_order_totals([obj.order_id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        update_order_totals([obj.order_id])
+
+    def delete_queryset(self, request, queryset):
+        order_ids = set(queryset.values_list('order_id', flat=True))
+        super().delete_queryset(request, queryset)
+        update_order_totals(order_ids)
 
 
 @admin.register(Contact)
@@ -11,3 +11,4 @@ class BackendConfig(AppConfig):
         """
 
         import backend.schema
+        import backend.signals
@@ -0,0 +1,172 @@
+import json
+import mimetypes
+import re
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import storages
+from django.utils import timezone
+
+# хранилище больших результатов задач Celery (STORAGES['task_results'])
+STORAGE_ALIAS = 'task_results'
+
+mimetypes.add_type('application/yaml', '.yaml')
+mimetypes.add_type('application/x-ndjson', '.ndjson')
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def get_storage():
+    return storages[STORAGE_ALIAS]
+
+
+def save_artifact(user_id, extension, write):
+    """
+    Save a large task output to the task results storage.
+
+    The output is written to a temporary file first, so it is never held in memory.
+    Only the returned reference is stored in the Celery result backend.
+
+    Args:
+        user_id (int): The ID of the user the output belongs to.
+        extension (str): The extension of the file ('yaml', 'json', ...).
+        write (callable): Called with a binary file to write the output to.
+
+    Returns:
+        dict: The reference to the output: 'artifact' (the name in the storage), 'size',
+            'content_type' and 'expires' (a UNIX timestamp).
+    """
+    with tempfile.TemporaryFile() as fp:
+        write(fp)
+        fp.seek(0)
+        name = get_storage().save(f'{user_id}/{uuid.uuid4().hex}.{extension}', File(fp))
+        size = get_storage().size(name)
+    return {'artifact': name, 'size': size, 'content_type': get_content_type(name),
+            'expires': int(time.time()) + settings.TASK_RESULTS_TTL}
+
+
+def save_import_chunk(task_id, index, goods):
+    """
+    Save a chunk of goods of a parallel price list import to the task results storage (NDJSON).
+
+    The chunks are passed to the import tasks by name, so the goods never go through the broker.
+    The files of failed imports are deleted by cleanup_artifacts.
+
+    Args:
+        task_id (str): The ID of the import task.
+        index (int): The number of the chunk.
+        goods (list): The goods of the chunk.
+
+    Returns:
+        str: The name of the file in the storage.
+    """
+    with tempfile.TemporaryFile() as fp:
+        for item in goods:
+            fp.write(json.dumps(item, ensure_ascii=False, default=str).encode('utf-8'))
+            fp.write(b'\n')
+        fp.seek(0)
+        return get_storage().save(f'imports/{task_id}-{index}.ndjson', File(fp))
+
+
+def read_import_chunk(name):
+    """
+    Read the goods of a chunk saved by save_import_chunk one at a time.
+
+    Args:
+        name (str): The name of the file in the storage.
+
+    Returns:
+        generator: The goods of the chunk.
+    """
+    with get_storage().open(name, 'rb') as fp:
+        for line in fp:
+            yield json.loads(line)
+
+
+def is_artifact(result):
+    return isinstance(result, dict) and 'artifact' in result
+
+
+def get_content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def get_owner_id(name):
+    """
+    Return the ID of the user the artifact belongs to (the first part of its name).
+    """
+    owner_id, _, _ = name.partition('/')
+    return int(owner_id) if owner_id.isdigit() else None
+
+
+def parse_range(header, size):
+    """
+    Parse a single byte range of the Range header.
+
+    Args:
+        header (str): The value of the Range header.
+        size (int): The size of the file.
+
+    Returns:
+        tuple: The first and the last byte of the range or None if the header is not supported
+            (the whole file is sent then).
+
+    Raises:
+        ValueError: If the range is not satisfiable.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # последние N байт файла
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError(f'Диапазон {header} не соответствует размеру файла {size}')
+    return start, end
+
+
+def iter_file(fp, length, chunk_size=64 * 1024):
+    """
+    Read length bytes of the file by chunks and close it.
+    """
+    try:
+        while length > 0:
+            chunk = fp.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        fp.close()
+
+
+def cleanup_artifacts(ttl=None):
+    """
+    Delete task outputs older than the TTL.
+
+    Args:
+        ttl (int): The time to live of the outputs, seconds (settings.TASK_RESULTS_TTL by default).
+
+    Returns:
+        int: The number of deleted files.
+    """
+    storage = get_storage()
+    expired = timezone.now() - timedelta(seconds=settings.TASK_RESULTS_TTL if ttl is None else ttl)
+    deleted = 0
+    if not storage.exists(''):
+        return deleted
+    directories, _ = storage.listdir('')
+    for directory in directories:
+        for file_name in storage.listdir(directory)[1]:
+            name = f'{directory}/{file_name}'
+            if storage.get_modified_time(name) < expired:
+                storage.delete(name)
+                deleted += 1
+    return deleted
@@ -0,0 +1,520 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery, Sum, F, Value, BigIntegerField
+from django.db.models.functions import Coalesce, Cast
+from rest_framework import serializers
+
+from backend.models import Order, OrderItem, ProductInfo, CatalogEntry
+from backend.serializers import OrderSerializer
+from backend.util import get_redis
+
+# ключи корзины в Redis: позиции (ID информации о продукте -> количество, ID позиции заказа, цена позиции)
+# и заказ-корзина в БД (id, dt)
+ITEMS_KEY = 'basket:{user_id}:items'
+LINES_KEY = 'basket:{user_id}:lines'
+PRICES_KEY = 'basket:{user_id}:prices'
+ORDER_KEY = 'basket:{user_id}:order'
+# пользователи, корзины которых изменены и еще не записаны в БД
+DIRTY_KEY = 'baskets:dirty'
+
+
+def get_basket(user_id, lock=False):
+    """
+    Return the basket of a user, creating it if necessary.
+
+    Args:
+        user_id (int): The ID of the user.
+        lock (bool): Lock the basket row until the end of the current transaction
+            (concurrent changes of the same basket are serialized).
+
+    Returns:
+        Order: The basket.
+    """
+    queryset = Order.objects.select_for_update() if lock else Order.objects
+    basket, _ = queryset.get_or_create(user_id=user_id, state='basket')
+    return basket
+
+
+def get_stock(product_info_ids, order_id=None):
+    """
+    Read the stock and the prices of goods (and their quantity in a basket) with one query.
+
+    Args:
+        product_info_ids (iterable): The IDs of the product infos.
+        order_id (int): The ID of the basket (the ordered quantities are 0 without it).
+
+    Returns:
+        dict: product_info ID -> (the stock, the state of the shop, the quantity in the basket, the price).
+    """
+    in_basket = OrderItem.objects.filter(order_id=order_id, product_info_id=OuterRef('pk')).values('quantity')
+    ordered = Coalesce(Subquery(in_basket), 0) if order_id is not None else Value(0)
+    return {product_info_id: row for product_info_id, *row in ProductInfo.objects.filter(
+        id__in=product_info_ids).annotate(ordered=ordered).values_list(
+        'id', 'quantity', 'shop__state', 'ordered', 'price')}
+
+
+def update_order_totals(order_ids):
+    """
+    Recalculate the stored totals of orders from their lines by one UPDATE.
+
+    The totals are calculated from the prices stored in the lines, so they do not change
+    when partners change the prices of goods.
+
+    Args:
+        order_ids (list): The IDs of the orders.
+
+    Returns:
+        None
+    """
+    lines = OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+    Order.objects.filter(id__in=order_ids).update(
+        total_sum=Coalesce(Subquery(lines.annotate(
+            total=Sum(Cast('price', BigIntegerField()) * F('quantity'))).values('total')), 0),
+        items_count=Coalesce(Subquery(lines.annotate(total=Sum('quantity')).values('total')), 0))
+
+
+def check_stock(stock, quantity):
+    """
+    Check that a quantity of a product can be put into a basket.
+
+    Args:
+        stock (tuple): The stock of the product returned by get_stock (None if the product is not found).
+        quantity (int): The new quantity of the product in the basket.
+
+    Returns:
+        str: The error or None.
+    """
+    if stock is None:
+        return 'Товар не найден'
+    available, shop_state = stock[:2]
+    if not shop_state:
+        return 'Магазин не принимает заказы'
+    if quantity > available:
+        return f'Недостаточно товара: в наличии {available}'
+    return None
+
+
+class DatabaseBasketStore:
+    """
+    Корзины в таблицах заказов (Order со статусом basket и его позиции OrderItem).
+
+    Methods:
+    - get: Return the basket of a user as rendered by OrderSerializer.
+    - add_items: Add goods to the basket.
+    - update_items: Set the quantities of the basket lines.
+    - delete_items: Remove lines from the basket.
+    - save: Write the basket to the database before the checkout.
+    - clear: Forget the basket after the checkout.
+    """
+
+    def get(self, user_id):
+        basket = Order.objects.filter(
+            user_id=user_id, state='basket').prefetch_related(
+            'ordered_items__product_info__product__category',
+            'ordered_items__product_info__product_parameters__parameter')
+        return OrderSerializer(basket, many=True).data
+
+    def add_items(self, user_id, items):
+        """
+        Add goods to the basket of a user in one transaction.
+
+        The goods and their stock are checked by one query, all lines are written by one upsert:
+        the quantity of a product already in the basket is increased. Nothing is written
+        if any line is invalid.
+
+        Args:
+            user_id (int): The ID of the user.
+            items (list): Dicts with product_info (ID) and quantity (> 0); repeated goods are summed.
+
+        Returns:
+            tuple: (the number of written lines, errors by product_info ID).
+        """
+        quantities = Counter()
+        for item in items:
+            quantities[item['product_info']] += item['quantity']
+
+        with transaction.atomic():
+            basket = get_basket(user_id, lock=True)
+            stock = get_stock(quantities, basket.id)
+            errors = {}
+            lines = []
+            for product_info_id, quantity in quantities.items():
+                if product_info_id in stock:
+                    quantity += stock[product_info_id][2]
+                error = check_stock(stock.get(product_info_id), quantity)
+                if error:
+                    errors[product_info_id] = error
+                else:
+                    lines.append(OrderItem(order_id=basket.id, product_info_id=product_info_id, quantity=quantity,
+                                           price=stock[product_info_id][3]))
+            if errors:
+                return 0, errors
+
+            # корзина заблокирована, поэтому новое количество (в корзине + добавляемое) вычислено без гонок
+            OrderItem.objects.bulk_create(lines, update_conflicts=True, unique_fields=['order', 'product_info'],
+                                          update_fields=['quantity', 'price'])
+            update_order_totals([basket.id])
+        return len(lines), {}
+
+    def update_items(self, user_id, items):
+        """
+        Set the quantities of the basket lines of a user.
+
+        The lines and the stock of their goods are read by one query, the valid lines are written
+        by one UPDATE statement (CASE by the line ID); the other lines are left unchanged.
+
+        Args:
+            user_id (int): The ID of the user.
+            items (list): Dicts with id (the ID of the basket line) and quantity (> 0).
+
+        Returns:
+            dict: The outcome of every line by its ID: None if the line is updated, otherwise the error.
+        """
+        quantities = {item['id']: item['quantity'] for item in items}
+        outcomes = dict.fromkeys(quantities, 'Позиция не найдена в корзине')
+
+        with transaction.atomic():
+            basket = get_basket(user_id, lock=True)
+            lines = []
+            for line in OrderItem.objects.filter(order_id=basket.id, id__in=quantities).select_related(
+                    'product_info__shop').only('quantity', 'price', 'product_info__quantity', 'product_info__price',
+                                               'product_info__shop__state'):
+                quantity, price = quantities[line.id], line.product_info.price
+                outcomes[line.id] = check_stock((line.product_info.quantity, line.product_info.shop.state), quantity)
+                if outcomes[line.id] is None and (line.quantity, line.price) != (quantity, price):
+                    line.quantity, line.price = quantity, price
+                    lines.append(line)
+            if lines:
+                OrderItem.objects.bulk_update(lines, ['quantity', 'price'])
+                update_order_totals([basket.id])
+        return outcomes
+
+    def delete_items(self, user_id, ids):
+        """
+        Remove lines from the basket of a user.
+
+        Args:
+            user_id (int): The ID of the user.
+            ids (list): The IDs of the basket lines.
+
+        Returns:
+            int: The number of removed lines.
+        """
+        basket = get_basket(user_id)
+        deleted = OrderItem.objects.filter(order_id=basket.id, id__in=ids).delete()[0]
+        if deleted:
+            update_order_totals([basket.id])
+        return deleted
+
+    def save(self, user_id):
+        return Order.objects.filter(user_id=user_id, state='basket').first()
+
+    def clear(self, user_id):
+        pass
+
+
+def allocate_line_ids(count):
+    """
+    Reserve the IDs of new basket lines from the sequence of the OrderItem table.
+
+    The lines are written to the database with these IDs later, so the IDs of the lines
+    do not depend on the basket store.
+
+    Args:
+        count (int): The number of IDs.
+
+    Returns:
+        list: The IDs.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                       [OrderItem._meta.db_table, count])
+        return [row[0] for row in cursor.fetchall()]
+
+
+class RedisBasketStore(DatabaseBasketStore):
+    """
+    Активные корзины в хэшах Redis (ID информации о продукте -> количество, ID позиции, цена)
+    со сроком хранения settings.BASKET_TTL.
+
+    Изменения корзины не пишутся в БД: корзина записывается в Order/OrderItem при оформлении заказа
+    (save) и периодической задачей flush_baskets. Корзина, которой нет в Redis, загружается из БД.
+    ID позиции корзины - ID позиции заказа (OrderItem): для новых позиций он берется из последовательности
+    таблицы позиций, и позиция записывается в БД с этим ID, поэтому ID позиций не меняются при смене хранилища.
+    Цена позиции, как и в DatabaseBasketStore, - цена товара при добавлении или изменении количества.
+
+    Attributes:
+    - redis: The Redis client.
+    - ttl: The time to live of a basket, seconds.
+    """
+
+    def __init__(self, url=None, ttl=None):
+        self.redis = get_redis(url or settings.BASKET_REDIS)
+        self.ttl = ttl or settings.BASKET_TTL
+
+    def _keys(self, user_id):
+        return (ITEMS_KEY.format(user_id=user_id), LINES_KEY.format(user_id=user_id),
+                PRICES_KEY.format(user_id=user_id), ORDER_KEY.format(user_id=user_id))
+
+    def _products(self, pipe, lines_key):
+        # ID позиции -> ID информации о продукте
+        return {int(line_id): int(product_info_id) for product_info_id, line_id in pipe.hgetall(lines_key).items()}
+
+    def _load(self, user_id, create=False):
+        """
+        Return the basket order of a user ({'id', 'dt'}), loading the basket from the database if necessary.
+
+        Args:
+            user_id (int): The ID of the user.
+            create (bool): Create the basket order if the user has none (the id is empty otherwise).
+
+        Returns:
+            dict: The basket order.
+        """
+        items_key, lines_key, prices_key, order_key = self._keys(user_id)
+        order = self.redis.hgetall(order_key)
+        if order and (order['id'] or not create):
+            return order
+
+        basket = get_basket(user_id) if create else Order.objects.filter(user_id=user_id, state='basket').first()
+        if basket is None:
+            order, lines = {'id': '', 'dt': ''}, []
+        else:
+            order = {'id': basket.id, 'dt': serializers.DateTimeField().to_representation(basket.dt)}
+            lines = list(basket.ordered_items.values_list('product_info_id', 'quantity', 'id', 'price'))
+
+        def load(pipe):
+            # корзина загружена параллельным запросом: позиции в Redis новее позиций в БД
+            loaded = pipe.exists(order_key)
+            pipe.multi()
+            if not loaded:
+                pipe.delete(items_key, lines_key, prices_key)
+                if lines:
+                    pipe.hset(items_key, mapping={line[0]: line[1] for line in lines})
+                    pipe.hset(lines_key, mapping={line[0]: line[2] for line in lines})
+                    pipe.hset(prices_key, mapping={line[0]: line[3] for line in lines})
+            pipe.hset(order_key, mapping=order)
+            for key in self._keys(user_id):
+                pipe.expire(key, self.ttl)
+
+        self.redis.transaction(load, order_key)
+        return {key: str(value) for key, value in order.items()}
+
+    def _touch(self, pipe, user_id):
+        for key in self._keys(user_id):
+            pipe.expire(key, self.ttl)
+        pipe.sadd(DIRTY_KEY, user_id)
+
+    def get(self, user_id):
+        order = self._load(user_id)
+        if not order['id']:
+            return []
+        items_key, lines_key, prices_key, _ = self._keys(user_id)
+        with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hgetall(items_key)
+            pipe.hgetall(lines_key)
+            pipe.hgetall(prices_key)
+            quantities, line_ids, prices = pipe.execute()
+        # документы каталога - это представление ProductInfoSerializer, позиции отображаются без запросов к заказам;
+        # цены и итоги - по ценам позиций, как в DatabaseBasketStore
+        documents = dict(CatalogEntry.objects.filter(product_info_id__in=quantities).values_list(
+            'product_info_id', 'document'))
+        ordered_items = sorted(({'id': int(line_ids[str(product_info_id)]), 'product_info': document,
+                                 'quantity': int(quantities[str(product_info_id)]),
+                                 'price': int(prices[str(product_info_id)])}
+                                for product_info_id, document in documents.items()), key=lambda item: item['id'])
+        return [{'id': int(order['id']), 'ordered_items': ordered_items, 'state': 'basket', 'dt': order['dt'],
+                 'total_sum': sum(item['price'] * item['quantity'] for item in ordered_items),
+                 'items_count': sum(item['quantity'] for item in ordered_items), 'contact': None}]
+
+    def add_items(self, user_id, items):
+        """
+        Add goods to the basket of a user.
+
+        The quantities in the basket are read and increased in one Redis transaction (WATCH/MULTI):
+        if the basket is changed concurrently, the stock is checked again against the new quantities.
+        The goods and their stock are checked by one query; nothing is added if any line is invalid.
+        The prices of the lines are set to the current prices of the goods.
+
+        Args:
+            user_id (int): The ID of the user.
+            items (list): Dicts with product_info (ID) and quantity (> 0); repeated goods are summed.
+
+        Returns:
+            tuple: (the number of written lines, errors by product_info ID).
+        """
+        quantities = Counter()
+        for item in items:
+            quantities[item['product_info']] += item['quantity']
+        self._load(user_id, create=True)
+        items_key, lines_key, prices_key, _ = self._keys(user_id)
+        errors = {}
+
+        def add(pipe):
+            # количество в корзине проверяется и увеличивается в одной транзакции: параллельное добавление
+            # тех же товаров повторяет транзакцию, и остаток проверяется уже с новым количеством
+            ordered = dict(zip(quantities, pipe.hmget(items_key, list(quantities))))
+            stock = get_stock(quantities)
+            errors.clear()
+            for product_info_id, quantity in quantities.items():
+                error = check_stock(stock.get(product_info_id), quantity + int(ordered[product_info_id] or 0))
+                if error:
+                    errors[product_info_id] = error
+            new = [product_info_id for product_info_id in quantities if ordered[product_info_id] is None]
+            line_ids = dict(zip(new, allocate_line_ids(len(new)))) if new and not errors else {}
+            pipe.multi()
+            if not errors:
+                for product_info_id, quantity in quantities.items():
+                    pipe.hincrby(items_key, product_info_id, quantity)
+                if line_ids:
+                    pipe.hset(lines_key, mapping=line_ids)
+                pipe.hset(prices_key, mapping={product_info_id: stock[product_info_id][3]
+                                               for product_info_id in quantities})
+                self._touch(pipe, user_id)
+
+        self.redis.transaction(add, items_key)
+        if errors:
+            return 0, errors
+        return len(quantities), {}
+
+    def update_items(self, user_id, items):
+        """
+        Set the quantities of the basket lines of a user.
+
+        Args:
+            user_id (int): The ID of the user.
+            items (list): Dicts with id (the ID of the basket line) and quantity (> 0).
+
+        Returns:
+            dict: The outcome of every line by its ID: None if the line is updated, otherwise the error.
+        """
+        quantities = {item['id']: item['quantity'] for item in items}
+        self._load(user_id)
+        items_key, lines_key, prices_key, _ = self._keys(user_id)
+        outcomes = {}
+
+        def update(pipe):
+            # позиции, удаленные параллельным запросом, не восстанавливаются (транзакция повторяется)
+            products = self._products(pipe, lines_key)
+            stock = get_stock([products[line_id] for line_id in quantities if line_id in products])
+            outcomes.clear()
+            changed = {}
+            for line_id, quantity in quantities.items():
+                if line_id not in products:
+                    outcomes[line_id] = 'Позиция не найдена в корзине'
+                    continue
+                outcomes[line_id] = check_stock(stock.get(products[line_id]), quantity)
+                if outcomes[line_id] is None:
+                    changed[products[line_id]] = quantity
+            pipe.multi()
+            if changed:
+                pipe.hset(items_key, mapping=changed)
+                pipe.hset(prices_key, mapping={product_info_id: stock[product_info_id][3]
+                                               for product_info_id in changed})
+                self._touch(pipe, user_id)
+
+        self.redis.transaction(update, items_key, lines_key)
+        return outcomes
+
+    def delete_items(self, user_id, ids):
+        self._load(user_id)
+        items_key, lines_key, prices_key, _ = self._keys(user_id)
+
+        def delete(pipe):
+            products = self._products(pipe, lines_key)
+            product_info_ids = {products[line_id] for line_id in ids if line_id in products}
+            pipe.multi()
+            if product_info_ids:
+                for key in (items_key, lines_key, prices_key):
+                    pipe.hdel(key, *product_info_ids)
+                self._touch(pipe, user_id)
+            return len(product_info_ids)
+
+        return self.redis.transaction(delete, lines_key, value_from_callable=True)
+
+    def _write(self, user_id):
+        items_key, lines_key, prices_key, order_key = self._keys(user_id)
+        with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hgetall(items_key)
+            pipe.hgetall(lines_key)
+            pipe.hgetall(prices_key)
+            pipe.exists(order_key)
+            quantities, line_ids, prices, loaded = pipe.execute()
+        if not loaded:
+            # корзина не загружалась или истек срок хранения: в БД - последняя записанная версия
+            return Order.objects.filter(user_id=user_id, state='basket').first()
+
+        with transaction.atomic():
+            basket = get_basket(user_id, lock=True)
+            product_info_ids = list(ProductInfo.objects.filter(id__in=quantities).values_list('id', flat=True))
+            OrderItem.objects.filter(order_id=basket.id).exclude(product_info_id__in=product_info_ids).delete()
+            OrderItem.objects.bulk_create(
+                [OrderItem(id=int(line_ids[str(product_info_id)]), order_id=basket.id,
+                           product_info_id=product_info_id, price=int(prices[str(product_info_id)]),
+                           quantity=int(quantities[str(product_info_id)]))
+                 for product_info_id in product_info_ids],
+                update_conflicts=True, unique_fields=['order', 'product_info'], update_fields=['quantity', 'price'])
+            update_order_totals([basket.id])
+            # позиция, созданная в БД не через Redis, сохраняет свой ID
+            written = OrderItem.objects.filter(order_id=basket.id).values_list('product_info_id', 'id')
+            changed_ids = {product_info_id: line_id for product_info_id, line_id in written
+                           if line_ids.get(str(product_info_id)) != str(line_id)}
+        with self.redis.pipeline() as pipe:
+            pipe.hset(order_key, 'id', basket.id)
+            if changed_ids:
+                pipe.hset(lines_key, mapping=changed_ids)
+            pipe.execute()
+        return basket
+
+    def save(self, user_id):
+        """
+        Write the basket of a user to Order/OrderItem.
+
+        Args:
+            user_id (int): The ID of the user.
+
+        Returns:
+            Order: The basket or None if the user has no basket.
+        """
+        self.redis.srem(DIRTY_KEY, user_id)
+        return self._write(user_id)
+
+    def clear(self, user_id):
+        with self.redis.pipeline() as pipe:
+            pipe.delete(*self._keys(user_id))
+            pipe.srem(DIRTY_KEY, user_id)
+            pipe.execute()
+
+    def flush(self, batch_size=None):
+        """
+        Write all changed baskets to the database.
+
+        Args:
+            batch_size (int): The number of baskets taken from Redis at a time.
+
+        Returns:
+            int: The number of written baskets.
+        """
+        batch_size = batch_size or settings.PRICE_LIST_IMPORT_BATCH_SIZE
+        written = 0
+        while user_ids := self.redis.spop(DIRTY_KEY, batch_size):
+            for index, user_id in enumerate(user_ids):
+                try:
+                    self._write(user_id)
+                except Exception:
+                    # не записанные корзины будут записаны следующим запуском
+                    self.redis.sadd(DIRTY_KEY, *user_ids[index:])
+                    raise
+                written += 1
+        return written
+
+
+def get_store():
+    """
+    Return the basket store selected by settings.BASKET_STORE ('db' or 'redis').
+    """
+    if settings.BASKET_STORE == 'redis':
+        return RedisBasketStore()
+    return DatabaseBasketStore()
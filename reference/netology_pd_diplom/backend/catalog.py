@@ -0,0 +1,193 @@
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Prefetch, Q, F, Func, JSONField, OuterRef, Subquery, Value
+
+from backend import search, response_cache
+from backend.models import ProductInfo, ProductParameter, CatalogEntry, Category
+
+# поля записи каталога, перезаписываемые при обновлении (поисковый документ обновляется отдельно)
+ENTRY_FIELDS = ('shop', 'category', 'active', 'name', 'model', 'quantity', 'price', 'price_rrc', 'document')
+
+
+def entry_source_queryset():
+    """
+    Return the product infos with everything render_document reads loaded by two queries.
+
+    Returns:
+        QuerySet: The ProductInfo queryset.
+    """
+    return ProductInfo.objects.select_related('shop', 'product__category').prefetch_related(
+        Prefetch('product_parameters', queryset=ProductParameter.objects.select_related('parameter').order_by('id')))
+
+
+def render_document(product_info):
+    """
+    Render the document of a catalog entry directly from the loaded objects.
+
+    The document is the representation of ProductInfoSerializer (the fields must follow
+    ProductInfoSerializer.Meta.fields); a serializer pass per row made the catalog update
+    as expensive as the import itself.
+
+    Args:
+        product_info (ProductInfo): The product info loaded by entry_source_queryset.
+
+    Returns:
+        dict: The document.
+    """
+    product = product_info.product
+    return {
+        'id': product_info.id,
+        'model': product_info.model,
+        'product': {'name': product.name, 'category': str(product.category)},
+        'shop': product_info.shop_id,
+        'quantity': product_info.quantity,
+        'price': product_info.price,
+        'price_rrc': product_info.price_rrc,
+        'product_parameters': [{'parameter': str(product_parameter.parameter), 'value': product_parameter.value}
+                               for product_parameter in product_info.product_parameters.all()],
+    }
+
+
+def build_entry(product_info):
+    """
+    Build the catalog entry of a product info.
+
+    Args:
+        product_info (ProductInfo): The product info loaded by entry_source_queryset.
+
+    Returns:
+        CatalogEntry: The unsaved entry.
+    """
+    return CatalogEntry(
+        product_info_id=product_info.id,
+        shop_id=product_info.shop_id,
+        category_id=product_info.product.category_id,
+        active=product_info.shop.state,
+        name=product_info.product.name,
+        model=product_info.model,
+        quantity=product_info.quantity,
+        price=product_info.price,
+        price_rrc=product_info.price_rrc,
+        document=render_document(product_info),
+    )
+
+
+def update_entries(ids, search_ids=None, batch_size=None):
+    """
+    Create or refresh the catalog entries of product infos.
+
+    Args:
+        ids (iterable): The IDs of the product infos (missing product infos are skipped,
+            their entries are deleted by the cascade).
+        search_ids (iterable): The IDs whose search documents are recalculated (all ids by default;
+            changes of the price or the stock do not change the search document).
+        batch_size (int): The number of entries written per query.
+
+    Returns:
+        int: The number of written entries.
+    """
+    batch_size = batch_size or settings.PRICE_LIST_IMPORT_BATCH_SIZE
+    ids = iter(ids)
+    written = 0
+    while batch := list(islice(ids, batch_size)):
+        entries = [build_entry(product_info) for product_info in entry_source_queryset().filter(id__in=batch)]
+        CatalogEntry.objects.bulk_create(entries, update_conflicts=True, unique_fields=['product_info'],
+                                         update_fields=ENTRY_FIELDS)
+        if search_ids is None:
+            search.update_search_vectors([entry.product_info_id for entry in entries])
+        written += len(entries)
+    if search_ids is not None:
+        search.update_search_vectors(search_ids)
+    response_cache.bump_version()
+    return written
+
+
+def update_quantities(ids):
+    """
+    Refresh the stock of catalog entries (the quantity column and the document) by one UPDATE.
+
+    The documents are not rendered again, and the version of the response cache is not bumped:
+    cached responses show the stock until the next change of the catalog or
+    settings.RESPONSE_CACHE_TIMEOUT, the stock is checked again at the checkout.
+
+    Args:
+        ids (list): The IDs of the product infos whose stock has changed.
+
+    Returns:
+        int: The number of updated entries.
+    """
+    quantity = Subquery(ProductInfo.objects.filter(id=OuterRef('product_info_id')).values('quantity'))
+    return CatalogEntry.objects.filter(product_info_id__in=ids).update(
+        quantity=quantity,
+        document=Func(F('document'), Value(['quantity']), Func(quantity, function='to_jsonb'),
+                      function='jsonb_set', output_field=JSONField()))
+
+
+def rebuild_entries(queryset=None, batch_size=None):
+    """
+    Refresh the catalog entries of all (or the given) product infos.
+
+    Args:
+        queryset (QuerySet): Product infos (all by default).
+        batch_size (int): The number of entries written per query.
+
+    Returns:
+        int: The number of written entries.
+    """
+    batch_size = batch_size or settings.PRICE_LIST_IMPORT_BATCH_SIZE
+    queryset = ProductInfo.objects.all() if queryset is None else queryset
+    ids = queryset.order_by('id').values_list('id', flat=True).iterator(chunk_size=batch_size)
+    return update_entries(ids, batch_size=batch_size)
+
+
+def set_shop_state(shop_ids, state):
+    """
+    Show or hide the entries of shops after the change of Shop.state.
+
+    Args:
+        shop_ids (list): The IDs of the shops.
+        state (bool): The new state of the shops.
+
+    Returns:
+        None
+    """
+    CatalogEntry.objects.filter(shop_id__in=shop_ids).exclude(active=state).update(active=state)
+    response_cache.bump_version()
+
+
+def refresh_category_names(categories):
+    """
+    Refresh the entries whose documents contain old names of the given categories.
+
+    Args:
+        categories (dict): category ID -> the current name.
+
+    Returns:
+        int: The number of written entries.
+    """
+    stale = Q()
+    for category_id, name in categories.items():
+        stale |= Q(category_id=category_id) & ~Q(document__product__category=name)
+    if not stale:
+        return 0
+    return rebuild_entries(ProductInfo.objects.filter(catalog_entry__in=CatalogEntry.objects.filter(stale)))
+
+
+def refresh_names(model_name, object_id):
+    """
+    Refresh the entries whose documents contain the name of a renamed category, parameter or product.
+
+    Args:
+        model_name (str): 'category', 'parameter' or 'product'.
+        object_id (int): The ID of the renamed object.
+
+    Returns:
+        int: The number of written entries.
+    """
+    if model_name == 'category':
+        name = Category.objects.filter(id=object_id).values_list('name', flat=True).first()
+        return 0 if name is None else refresh_category_names({object_id: name})
+    if model_name == 'parameter':
+        return rebuild_entries(ProductInfo.objects.filter(product_parameters__parameter_id=object_id))
+    return rebuild_entries(ProductInfo.objects.filter(product_id=object_id))
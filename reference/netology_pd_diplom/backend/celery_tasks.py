@@ -1,10 +1,23 @@
-from celery import shared_task
+import time
+from itertools import chain, islice
+
+from celery import shared_task, chord
 from celery.contrib.django.task import DjangoTask
+from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import EmailMultiAlternatives
-from yaml import load as load_yaml, Loader
+from django.utils import timezone
 
-from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter
-from backend.serializers import PartnerExportSerializer
+from backend.artifacts import save_artifact, cleanup_artifacts, save_import_chunk, read_import_chunk, get_storage
+from backend.basket import RedisBasketStore
+from backend.catalog import refresh_names
+from backend.reservations import release_expired_orders
+from backend.dumps import plan_shards, write_shard, write_manifest, cleanup_dumps
+from backend.exporters import write_export
+from backend.fetch import fetch_price_list, host_slot, HostBusy
+from backend.importer import import_price_list, iter_batches, PriceListImporter, bump_catalog_version
+from backend.price_list import read_price_list
+from backend.models import Shop
 
 
 # отправить сообщение по электронной почте (асинхронно - через Celery)
@@ -38,56 +51,309 @@ def send_email(title, message, sender, recipients):
 
 # экспорт товаров партнера (асинхронно - через Celery)
 @shared_task
-def partner_export(user_id):
+def partner_export(user_id, export_format='yaml'):
     """
     Export partner data asynchronously using Celery tasks.
 
+    The price list is streamed to a file in the task results storage; only the reference
+    to the file is stored in the result backend (see backend.artifacts).
+
     Args:
         user_id (int): The ID of the user associated with the partner.
+        export_format (str): The format of the export ('yaml', 'json', 'ndjson' or 'csv').
 
     Returns:
-        dict: The serialized data of the partner.
+        dict: The reference to the exported file or {'status': 'shop not found'}.
     """
 
     shop = Shop.objects.filter(user_id=user_id).first()
-    serializer = PartnerExportSerializer(shop)
-    return serializer.data
+    if shop is None:
+        return {'status': 'shop not found'}
+    return save_artifact(user_id, export_format, lambda fp: write_export(shop, fp, export_format))
 
 
-# обновление данных партнера (асинхронно - через Celery)
+# удаление устаревших файлов результатов задач (периодическая задача celery beat)
+@shared_task
+def cleanup_task_results():
+    """
+    Delete task outputs older than settings.TASK_RESULTS_TTL.
+
+    Returns:
+        int: The number of deleted files.
+    """
+    return cleanup_artifacts()
+
+
+# обновление записей каталога после переименования категории, параметра или товара (асинхронно - через Celery)
+@shared_task
+def refresh_catalog_names(model_name, object_id):
+    """
+    Refresh the catalog entries whose documents contain the name of a renamed category, parameter or product.
+
+    Args:
+        model_name (str): 'category', 'parameter' or 'product'.
+        object_id (int): The ID of the renamed object.
+
+    Returns:
+        int: The number of written entries.
+    """
+    return refresh_names(model_name, object_id)
+
+
+# запись измененных корзин из Redis в БД (периодическая задача celery beat)
+@shared_task
+def flush_baskets():
+    """
+    Write the baskets changed in the Redis basket store to the database.
+
+    Returns:
+        int: The number of written baskets.
+    """
+    if settings.BASKET_STORE != 'redis':
+        return 0
+    return RedisBasketStore().flush()
+
+
+# отмена заказов с истекшим резервом товаров (периодическая задача celery beat)
 @shared_task
-def partner_update(stream, user_id):
+def release_expired_reservations():
+    """
+    Cancel the orders not confirmed until the end of the reservation and return their goods to the stock.
+
+    Returns:
+        int: The number of canceled orders.
+    """
+    return release_expired_orders()
+
+
+def publish_import_progress(task, task_id, progress, rows_done, chunks_done=0):
+    """
+    Publish the progress of a price list import in the meta of the task (state PROGRESS).
+
+    Args:
+        task (Task): The task publishing the progress.
+        task_id (str): The ID of the task whose state is updated.
+        progress (dict): 'started' timestamp, 'rows_total' and 'chunks_total' of the import.
+        rows_done (int): The number of imported goods.
+        chunks_done (int): The number of imported chunks.
+
+    Returns:
+        None
     """
-	Update partner information based on the provided stream data asynchronously using Celery tasks.
+    elapsed = max(time.time() - progress['started'], 1e-6)
+    rows_per_sec = rows_done / elapsed
+    task.update_state(task_id=task_id, state='PROGRESS', meta={
+        'chunks_done': chunks_done,
+        'chunks_total': progress['chunks_total'],
+        'rows_done': rows_done,
+        'rows_total': progress['rows_total'],
+        'rows_per_sec': round(rows_per_sec, 1),
+        'eta': round((progress['rows_total'] - rows_done) / rows_per_sec, 1) if rows_per_sec else None,
+    })
+
+
+# обновление данных партнера (асинхронно - через Celery)
+@shared_task(bind=True, max_retries=None)
+def partner_update(self, url, user_id):
+    """
+	Download the partner price list and update partner information asynchronously using Celery tasks.
+
+	Price lists longer than one chunk (settings.PRICE_LIST_IMPORT_CHUNK_SIZE goods) are imported
+	in parallel: the chunks are written to the task results storage one at a time and the task
+	is replaced by a chord of partner_update_chunk tasks (which receive the names of the chunk files)
+	with partner_update_finish as the callback. Progress is published in the task meta (state PROGRESS).
+
+	The download is conditional (If-None-Match/If-Modified-Since) and the SHA-256 digest of the price list
+	is compared with the previous one, so an unchanged price list does not touch the catalog.
 
 	Args:
-	- stream: The stream data containing partner information (price).
+	- url: The URL of the partner price list.
 	- user_id: The user ID associated with the partner.
 
 	Returns:
-	- None
+	- dict: The numbers of added, changed, removed and unchanged goods or {'status': 'unchanged'}.
     """
 
-    data = load_yaml(stream, Loader=Loader)
+    # валидаторы предыдущей загрузки используются, только если прайс-лист загружается с того же адреса
+    shop = Shop.objects.filter(user_id=user_id, url=url).first()
+    validators = (shop.price_list_etag, shop.price_list_last_modified) if shop else ()
+
+    # загрузка выполняется в воркере, а не в веб-запросе; число одновременных загрузок с одного хоста ограничено
+    try:
+        with host_slot(url):
+            price_list = fetch_price_list(url, *validators)
+    except HostBusy as error:
+        raise self.retry(exc=error, countdown=settings.PRICE_LIST_FETCH_RETRY_DELAY)
+
+    # прайс-лист не изменился с прошлой загрузки - БД не изменяется
+    if price_list.file is None or (shop and price_list.digest == shop.price_list_digest):
+        if price_list.file is not None:
+            price_list.file.close()
+        return {'status': 'unchanged'}
+    source = {'url': url, 'price_list_etag': price_list.etag, 'price_list_last_modified': price_list.last_modified,
+              'price_list_digest': price_list.digest}
+
+    with price_list.file as stream:
+        # товары читаются из YAML потоком и записываются в БД пакетами
+        data = read_price_list(stream)
+        chunks = iter_batches(data['goods'], settings.PRICE_LIST_IMPORT_CHUNK_SIZE)
+        head = list(islice(chunks, 2))
+        progress = {'started': time.time(), 'chunks_total': len(head), 'rows_total': sum(map(len, head))}
+
+        if len(head) < 2:
+            # прайс-лист не больше одного блока импортируется в текущей задаче
+            rows_done = 0
+
+            def on_batch(rows):
+                nonlocal rows_done
+                rows_done += rows
+                publish_import_progress(self, self.request.id, progress, rows_done)
+
+            data['goods'] = chain.from_iterable(head)
+            stats = import_price_list(data, user_id, progress=on_batch)
+            Shop.objects.filter(user_id=user_id).update(**source)
+            return stats
 
+        # блоки товаров записываются в хранилище результатов задач по одному и импортируются параллельно
+        # в разных воркерах: через брокер передаются только имена файлов
+        chunk_names, rows_total = [], 0
+        for index, chunk in enumerate(chain(head, chunks)):
+            chunk_names.append(save_import_chunk(self.request.id, index, chunk))
+            rows_total += len(chunk)
+
+    progress.update(chunks_total=len(chunk_names), rows_total=rows_total, task_id=self.request.id)
     shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=user_id)
-    for category in data['categories']:
-        category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-        category_object.shops.add(shop.id)
-        category_object.save()
-    ProductInfo.objects.filter(shop_id=shop.id).delete()
-    for item in data['goods']:
-        product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-
-        product_info = ProductInfo.objects.create(product_id=product.id,
-                                                              external_id=item['id'],
-                                                              model=item['model'],
-                                                              price=item['price'],
-                                                              price_rrc=item['price_rrc'],
-                                                              quantity=item['quantity'],
-                                                              shop_id=shop.id)
-        for name, value in item['parameters'].items():
-            parameter_object, _ = Parameter.objects.get_or_create(name=name)
-            ProductParameter.objects.create(product_info_id=product_info.id,
-                                                        parameter_id=parameter_object.id,
-                                                        value=value)
+    importer = PriceListImporter(shop)
+    importer.import_categories(data['categories'])
+    cache.set_many({f'price_list_import:{self.request.id}:rows': 0,
+                    f'price_list_import:{self.request.id}:chunks': 0}, timeout=24 * 60 * 60)
+
+    return self.replace(chord(
+        [partner_update_chunk.s(shop.id, chunk_name, progress) for chunk_name in chunk_names],
+        partner_update_finish.s(shop.id, list(importer.category_ids), chunk_names, progress, source)))
+
+
+# импорт блока товаров прайс-листа (часть параллельного импорта partner_update)
+@shared_task(bind=True)
+def partner_update_chunk(self, shop_id, chunk_name, progress):
+    """
+    Import a chunk of goods of a partner price list.
+
+    Args:
+        shop_id (int): The ID of the shop.
+        chunk_name (str): The name of the chunk file in the task results storage (see save_import_chunk).
+        progress (dict): The progress of the whole import (see publish_import_progress).
+
+    Returns:
+        dict: The numbers of added, changed and unchanged goods of the chunk.
+    """
+    rows = 0
+
+    def on_batch(batch_rows):
+        nonlocal rows
+        rows += batch_rows
+
+    importer = PriceListImporter(Shop.objects.get(id=shop_id), progress=on_batch)
+    stats = importer.import_goods(read_import_chunk(chunk_name))
+
+    rows_done = cache.incr(f'price_list_import:{progress["task_id"]}:rows', rows)
+    chunks_done = cache.incr(f'price_list_import:{progress["task_id"]}:chunks')
+    publish_import_progress(self, progress['task_id'], progress, rows_done, chunks_done)
+    return stats
+
+
+# завершение параллельного импорта прайс-листа
+@shared_task
+def partner_update_finish(results, shop_id, category_ids, chunk_names, progress, source):
+    """
+    Finish a parallel price list import: link categories to the shop and delete goods absent from the price list.
+
+    The external IDs of the price list are read back from the chunk files, which are deleted afterwards.
+
+    Args:
+        results (list): The stats returned by partner_update_chunk tasks.
+        shop_id (int): The ID of the shop.
+        category_ids (list): The IDs of the categories of the price list.
+        chunk_names (list): The names of the chunk files in the task results storage.
+        progress (dict): The progress of the whole import.
+        source (dict): The URL and validators of the price list to be saved in the shop.
+
+    Returns:
+        dict: The numbers of added, changed, removed and unchanged goods.
+    """
+    importer = PriceListImporter(Shop.objects.get(id=shop_id))
+    importer.category_ids = set(category_ids)
+    importer.seen = {item['id'] for chunk_name in chunk_names for item in read_import_chunk(chunk_name)}
+    importer.link_categories()
+    stats = importer.remove_missing()
+    for result in results:
+        for key, value in result.items():
+            stats[key] += value
+    Shop.objects.filter(id=shop_id).update(**source)
+    bump_catalog_version(shop_id)
+
+    for chunk_name in chunk_names:
+        get_storage().delete(chunk_name)
+    cache.delete_many([f'price_list_import:{progress["task_id"]}:rows',
+                       f'price_list_import:{progress["task_id"]}:chunks'])
+    return stats
+
+
+# ночная выгрузка каталога всех активных магазинов (периодическая задача celery beat)
+@shared_task(bind=True)
+def dump_catalog(self):
+    """
+    Dump the goods of all active shops into sharded gzip-compressed NDJSON files.
+
+    The shards (a shop or a range of its goods, see backend.dumps.plan_shards) are written
+    in parallel by dump_catalog_shard tasks; dump_catalog_finish writes the manifest
+    with the row counts and checksums of the shards.
+
+    Returns:
+        dict: The manifest of the dump.
+    """
+    dump_name = timezone.now().strftime('%Y%m%d-%H%M%S')
+    shards = plan_shards()
+    if not shards:
+        return dump_catalog_finish([], dump_name)
+
+    return self.replace(chord(
+        [dump_catalog_shard.s(dump_name, index, shard['shop_id'], shard['id_range'])
+         for index, shard in enumerate(shards)],
+        dump_catalog_finish.s(dump_name)))
+
+
+# выгрузка одного блока каталога (часть dump_catalog)
+@shared_task
+def dump_catalog_shard(dump_name, index, shop_id, id_range):
+    """
+    Write a shard of the catalog dump.
+
+    Args:
+        dump_name (str): The name (directory) of the dump.
+        index (int): The number of the shard.
+        shop_id (int): The ID of the shop.
+        id_range (list): The first and the last ID of the goods of the shard or None for all goods of the shop.
+
+    Returns:
+        dict: The description of the shard for the manifest.
+    """
+    return write_shard(dump_name, index, shop_id, id_range)
+
+
+# завершение выгрузки каталога
+@shared_task
+def dump_catalog_finish(shards, dump_name):
+    """
+    Write the manifest of the catalog dump and delete old dumps.
+
+    Args:
+        shards (list): The descriptions of the shards returned by dump_catalog_shard tasks.
+        dump_name (str): The name (directory) of the dump.
+
+    Returns:
+        dict: The manifest of the dump.
+    """
+    manifest = write_manifest(dump_name, shards)
+    cleanup_dumps()
+    return manifest
@@ -0,0 +1,150 @@
+import gzip
+import hashlib
+import json
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db.models import Count
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from backend.exporters import iter_goods
+from backend.models import Shop, ProductInfo
+
+# хранилище выгрузок каталога площадки (STORAGES['catalog_dumps'])
+STORAGE_ALIAS = 'catalog_dumps'
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def get_storage():
+    return storages[STORAGE_ALIAS]
+
+
+def plan_shards(shard_size=None):
+    """
+    Split the goods of all active shops into shards.
+
+    A shop with at most shard_size goods is one shard; the goods of a larger shop are split
+    into ranges of shard_size IDs (only the IDs are read, with a server-side cursor).
+
+    Args:
+        shard_size (int): The maximum number of goods in a shard (settings.CATALOG_DUMP_SHARD_SIZE by default).
+
+    Returns:
+        list: Shards as dicts with 'shop_id' and 'id_range' (the first and the last ID or None for the whole shop).
+    """
+    shard_size = shard_size or settings.CATALOG_DUMP_SHARD_SIZE
+    shards = []
+    shops = Shop.objects.filter(state=True).annotate(goods_count=Count('product_infos')).filter(
+        goods_count__gt=0).order_by('id').values_list('id', 'goods_count')
+    for shop_id, goods_count in shops:
+        if goods_count <= shard_size:
+            shards.append({'shop_id': shop_id, 'id_range': None})
+            continue
+        ids = ProductInfo.objects.filter(shop_id=shop_id).order_by('id').values_list('id', flat=True)
+        first_id = last_id = None
+        for index, product_info_id in enumerate(ids.iterator(chunk_size=settings.PARTNER_EXPORT_CHUNK_SIZE)):
+            if index % shard_size == 0:
+                if first_id is not None:
+                    shards.append({'shop_id': shop_id, 'id_range': [first_id, last_id]})
+                first_id = product_info_id
+            last_id = product_info_id
+        shards.append({'shop_id': shop_id, 'id_range': [first_id, last_id]})
+    return shards
+
+
+def write_shard(dump_name, index, shop_id, id_range=None):
+    """
+    Write a shard of the catalog dump as gzip-compressed NDJSON (one good per line).
+
+    The goods are read with a server-side cursor and compressed into a temporary file
+    before the file is saved to the storage.
+
+    Args:
+        dump_name (str): The name (directory) of the dump.
+        index (int): The number of the shard.
+        shop_id (int): The ID of the shop.
+        id_range (list): The first and the last ID of the goods of the shard.
+
+    Returns:
+        dict: The description of the shard for the manifest: 'file', 'shop_id', 'id_range',
+            'rows', 'size' and 'sha256' of the compressed file.
+    """
+    shop = Shop.objects.get(id=shop_id)
+    rows = 0
+    with tempfile.TemporaryFile() as fp:
+        with gzip.GzipFile(fileobj=fp, mode='wb') as gz:
+            for good in iter_goods(shop, id_range=id_range):
+                good = {'shop_id': shop.id, 'shop': shop.name, **good}
+                gz.write((json.dumps(good, ensure_ascii=False, cls=JSONEncoder) + '\n').encode('utf-8'))
+                rows += 1
+
+        fp.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: fp.read(64 * 1024), b''):
+            digest.update(chunk)
+        fp.seek(0)
+        name = get_storage().save(f'{dump_name}/shard-{index:05d}.ndjson.gz', File(fp))
+        size = get_storage().size(name)
+
+    return {'file': name.rpartition('/')[2], 'shop_id': shop_id, 'id_range': id_range,
+            'rows': rows, 'size': size, 'sha256': digest.hexdigest()}
+
+
+def write_manifest(dump_name, shards):
+    """
+    Write the manifest of the dump: the list of shards with their row counts and checksums.
+
+    Args:
+        dump_name (str): The name (directory) of the dump.
+        shards (list): The descriptions of the shards returned by write_shard.
+
+    Returns:
+        dict: The manifest.
+    """
+    manifest = {
+        'name': dump_name,
+        'created': timezone.now().isoformat(),
+        'rows': sum(shard['rows'] for shard in shards),
+        'shards': sorted(shards, key=lambda shard: shard['file']),
+    }
+    get_storage().save(f'{dump_name}/{MANIFEST_NAME}',
+                       ContentFile(json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')))
+    return manifest
+
+
+def cleanup_dumps(keep=None):
+    """
+    Delete dumps older than settings.CATALOG_DUMP_KEEP days.
+
+    Args:
+        keep (int): The number of days the dumps are kept.
+
+    Returns:
+        int: The number of deleted dumps.
+    """
+    storage = get_storage()
+    if not storage.exists(''):
+        return 0
+    expired = timezone.now() - timedelta(days=settings.CATALOG_DUMP_KEEP if keep is None else keep)
+    deleted = 0
+    for dump_name in storage.listdir('')[0]:
+        manifest = f'{dump_name}/{MANIFEST_NAME}'
+        # незавершенные выгрузки (без манифеста) удаляются по времени файлов
+        files = storage.listdir(dump_name)[1]
+        if not files:
+            continue
+        if storage.exists(manifest):
+            created = storage.get_modified_time(manifest)
+        else:
+            created = max(storage.get_modified_time(f'{dump_name}/{file_name}') for file_name in files)
+        if created < expired:
+            for file_name in files:
+                storage.delete(f'{dump_name}/{file_name}')
+            deleted += 1
+    return deleted
@@ -0,0 +1,301 @@
+import csv
+import io
+import json
+
+import yaml
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.utils.text import compress_sequence
+from rest_framework.utils.encoders import JSONEncoder
+
+from backend.models import Shop, ProductInfo, Parameter, ProductParameter
+from backend.serializers import CategorySerializer, PartnerProductInfoSerializer
+
+# выгрузка на основе libyaml (C), если PyYAML собран с ним, иначе - на чистом Python
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
+
+# форматы потоковой выгрузки: тип содержимого ответа
+EXPORT_CONTENT_TYPES = {
+    'yaml': 'application/yaml; charset=utf-8',
+    'json': 'application/json; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+# столбцы CSV перед столбцами параметров
+CSV_FIELDS = ('id', 'category', 'model', 'name', 'price', 'price_rrc', 'quantity')
+
+
+def export_goods_queryset():
+    """
+    Return the goods queryset with everything PartnerProductInfoSerializer reads
+    (product, category, parameters and their names) loaded by two queries.
+
+    Returns:
+        QuerySet: The ProductInfo queryset.
+    """
+    return ProductInfo.objects.select_related('product__category').prefetch_related(
+        Prefetch('product_parameters', queryset=ProductParameter.objects.select_related('parameter').order_by('id')))
+
+
+def export_shop_queryset():
+    """
+    Return the shops queryset for PartnerExportSerializer: the export of a shop takes
+    a fixed number of queries regardless of the size of its catalog.
+
+    Returns:
+        QuerySet: The Shop queryset.
+    """
+    return Shop.objects.prefetch_related('categories', Prefetch('product_infos', queryset=export_goods_queryset()))
+
+
+def iter_goods(shop, chunk_size=None, id_range=None):
+    """
+    Read the goods of the shop with a server-side cursor and serialize them one at a time.
+
+    Products, categories and parameters are loaded for every chunk of goods, so memory
+    depends on the chunk size and not on the size of the catalog.
+
+    Args:
+        shop (Shop): The shop to export.
+        chunk_size (int): The number of goods fetched from the cursor at a time.
+        id_range (tuple): The first and the last ID of the goods to export (all goods by default).
+
+    Returns:
+        generator: Serialized goods (dicts in the format of PartnerProductInfoSerializer).
+    """
+    queryset = export_goods_queryset().filter(shop_id=shop.id).order_by('id')
+    if id_range:
+        queryset = queryset.filter(id__range=id_range)
+    # поля сериализатора строятся один раз на всю выгрузку, а не для каждой позиции
+    serializer = PartnerProductInfoSerializer()
+    for product_info in queryset.iterator(chunk_size=chunk_size or settings.PARTNER_EXPORT_CHUNK_SIZE):
+        yield serializer.to_representation(product_info)
+
+
+def _header(shop):
+    return {
+        'shop': shop.name,
+        'categories': [dict(category) for category in CategorySerializer(shop.categories.all(), many=True).data],
+    }
+
+
+def _dump_yaml(data):
+    return yaml.dump(data, Dumper=SafeDumper, allow_unicode=True, sort_keys=False)
+
+
+def iter_yaml_export(shop, chunk_size=None):
+    """
+    Render the price list of the shop as a YAML document piece by piece.
+
+    Args:
+        shop (Shop): The shop to export.
+        chunk_size (int): The number of goods fetched from the cursor at a time.
+
+    Returns:
+        generator: Parts of the YAML document (str).
+    """
+    yield _dump_yaml(_header(shop))
+    yield 'goods:\n'
+    empty = True
+    for good in iter_goods(shop, chunk_size):
+        empty = False
+        yield _dump_yaml([dict(good)])
+    if empty:
+        yield '  []\n'
+
+
+def iter_json_export(shop, chunk_size=None):
+    """
+    Render the price list of the shop as a JSON document piece by piece.
+
+    Args:
+        shop (Shop): The shop to export.
+        chunk_size (int): The number of goods fetched from the cursor at a time.
+
+    Returns:
+        generator: Parts of the JSON document (str).
+    """
+    header = json.dumps(_header(shop), ensure_ascii=False, cls=JSONEncoder)
+    yield header[:-1] + ', "goods": ['
+    separator = ''
+    for good in iter_goods(shop, chunk_size):
+        yield separator + json.dumps(good, ensure_ascii=False, cls=JSONEncoder)
+        separator = ', '
+    yield ']}'
+
+
+def iter_ndjson_export(shop, chunk_size=None):
+    """
+    Render the goods of the shop as newline delimited JSON (one good per line).
+
+    Args:
+        shop (Shop): The shop to export.
+        chunk_size (int): The number of goods fetched from the cursor at a time.
+
+    Returns:
+        generator: Lines of the document (str).
+    """
+    for good in iter_goods(shop, chunk_size):
+        yield json.dumps(good, ensure_ascii=False, cls=JSONEncoder) + '\n'
+
+
+def iter_csv_export(shop, chunk_size=None):
+    """
+    Render the goods of the shop as CSV with one column per parameter.
+
+    The parameter columns are read by one query before the goods, so the goods are still
+    rendered in a single pass.
+
+    Args:
+        shop (Shop): The shop to export.
+        chunk_size (int): The number of goods fetched from the cursor at a time.
+
+    Returns:
+        generator: Lines of the document (str).
+    """
+    parameters = list(Parameter.objects.filter(product_parameters__product_info__shop_id=shop.id).distinct().order_by(
+        'name').values_list('name', flat=True))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def row(values):
+        writer.writerow(values)
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    yield row(CSV_FIELDS + tuple(parameters))
+    for good in iter_goods(shop, chunk_size):
+        values = {name: value for parameter in good['parameters'] for name, value in parameter.items()}
+        yield row([good[field] for field in CSV_FIELDS] + [values.get(name, '') for name in parameters])
+
+
+EXPORTERS = {
+    'yaml': iter_yaml_export,
+    'json': iter_json_export,
+    'ndjson': iter_ndjson_export,
+    'csv': iter_csv_export,
+}
+
+
+def iter_export(shop, export_format='yaml', chunk_size=None):
+    """
+    Render the price list of the shop in the given format piece by piece.
+
+    Args:
+        shop (Shop): The shop to export.
+        export_format (str): 'yaml', 'json', 'ndjson' or 'csv'.
+        chunk_size (int): The number of goods fetched from the cursor at a time.
+
+    Returns:
+        generator: Parts of the document (str).
+    """
+    return EXPORTERS[export_format](shop, chunk_size)
+
+
+def iter_encoded_export(shop, export_format='yaml', compress=False, chunk_size=None):
+    """
+    Render the price list of the shop in the given format as UTF-8 bytes, optionally compressed with gzip.
+
+    Args:
+        shop (Shop): The shop to export.
+        export_format (str): 'yaml', 'json', 'ndjson' or 'csv'.
+        compress (bool): Compress the document with gzip.
+        chunk_size (int): The number of goods fetched from the cursor at a time.
+
+    Returns:
+        generator: Parts of the document (bytes).
+    """
+    parts = (part.encode('utf-8') for part in iter_export(shop, export_format, chunk_size))
+    return compress_sequence(parts) if compress else parts
+
+
+def export_variant(export_format, compress=False):
+    return f'{export_format}-gzip' if compress else export_format
+
+
+def export_cache_key(shop, export_format, compress=False):
+    return f'partner_export:{shop.id}:{shop.catalog_version}:{export_variant(export_format, compress)}'
+
+
+def export_etag(shop, export_format, compress=False):
+    return f'"{shop.id}-{shop.catalog_version}-{export_variant(export_format, compress)}"'
+
+
+def get_cached_export(shop, export_format, compress=False):
+    """
+    Return the rendered export of the current catalog version of the shop from the cache.
+
+    Args:
+        shop (Shop): The shop to export.
+        export_format (str): 'yaml', 'json', 'ndjson' or 'csv'.
+        compress (bool): Return the document compressed with gzip.
+
+    Returns:
+        bytes: The rendered document or None if it is not cached.
+    """
+    return cache.get(export_cache_key(shop, export_format, compress))
+
+
+def iter_cached_export(shop, export_format='yaml', compress=False, chunk_size=None):
+    """
+    Render the export piece by piece and put it in the cache once it is complete.
+
+    Documents larger than settings.PARTNER_EXPORT_CACHE_MAX_SIZE are streamed without caching,
+    so the memory used by the export stays bounded.
+
+    Args:
+        shop (Shop): The shop to export.
+        export_format (str): 'yaml', 'json', 'ndjson' or 'csv'.
+        compress (bool): Compress the document with gzip.
+        chunk_size (int): The number of goods fetched from the cursor at a time.
+
+    Returns:
+        generator: Parts of the document (bytes).
+    """
+    parts, size = [], 0
+    for data in iter_encoded_export(shop, export_format, compress, chunk_size):
+        if parts is not None:
+            size += len(data)
+            if size > settings.PARTNER_EXPORT_CACHE_MAX_SIZE:
+                parts = None
+            else:
+                parts.append(data)
+        yield data
+    # ключ содержит версию каталога: устаревшие выгрузки не инвалидируются, а вытесняются по таймауту
+    if parts is not None:
+        cache.set(export_cache_key(shop, export_format, compress), b''.join(parts),
+                  timeout=settings.PARTNER_EXPORT_CACHE_TIMEOUT)
+
+
+def write_export(shop, fp, export_format='yaml', chunk_size=None):
+    """
+    Write the price list of the shop to a binary file without building it in memory.
+
+    The export shares the cache of the streaming export (see iter_cached_export): a cached document
+    of the current catalog version is copied to the file, otherwise the rendered document is cached.
+
+    Args:
+        shop (Shop): The shop to export.
+        fp (file): The file opened for writing in binary mode.
+        export_format (str): 'yaml', 'json', 'ndjson' or 'csv'.
+        chunk_size (int): The number of goods fetched from the cursor at a time.
+
+    Returns:
+        int: The number of written bytes.
+    """
+    content = get_cached_export(shop, export_format)
+    if content is not None:
+        fp.write(content)
+        return len(content)
+    size = 0
+    for data in iter_cached_export(shop, export_format, chunk_size=chunk_size):
+        fp.write(data)
+        size += len(data)
+    return size
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class ExtensionsConfig(AppConfig):
+    """
+    Расширения PostgreSQL, которые нужны приложению backend: миграции backend создаются makemigrations
+    и не хранятся в репозитории, поэтому расширения и зависящие от них индексы создаются миграциями этого приложения.
+    """
+    name = 'backend.extensions'
+    label = 'extensions'
@@ -0,0 +1,23 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # расширение pg_trgm и индекс похожих названий (поиск при опечатках, backend.search).
+    # Роли, выполняющей migrate, нужно право CREATE на базу данных (pg_trgm - доверенное расширение
+    # начиная с PostgreSQL 13) или расширение должно быть заранее создано суперпользователем:
+    # TrigramExtension пропускает уже установленное расширение.
+
+    initial = True
+
+    dependencies = [
+        ('backend', '__first__'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS catalog_entry_name_trgm ON backend_catalogentry USING gin (name gin_trgm_ops)',
+            'DROP INDEX IF EXISTS catalog_entry_name_trgm',
+        ),
+    ]
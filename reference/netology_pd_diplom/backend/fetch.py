@@ -0,0 +1,174 @@
+import hashlib
+from collections import namedtuple
+from contextlib import contextmanager
+from tempfile import SpooledTemporaryFile
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from requests import Session, RequestException
+from requests.adapters import HTTPAdapter
+
+from backend.util import get_redis
+
+
+class PriceListFetchError(Exception):
+    """
+    The price list could not be downloaded.
+    """
+
+
+class HostBusy(Exception):
+    """
+    Too many price lists are being downloaded from the host at the moment.
+    """
+
+
+# результат загрузки прайс-листа: file - None, если сервер ответил 304 Not Modified
+FetchResult = namedtuple('FetchResult', ('file', 'etag', 'last_modified', 'digest'))
+
+_session = None
+
+# захват слота одной командой Redis: счетчик, срок его жизни и проверка лимита атомарны
+_ACQUIRE_SCRIPT = """
+local value = redis.call('INCR', KEYS[1])
+if value == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+if value > tonumber(ARGV[2]) then
+    redis.call('DECR', KEYS[1])
+    return 0
+end
+return value
+"""
+
+# освобождение слота не создает заново истекший счетчик
+_RELEASE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('DECR', KEYS[1])
+end
+return 0
+"""
+
+
+def get_session():
+    """
+    Return the HTTP session of the current process (connections are pooled and reused).
+
+    Returns:
+        Session: The requests session.
+    """
+    global _session
+    if _session is None:
+        _session = Session()
+        adapter = HTTPAdapter(pool_connections=settings.PRICE_LIST_FETCH_POOL_SIZE,
+                              pool_maxsize=settings.PRICE_LIST_FETCH_POOL_SIZE)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def _acquire_slot(key, limit, timeout):
+    if settings.PRICE_LIST_FETCH_REDIS:
+        return get_redis(settings.PRICE_LIST_FETCH_REDIS).eval(_ACQUIRE_SCRIPT, 1, key, timeout, limit) > 0
+    # без Redis - счетчик в кэше Django (общий для воркеров, только если общий и кэш)
+    cache = caches[DEFAULT_CACHE_ALIAS]
+    cache.add(key, 0, timeout=timeout)
+    if cache.incr(key) > limit:
+        cache.decr(key)
+        return False
+    return True
+
+
+def _release_slot(key):
+    if settings.PRICE_LIST_FETCH_REDIS:
+        get_redis(settings.PRICE_LIST_FETCH_REDIS).eval(_RELEASE_SCRIPT, 1, key)
+        return
+    try:
+        caches[DEFAULT_CACHE_ALIAS].decr(key)
+    except ValueError:
+        pass
+
+
+@contextmanager
+def host_slot(url):
+    """
+    Limit the number of simultaneous downloads from one host across all workers.
+
+    The counters are kept in Redis (settings.PRICE_LIST_FETCH_REDIS), so the limit is shared
+    by all worker processes; a slot is taken by one Lua script (INCR, EXPIRE and the limit check
+    are atomic). Without Redis the counters are kept in the Django cache.
+
+    Args:
+        url (str): The URL to be downloaded.
+
+    Raises:
+        HostBusy: If the limit for the host is reached.
+    """
+    host = urlsplit(url).hostname
+    key = f'price_list_fetch:{host}'
+    # счетчик живет не дольше максимального времени загрузки, если воркер упадет, не освободив слот
+    timeout = int(sum(settings.PRICE_LIST_FETCH_TIMEOUT) * 10)
+    if not _acquire_slot(key, settings.PRICE_LIST_FETCH_HOST_CONCURRENCY, timeout):
+        raise HostBusy(host)
+    try:
+        yield
+    finally:
+        _release_slot(key)
+
+
+def fetch_price_list(url, etag=None, last_modified=None):
+    """
+    Download a price list into a temporary file.
+
+    The download uses the pooled session with connect/read timeouts and is aborted as soon as
+    the size of the file exceeds settings.PRICE_LIST_MAX_SIZE. The request is conditional
+    if the validators of the previous download are given.
+
+    Args:
+        url (str): The URL of the price list.
+        etag (str): The ETag of the previous download.
+        last_modified (str): The Last-Modified of the previous download.
+
+    Returns:
+        FetchResult: The downloaded price list positioned at the beginning (None if not modified),
+            its ETag, Last-Modified and SHA-256 digest.
+
+    Raises:
+        PriceListFetchError: If the price list can not be downloaded or is too large.
+    """
+    max_size = settings.PRICE_LIST_MAX_SIZE
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    fp = None
+    try:
+        with get_session().get(url, headers=headers, stream=True,
+                               timeout=settings.PRICE_LIST_FETCH_TIMEOUT) as response:
+            if response.status_code == 304:
+                return FetchResult(None, etag, last_modified, None)
+            response.raise_for_status()
+            if int(response.headers.get('Content-Length') or 0) > max_size:
+                raise PriceListFetchError(f'Размер прайс-листа превышает {max_size} байт')
+
+            fp = SpooledTemporaryFile(max_size=settings.PRICE_LIST_SPOOL_SIZE)
+            digest = hashlib.sha256()
+            size = 0
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if size > max_size:
+                    fp.close()
+                    raise PriceListFetchError(f'Размер прайс-листа превышает {max_size} байт')
+                digest.update(chunk)
+                fp.write(chunk)
+    except RequestException as error:
+        # соединение оборвалось во время чтения - временный файл удаляется
+        if fp is not None:
+            fp.close()
+        raise PriceListFetchError(f'Не удалось загрузить прайс-лист: {error}') from error
+
+    fp.seek(0)
+    return FetchResult(fp, response.headers.get('ETag', ''), response.headers.get('Last-Modified', ''),
+                       digest.hexdigest())
@@ -0,0 +1,118 @@
+import re
+
+from django.conf import settings
+from django.db.models import Count, Exists, OuterRef
+from rest_framework.exceptions import ValidationError
+
+from backend.models import Parameter, ProductParameter
+from backend.util import parse_number, strtobool
+
+# param[Цвет]=красный, param[Диагональ (дюйм)]__gte=6
+PARAMETER_FILTER_RE = re.compile(r'^param\[(?P<name>.+)\](?:__(?P<lookup>gte|lte|gt|lt))?$')
+
+
+def parse_parameter_filters(query_params):
+    """
+    Collect the product parameter filters from the query parameters.
+
+    param[name]=value selects goods with one of the given values of the parameter (the parameter
+    may be repeated); param[name]__gte (gt, lte, lt) compares the numeric value of the parameter.
+
+    Args:
+        query_params (QueryDict): The query parameters of the request.
+
+    Returns:
+        list: (name, lookup, values) tuples, lookup is None for the value filter.
+    """
+    filters = []
+    for key in query_params:
+        match = PARAMETER_FILTER_RE.match(key)
+        if not match:
+            continue
+        name, lookup = match.group('name'), match.group('lookup')
+        values = query_params.getlist(key)
+        if lookup:
+            number = parse_number(values[-1])
+            if number is None:
+                raise ValidationError({key: 'Ожидается число'})
+            values = number
+        filters.append((name, lookup, values))
+    return filters
+
+
+def filter_by_parameters(queryset, filters):
+    """
+    Filter product infos by the values of their parameters (all filters must match).
+
+    Args:
+        queryset (QuerySet): Product infos.
+        filters (list): The filters returned by parse_parameter_filters.
+
+    Returns:
+        QuerySet: The filtered product infos.
+    """
+    if not filters:
+        return queryset
+    parameter_ids = dict(Parameter.objects.filter(name__in={name for name, _, _ in filters}).values_list('name', 'id'))
+    for name, lookup, values in filters:
+        if name not in parameter_ids:
+            return queryset.none()
+        condition = {f'value_number__{lookup}': values} if lookup else {'value__in': values}
+        queryset = queryset.filter(Exists(ProductParameter.objects.filter(
+            product_info_id=OuterRef('pk'), parameter_id=parameter_ids[name], **condition)))
+    return queryset
+
+
+def get_facets(queryset, limit=None):
+    """
+    Count the values of the parameters of the given product infos with one aggregate query.
+
+    Args:
+        queryset (QuerySet): Product infos (the current result set).
+        limit (int): The maximum number of the most frequent values per parameter.
+
+    Returns:
+        dict: {parameter name: {value: number of goods}}, values ordered by the number of goods.
+    """
+    limit = limit or settings.PRODUCT_FACET_VALUES_LIMIT
+    counts = ProductParameter.objects.filter(
+        product_info_id__in=queryset.order_by().values('pk')).values(
+        'parameter__name', 'value').annotate(count=Count('product_info_id')).order_by(
+        'parameter__name', '-count', 'value')
+    facets = {}
+    for row in counts:
+        values = facets.setdefault(row['parameter__name'], {})
+        if len(values) < limit:
+            values[row['value']] = row['count']
+    return facets
+
+
+def filter_by_offer(queryset, query_params):
+    """
+    Filter product infos by the price range and availability.
+
+    Args:
+        queryset (QuerySet): Product infos.
+        query_params (QueryDict): The query parameters: price__gte, price__lte and in_stock.
+
+    Returns:
+        QuerySet: The filtered product infos.
+    """
+    for key in ('price__gte', 'price__lte'):
+        value = query_params.get(key)
+        if not value:
+            continue
+        try:
+            queryset = queryset.filter(**{key: int(value)})
+        except ValueError:
+            raise ValidationError({key: 'Ожидается целое число'})
+    in_stock = query_params.get('in_stock')
+    if in_stock:
+        try:
+            in_stock = strtobool(in_stock)
+        except ValueError:
+            raise ValidationError({'in_stock': 'Ожидается true или false'})
+        if in_stock:
+            # условие частичного индекса product_info_in_stock_price
+            queryset = queryset.filter(quantity__gt=0)
+    return queryset
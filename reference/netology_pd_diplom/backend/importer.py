@@ -0,0 +1,351 @@
+from functools import partial
+
+from cacheops import invalidate_obj
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from backend import lookups, catalog, response_cache
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter
+from backend.util import parse_number
+
+
+def iter_batches(items, batch_size):
+    """
+    Split an iterable into lists of at most batch_size elements.
+
+    Args:
+        items (iterable): The source items.
+        batch_size (int): The maximum size of a batch.
+
+    Returns:
+        generator: Lists of items.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class PriceListImporter:
+    """
+    Пакетная синхронизация прайс-листа партнера с каталогом магазина.
+
+    Категории, товары и параметры разрешаются в словари "имя -> id" в памяти; соответствия,
+    найденные при предыдущих импортах в этом процессе, берутся из кэша backend.lookups без запросов к БД.
+    Товары прайс-листа сравниваются с сохраненными позициями магазина по external_id:
+    новые позиции создаются, измененные обновляются, отсутствующие в прайс-листе удаляются,
+    поэтому число записей в БД пропорционально числу изменений, а не размеру каталога.
+    Число запросов к БД на один пакет товаров не зависит от его размера.
+    Записи каталога (backend.catalog) новых и измененных позиций обновляются в том же пакете,
+    поисковые документы пересчитываются только при изменении названия, модели или параметров.
+
+    Methods:
+    - import_categories: Create or update categories.
+    - link_categories: Link the imported categories to the shop.
+    - import_goods: Synchronize goods in batches.
+    - remove_missing: Delete goods of the shop absent from the price list.
+
+    Attributes:
+    - shop: The shop the price list belongs to.
+    - batch_size: The number of goods written per batch.
+    - progress: A callable called with the number of goods after every batch.
+    - products: (name, category_id) -> product id map.
+    - parameters: parameter name -> parameter id map.
+    - seen: external ids of the goods from the price list.
+    - stats: added, changed, removed and unchanged counters.
+    """
+
+    # поля позиции, изменение которых приводит к обновлению записи
+    compared_fields = ('product_id', 'model', 'price', 'price_rrc', 'quantity')
+    # поля позиции, входящие в поисковый документ
+    search_fields = {'product_id', 'model'}
+
+    def __init__(self, shop, batch_size=None, progress=None):
+        self.shop = shop
+        self.batch_size = batch_size or settings.PRICE_LIST_IMPORT_BATCH_SIZE
+        self.progress = progress
+        self.products = {}
+        self.parameters = {}
+        self.category_ids = set()
+        self.seen = set()
+        self.stats = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+
+    def import_categories(self, categories):
+        """
+        Create or update categories (category links are created by link_categories).
+
+        Args:
+            categories (list): A list of dicts with 'id' and 'name' keys.
+
+        Returns:
+            None
+        """
+        categories = {category['id']: category['name'] for category in categories}
+        if not categories:
+            return
+        lookups.refresh()
+        self.category_ids.update(categories)
+        # записываются только новые и переименованные категории
+        cached = lookups.categories.get_many(categories)
+        changed = {category_id: name for category_id, name in categories.items() if cached.get(category_id) != name}
+        if not changed:
+            return
+        Category.objects.bulk_create(
+            [Category(id=category_id, name=name) for category_id, name in changed.items()],
+            update_conflicts=True, unique_fields=['id'], update_fields=['name'])
+        # название категории входит в документы каталога и в выгрузки всех магазинов с этой категорией
+        catalog.refresh_category_names(changed)
+        bump_export_versions(Shop.objects.filter(categories__in=changed).exclude(id=self.shop.id))
+        transaction.on_commit(partial(lookups.categories.set_many, changed))
+
+    def link_categories(self):
+        """
+        Link the imported categories to the shop.
+
+        Returns:
+            None
+        """
+        Category.shops.through.objects.bulk_create(
+            [Category.shops.through(category_id=category_id, shop_id=self.shop.id)
+             for category_id in self.category_ids],
+            ignore_conflicts=True)
+
+    def import_goods(self, goods):
+        """
+        Synchronize goods in batches of self.batch_size items.
+
+        Args:
+            goods (iterable): Goods from the price list.
+
+        Returns:
+            dict: The stats of the import.
+        """
+        for batch in iter_batches(goods, self.batch_size):
+            with transaction.atomic():
+                self._import_batch(batch)
+            if self.progress:
+                self.progress(len(batch))
+        return self.stats
+
+    def remove_missing(self):
+        """
+        Delete goods of the shop whose external ids were not present in the price list.
+
+        Returns:
+            dict: The stats of the import.
+        """
+        removed_ids = [product_info_id for product_info_id, external_id in
+                       ProductInfo.objects.filter(shop_id=self.shop.id).values_list('id', 'external_id').iterator()
+                       if external_id not in self.seen]
+        for batch in iter_batches(removed_ids, self.batch_size):
+            ProductInfo.objects.filter(id__in=batch).delete()
+        self.stats['removed'] += len(removed_ids)
+        return self.stats
+
+    def _resolve_products(self, batch):
+        """
+        Fill self.products for all goods of the batch.
+
+        Missing products are inserted with ON CONFLICT DO NOTHING (unique_product) and selected again,
+        so chunks imported in parallel do not create duplicates.
+        """
+        missing = {(item['name'], item['category']) for item in batch} - self.products.keys()
+        if not missing:
+            return
+        cached = lookups.products.get_many(missing)
+        self.products.update(cached)
+        missing -= cached.keys()
+        if not missing:
+            return
+
+        existing = self._select_products(missing)
+        self.products.update(existing)
+        lookups.products.set_many(existing)
+        missing -= existing.keys()
+        if not missing:
+            return
+        # строки вставляются в одном порядке во всех транзакциях, чтобы ожидания на уникальном индексе
+        # не приводили к взаимоблокировкам
+        Product.objects.bulk_create([Product(name=name, category_id=category_id)
+                                     for name, category_id in sorted(missing)], ignore_conflicts=True)
+        created = self._select_products(missing)
+        self.products.update(created)
+        # новые товары попадают в кэш процесса только после фиксации транзакции
+        transaction.on_commit(partial(lookups.products.set_many, created))
+
+    @staticmethod
+    def _select_products(keys):
+        return {(name, category_id): product_id for name, category_id, product_id in Product.objects.filter(
+            name__in={name for name, _ in keys},
+            category_id__in={category_id for _, category_id in keys}).values_list('name', 'category_id', 'id')
+            if (name, category_id) in keys}
+
+    def _resolve_parameters(self, batch):
+        """
+        Fill self.parameters for all parameter names of the batch
+        (missing parameters are inserted with ON CONFLICT DO NOTHING and selected again).
+        """
+        missing = {name for item in batch for name in item['parameters']} - self.parameters.keys()
+        if not missing:
+            return
+        cached = lookups.parameters.get_many(missing)
+        self.parameters.update(cached)
+        missing -= cached.keys()
+        if not missing:
+            return
+
+        existing = dict(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+        self.parameters.update(existing)
+        lookups.parameters.set_many(existing)
+        missing -= existing.keys()
+        if not missing:
+            return
+        Parameter.objects.bulk_create([Parameter(name=name) for name in sorted(missing)], ignore_conflicts=True)
+        created = dict(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+        self.parameters.update(created)
+        transaction.on_commit(partial(lookups.parameters.set_many, created))
+
+    def _import_batch(self, batch):
+        # товар, повторяющийся в прайс-листе, записывается один раз (действует последнее вхождение)
+        batch = list({item['id']: item for item in batch}.values())
+        lookups.refresh()
+        self._resolve_products(batch)
+        self._resolve_parameters(batch)
+
+        # сохраненные позиции и их параметры для товаров пакета
+        stored = {product_info.external_id: product_info for product_info in ProductInfo.objects.filter(
+            shop_id=self.shop.id, external_id__in=[item['id'] for item in batch]).only('id', 'external_id',
+                                                                                        *self.compared_fields)}
+        stored_parameters = {}
+        for product_parameter in ProductParameter.objects.filter(
+                product_info_id__in=[product_info.id for product_info in stored.values()]).only(
+                'id', 'product_info_id', 'parameter_id', 'value'):
+            stored_parameters.setdefault(product_parameter.product_info_id, {})[product_parameter.parameter_id] = \
+                product_parameter
+
+        new_items, new_infos = [], []
+        changed_infos, changed_fields = [], set()
+        # позиции, записи каталога и поисковые документы которых нужно обновить
+        updated, reindexed = [], []
+        upserted_parameters, deleted_parameters = [], []
+        for item in batch:
+            self.seen.add(item['id'])
+            values = {'product_id': self.products[(item['name'], item['category'])],
+                      'model': item['model'],
+                      'price': item['price'],
+                      'price_rrc': item['price_rrc'],
+                      'quantity': item['quantity']}
+            parameters = {self.parameters[name]: str(value) for name, value in item['parameters'].items()}
+
+            product_info = stored.get(item['id'])
+            if product_info is None:
+                new_items.append(parameters)
+                new_infos.append(ProductInfo(external_id=item['id'], shop_id=self.shop.id, **values))
+                continue
+
+            fields = [field for field, value in values.items() if getattr(product_info, field) != value]
+            for field in fields:
+                setattr(product_info, field, values[field])
+
+            current = stored_parameters.get(product_info.id, {})
+            upserts = [ProductParameter(product_info_id=product_info.id, parameter_id=parameter_id, value=value,
+                                        value_number=parse_number(value))
+                       for parameter_id, value in parameters.items()
+                       if parameter_id not in current or current[parameter_id].value != value]
+            deletes = [product_parameter.id for parameter_id, product_parameter in current.items()
+                       if parameter_id not in parameters]
+
+            if fields or upserts or deletes:
+                self.stats['changed'] += 1
+                updated.append(product_info.id)
+                if upserts or deletes or self.search_fields.intersection(fields):
+                    reindexed.append(product_info.id)
+                if fields:
+                    changed_infos.append(product_info)
+                    changed_fields.update(fields)
+                upserted_parameters.extend(upserts)
+                deleted_parameters.extend(deletes)
+            else:
+                self.stats['unchanged'] += 1
+
+        for parameters, product_info in zip(new_items, ProductInfo.objects.bulk_create(new_infos)):
+            updated.append(product_info.id)
+            reindexed.append(product_info.id)
+            upserted_parameters.extend(
+                ProductParameter(product_info_id=product_info.id, parameter_id=parameter_id, value=value,
+                                 value_number=parse_number(value))
+                for parameter_id, value in parameters.items())
+        self.stats['added'] += len(new_infos)
+
+        if changed_infos:
+            ProductInfo.objects.bulk_update(changed_infos, sorted(changed_fields))
+            # bulk_update не вызывает инвалидацию cacheops
+            for product_info in changed_infos:
+                invalidate_obj(product_info)
+        if deleted_parameters:
+            ProductParameter.objects.filter(id__in=deleted_parameters).delete()
+        if upserted_parameters:
+            ProductParameter.objects.bulk_create(
+                upserted_parameters,
+                update_conflicts=True, unique_fields=['product_info', 'parameter'],
+                update_fields=['value', 'value_number'])
+        if updated:
+            catalog.update_entries(updated, search_ids=reindexed)
+
+
+def bump_catalog_version(shop_id):
+    """
+    Increase the catalog version of the shop (cached exports of the previous version become stale)
+    and the version of the cached catalog responses.
+
+    Args:
+        shop_id (int): The ID of the shop.
+
+    Returns:
+        None
+    """
+    Shop.objects.filter(id=shop_id).update(catalog_version=F('catalog_version') + 1)
+    response_cache.bump_version()
+
+
+def bump_export_versions(shops):
+    """
+    Increase the catalog versions of the shops whose exports contain a renamed shop, category,
+    product or parameter, or a changed stock (the cached exports of the previous versions become stale).
+
+    Args:
+        shops (QuerySet): The shops.
+
+    Returns:
+        int: The number of updated shops.
+    """
+    return Shop.objects.filter(id__in=shops.values('id')).update(catalog_version=F('catalog_version') + 1)
+
+
+def import_price_list(data, user_id, batch_size=None, progress=None):
+    """
+    Synchronize a parsed partner price list with the goods of the shop.
+
+    Args:
+        data (dict): The price list with 'shop', 'categories' and 'goods' keys
+            ('goods' may be a generator, see backend.price_list.read_price_list).
+        user_id (int): The user ID associated with the partner.
+        batch_size (int): The number of goods written per batch.
+        progress (callable): Called with the number of goods after every batch.
+
+    Returns:
+        dict: The numbers of added, changed, removed and unchanged goods.
+    """
+    shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=user_id)
+    importer = PriceListImporter(shop, batch_size=batch_size, progress=progress)
+    importer.import_categories(data['categories'])
+    importer.import_goods(data['goods'])
+    importer.link_categories()
+    stats = importer.remove_missing()
+    bump_catalog_version(shop.id)
+    return stats
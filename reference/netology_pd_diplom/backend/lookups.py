@@ -0,0 +1,150 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+# номер поколения справочников в общем кэше: увеличивается при изменении таблиц,
+# процессы сравнивают его со своим и сбрасывают локальные кэши
+GENERATION_KEY = 'lookups:generation'
+
+
+class LookupCache:
+    """
+    Кэш соответствий "ключ -> id" справочника в памяти процесса с вытеснением давно не использованных записей (LRU).
+
+    Methods:
+    - get_many: Return the cached values of the given keys.
+    - set_many: Store values in the cache.
+    - clear: Drop all cached values.
+    - stats: Return the hit-rate counters.
+
+    Attributes:
+    - name: The name of the cache.
+    - maxsize: The maximum number of cached keys.
+    - hits: The number of keys found in the cache.
+    - misses: The number of keys not found in the cache.
+    """
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        """
+        Return the cached values of the given keys.
+
+        Args:
+            keys (iterable): The keys to look up.
+
+        Returns:
+            dict: The found keys and their values.
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    found[key] = self._data[key]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def set_many(self, mapping):
+        """
+        Store values in the cache evicting the least recently used keys.
+
+        Args:
+            mapping (dict): The keys and their values.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            for key, value in mapping.items():
+                self._data[key] = value
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        Return the hit-rate counters of the cache.
+
+        Returns:
+            dict: The size of the cache, the numbers of hits and misses and the hit rate.
+        """
+        total = self.hits + self.misses
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
+
+    def __len__(self):
+        return len(self._data)
+
+
+# id категории -> название
+categories = LookupCache('categories', settings.LOOKUP_CACHE_SIZE)
+# название параметра -> id
+parameters = LookupCache('parameters', settings.LOOKUP_CACHE_SIZE)
+# (название товара, id категории) -> id товара
+products = LookupCache('products', settings.LOOKUP_CACHE_SIZE)
+
+CACHES = (categories, parameters, products)
+
+_generation = None
+
+
+def clear():
+    """
+    Drop the cached values of all lookups in the current process.
+    """
+    for lookup in CACHES:
+        lookup.clear()
+
+
+def refresh():
+    """
+    Drop the local lookups if the tables were changed by another process.
+
+    Returns:
+        None
+    """
+    global _generation
+    generation = cache.get(GENERATION_KEY, 0)
+    if generation != _generation:
+        clear()
+        _generation = generation
+
+
+def invalidate():
+    """
+    Drop the lookups in all processes (called when categories, parameters or products are changed or deleted).
+
+    Returns:
+        None
+    """
+    clear()
+    if not cache.add(GENERATION_KEY, 1, timeout=None):
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.add(GENERATION_KEY, 1, timeout=None)
+
+
+def stats():
+    """
+    Return the hit-rate counters of all lookups of the current process.
+
+    Returns:
+        dict: The counters by lookup name.
+    """
+    return {lookup.name: lookup.stats() for lookup in CACHES}
@@ -0,0 +1,99 @@
+import glob
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+# модуль загружается в процессе-воркере (spawn) до django.setup(), поэтому модули с моделями
+# (backend.importer) импортируются в load_file
+from backend import lookups
+from backend.price_list import read_price_list
+
+
+def init_worker(databases):
+    """
+    Set up Django in a worker process (every worker opens its own DB connection).
+
+    Args:
+        databases (dict): The DATABASES setting of the parent process (it may differ from the settings module,
+            e.g. the test database).
+    """
+    import django
+    settings.DATABASES = databases
+    django.setup()
+
+
+def load_file(path):
+    """
+    Import one price list file with the same code as partner_update.
+
+    Args:
+        path (str): The path of the YAML file.
+
+    Returns:
+        tuple: The path, the stats of the import (or None), the error message (or None), the time in seconds
+            and the hit-rate counters of the lookups of the process.
+    """
+    from backend.importer import import_price_list
+
+    started = time.perf_counter()
+    try:
+        with open(path, 'rb') as stream:
+            stats = import_price_list(read_price_list(stream), None)
+    except Exception as error:
+        return path, None, str(error), time.perf_counter() - started, lookups.stats()
+    return path, stats, None, time.perf_counter() - started, lookups.stats()
+
+
+class Command(BaseCommand):
+    help = 'Загрузить прайс-листы магазинов (YAML) из каталога или по маске в параллельных процессах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Каталог с файлами *.yaml или маска файлов')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Число процессов (1 - загрузка в текущем процессе)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, '*.yaml')) + glob.glob(os.path.join(path, '*.yml')))
+        else:
+            files = sorted(glob.glob(path))
+        if not files:
+            raise CommandError(f'Не найдены прайс-листы: {path}')
+
+        workers = max(1, min(options['workers'], len(files)))
+        started = time.perf_counter()
+        if workers == 1:
+            results = map(load_file, files)
+            self.report(results, started)
+        else:
+            # соединение родительского процесса не должно наследоваться воркерами
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=init_worker, initargs=(settings.DATABASES,)) as executor:
+                self.report(executor.map(load_file, files), started)
+
+    def report(self, results, started):
+        total_rows = 0
+        failed = 0
+        for path, stats, error, seconds, lookup_stats in results:
+            if error:
+                failed += 1
+                self.stderr.write(self.style.ERROR(f'{path}: {error}'))
+                continue
+            rows = stats['added'] + stats['changed'] + stats['unchanged']
+            total_rows += rows
+            hit_rates = ', '.join(f'{name} {counters["hit_rate"]:.0%}' for name, counters in lookup_stats.items())
+            self.stdout.write(
+                f'{path}: добавлено {stats["added"]}, изменено {stats["changed"]}, удалено {stats["removed"]}, '
+                f'без изменений {stats["unchanged"]} за {seconds:.2f} с ({rows / seconds:.0f} строк/с), '
+                f'попадания в кэш справочников: {hit_rates}')
+
+        seconds = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Итого: {total_rows} строк за {seconds:.2f} с ({total_rows / seconds:.0f} строк/с), ошибок: {failed}'))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend import catalog
+from backend.models import ProductInfo
+
+
+class Command(BaseCommand):
+    help = 'Пересоздать записи каталога (документы, колонки фильтров и поисковые документы) по позициям магазинов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, help='ИД магазина (по умолчанию - все магазины)')
+        parser.add_argument('--batch-size', type=int, help='Число позиций, записываемых одним запросом')
+
+    def handle(self, *args, **options):
+        queryset = ProductInfo.objects.all()
+        if options['shop']:
+            queryset = queryset.filter(shop_id=options['shop'])
+
+        started = time.perf_counter()
+        written = catalog.rebuild_entries(queryset, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено позиций: {written} за {time.perf_counter() - started:.1f} с'))
@@ -0,0 +1,27 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+
+from backend.basket import update_order_totals
+from backend.models import Order, OrderItem, ProductInfo
+
+
+class Command(BaseCommand):
+    help = 'Заполнить цены позиций заказов (текущими ценами товаров) и пересчитать итоги заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Число заказов, пересчитываемых одним запросом')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or settings.PRICE_LIST_IMPORT_BATCH_SIZE
+        # цены на момент заказа не сохранялись: позиции без цены получают текущую цену товара
+        prices = OrderItem.objects.filter(price=0).update(
+            price=Subquery(ProductInfo.objects.filter(id=OuterRef('product_info_id')).values('price')))
+        order_ids = Order.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=batch_size)
+        orders = 0
+        while batch := list(islice(order_ids, batch_size)):
+            update_order_totals(batch)
+            orders += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Заполнено цен позиций: {prices}, пересчитано заказов: {orders}'))
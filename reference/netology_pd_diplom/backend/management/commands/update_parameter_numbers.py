@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db.models import FloatField, Value
+from django.db.models.functions import Cast, Replace, Trim
+
+from backend.models import ProductParameter
+from backend.util import NUMBER_PATTERN
+
+
+class Command(BaseCommand):
+    help = 'Заполнить числовые значения параметров товаров (для фильтров param[...]__gte/__lte)'
+
+    def handle(self, *args, **options):
+        # числовые значения вычисляются в БД одним запросом, остальные сбрасываются
+        numbers = ProductParameter.objects.filter(value__regex=NUMBER_PATTERN).update(
+            value_number=Cast(Replace(Trim('value'), Value(','), Value('.')), FloatField()))
+        ProductParameter.objects.exclude(value__regex=NUMBER_PATTERN).filter(
+            value_number__isnull=False).update(value_number=None)
+        self.stdout.write(self.style.SUCCESS(f'Числовых значений параметров: {numbers}'))
@@ -1,10 +1,14 @@
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
 
+from backend.util import parse_number
+
 STATE_CHOICES = (
     ('basket', 'Статус корзины'),
     ('new', 'Новый'),
@@ -108,6 +112,12 @@ class Shop(models.Model):
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
     state = models.BooleanField(verbose_name='статус получения заказов', default=True)
+    # валидаторы последнего загруженного прайс-листа (для условной загрузки)
+    price_list_etag = models.CharField(max_length=255, verbose_name='ETag прайс-листа', blank=True)
+    price_list_last_modified = models.CharField(max_length=64, verbose_name='Last-Modified прайс-листа', blank=True)
+    price_list_digest = models.CharField(max_length=64, verbose_name='SHA-256 прайс-листа', blank=True)
+    # версия каталога увеличивается при каждом импорте прайс-листа (ключ кэша выгрузки и ETag)
+    catalog_version = models.PositiveIntegerField(verbose_name='Версия каталога', default=0)
 
     # filename
 
@@ -144,6 +154,10 @@ class Product(models.Model):
         verbose_name = 'Продукт'
         verbose_name_plural = "Список продуктов"
         ordering = ('-name',)
+        constraints = [
+            # параллельные импорты прайс-листов не создают дубликатов товаров
+            models.UniqueConstraint(fields=['name', 'category'], name='unique_product'),
+        ]
 
     def __str__(self):
         return self.name
@@ -165,7 +179,7 @@ class ProductInfo(models.Model):
         verbose_name = 'Информация о продукте'
         verbose_name_plural = "Информационный список о продуктах"
         constraints = [
-            models.UniqueConstraint(fields=['product', 'shop', 'external_id'], name='unique_product_info'),
+            models.UniqueConstraint(fields=['shop', 'external_id'], name='unique_product_info'),
         ]
 
     def __str__(self):
@@ -180,6 +194,9 @@ class Parameter(models.Model):
         verbose_name = 'Имя параметра'
         verbose_name_plural = "Список имен параметров"
         ordering = ('-name',)
+        constraints = [
+            models.UniqueConstraint(fields=['name'], name='unique_parameter'),
+        ]
 
     def __str__(self):
         return self.name
@@ -193,6 +210,8 @@ class ProductParameter(models.Model):
     parameter = models.ForeignKey(Parameter, verbose_name='Параметр', related_name='product_parameters', blank=True,
                                   on_delete=models.CASCADE)
     value = models.CharField(verbose_name='Значение', max_length=100)
+    # значение как число (None для нечисловых значений) для фильтрации по диапазону
+    value_number = models.FloatField(verbose_name='Числовое значение', null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = 'Параметр'
@@ -200,6 +219,65 @@ class ProductParameter(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product_info', 'parameter'], name='unique_product_parameter'),
         ]
+        indexes = [
+            # фильтры param[...] и подсчет значений параметров (фасеты) без чтения таблицы
+            models.Index(fields=['parameter', 'value', 'product_info'], name='product_parameter_value'),
+            models.Index(fields=['parameter', 'value_number', 'product_info'], name='product_parameter_number'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.value_number = parse_number(self.value)
+        super().save(*args, **kwargs)
+
+
+class CatalogEntry(models.Model):
+    """
+    Позиция каталога для выдачи покупателям (модель чтения).
+
+    Одна запись на позицию магазина: готовый документ ответа ProductInfoView (ProductInfoSerializer)
+    и колонки для фильтров и сортировок. Записи обновляются модулем backend.catalog
+    при импорте прайс-листа, изменении позиций и статуса магазина.
+    """
+    objects = models.manager.Manager()
+    product_info = models.OneToOneField(ProductInfo, verbose_name='Информация о продукте', primary_key=True,
+                                        related_name='catalog_entry', on_delete=models.CASCADE)
+    # индексы по магазину и категории - составные (см. Meta.indexes)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='catalog_entries', db_index=False,
+                             on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, verbose_name='Категория', related_name='catalog_entries',
+                                 db_index=False, on_delete=models.CASCADE)
+    # статус магазина (Shop.state)
+    active = models.BooleanField(verbose_name='Магазин принимает заказы', default=True)
+    name = models.CharField(max_length=80, verbose_name='Название')
+    model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    price = models.PositiveIntegerField(verbose_name='Цена')
+    price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')
+    search_vector = SearchVectorField(verbose_name='Поисковый документ', null=True)
+    document = models.JSONField(verbose_name='Документ')
+
+    class Meta:
+        verbose_name = 'Позиция каталога'
+        verbose_name_plural = "Каталог"
+        indexes = [
+            # выдача только по активным магазинам, последнее поле индексов - ключ курсора
+            models.Index(fields=['price', 'product_info'], condition=models.Q(active=True),
+                         name='catalog_entry_price'),
+            models.Index(fields=['price_rrc', 'product_info'], condition=models.Q(active=True),
+                         name='catalog_entry_price_rrc'),
+            models.Index(fields=['shop', 'price', 'product_info'], condition=models.Q(active=True),
+                         name='catalog_entry_shop_price'),
+            models.Index(fields=['category', 'price', 'product_info'], condition=models.Q(active=True),
+                         name='catalog_entry_category_price'),
+            models.Index(fields=['price', 'product_info'], condition=models.Q(active=True, quantity__gt=0),
+                         name='catalog_entry_in_stock_price'),
+            # полнотекстовый поиск (?q=); индекс похожих названий catalog_entry_name_trgm требует расширения pg_trgm
+            # и создается миграцией backend/extensions/migrations/0001_pg_trgm.py
+            GinIndex(fields=['search_vector'], name='catalog_entry_search'),
+        ]
+
+    def __str__(self):
+        return self.name
 
 
 class Contact(models.Model):
@@ -234,19 +312,27 @@ class Order(models.Model):
     contact = models.ForeignKey(Contact, verbose_name='Контакт',
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
+    # товары заказа списаны с остатков при оформлении и возвращаются при отмене;
+    # неподтвержденный заказ отменяется по истечении срока резерва
+    stock_reserved = models.BooleanField(verbose_name='Товары зарезервированы', default=False)
+    reserved_until = models.DateTimeField(verbose_name='Резерв до', null=True, blank=True)
+    # итоги заказа по позициям (пересчитываются при изменении позиций, см. backend.basket.update_order_totals)
+    total_sum = models.PositiveBigIntegerField(verbose_name='Сумма заказа', default=0, editable=False)
+    items_count = models.PositiveIntegerField(verbose_name='Количество товаров', default=0, editable=False)
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = "Список заказ"
         ordering = ('-dt',)
+        indexes = [
+            # поиск заказов с истекшим резервом (release_expired_orders)
+            models.Index(fields=['reserved_until'], name='order_reserved_until',
+                         condition=models.Q(state='new', reserved_until__isnull=False)),
+        ]
 
     def __str__(self):
         return str(self.dt)
 
-    # @property
-    # def sum(self):
-    #     return self.ordered_items.aggregate(total=Sum("quantity"))["total"]
-
 
 class OrderItem(models.Model):
     objects = models.manager.Manager()
@@ -257,6 +343,8 @@ class OrderItem(models.Model):
                                      blank=True,
                                      on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(verbose_name='Количество')
+    # цена за единицу на момент заказа (в корзине - на момент последнего изменения позиции)
+    price = models.PositiveIntegerField(verbose_name='Цена', default=0)
 
     class Meta:
         verbose_name = 'Заказанная позиция'
@@ -0,0 +1,164 @@
+from yaml import ScalarNode, ScalarEvent, SequenceStartEvent, SequenceEndEvent, MappingStartEvent, \
+    MappingEndEvent, AliasEvent, StreamEndEvent, DocumentEndEvent
+from yaml.constructor import ConstructorError
+
+# загрузчик на основе libyaml (C), если PyYAML собран с ним, иначе - на чистом Python
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+class _EventReader:
+    """
+    Builds Python objects from the YAML event stream one node at a time.
+
+    Only safe YAML tags are supported (the same set as yaml.safe_load), including merge keys (<<).
+    """
+
+    merge_tag = 'tag:yaml.org,2002:merge'
+
+
+    def __init__(self, stream):
+        self.loader = SafeLoader(stream)
+        self.anchors = {}
+
+    def get_event(self):
+        return self.loader.get_event()
+
+    def peek_event(self):
+        return self.loader.peek_event()
+
+    def is_merge_key(self):
+        """
+        Check whether the next event is a merge key (<<).
+        """
+        event = self.peek_event()
+        if not isinstance(event, ScalarEvent):
+            return False
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = self.loader.resolve(ScalarNode, event.value, event.implicit)
+        return tag == self.merge_tag
+
+    def read_merged(self, start_mark):
+        """
+        Read the value of a merge key: a mapping or a sequence of mappings
+        (earlier mappings take precedence over later ones).
+        """
+        value = self.read_node()
+        sources = value if isinstance(value, list) else [value]
+        merged = {}
+        for source in reversed(sources):
+            if not isinstance(source, dict):
+                raise ConstructorError('while constructing a mapping', start_mark,
+                                       'expected a mapping or list of mappings for merging', start_mark)
+            merged.update(source)
+        return merged
+
+    def read_node(self):
+        """
+        Read the next node from the event stream and return it as a Python object.
+        """
+        event = self.get_event()
+        if isinstance(event, AliasEvent):
+            return self.anchors[event.anchor]
+
+        if isinstance(event, ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = self.loader.resolve(ScalarNode, event.value, event.implicit)
+            node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, event.style)
+            constructor = self.loader.yaml_constructors.get(tag)
+            if constructor is None:
+                raise ConstructorError(None, None, f'could not determine a constructor for the tag {tag!r}',
+                                       event.start_mark)
+            value = constructor(self.loader, node)
+        elif isinstance(event, SequenceStartEvent):
+            value = []
+            if event.anchor is not None:
+                self.anchors[event.anchor] = value
+            while not isinstance(self.peek_event(), SequenceEndEvent):
+                value.append(self.read_node())
+            self.get_event()
+        elif isinstance(event, MappingStartEvent):
+            value = {}
+            if event.anchor is not None:
+                self.anchors[event.anchor] = value
+            # ключи из << дополняют словарь, явно заданные ключи имеют приоритет
+            merged, explicit = {}, {}
+            while not isinstance(self.peek_event(), MappingEndEvent):
+                if self.is_merge_key():
+                    self.get_event()
+                    merged.update(self.read_merged(event.start_mark))
+                    continue
+                key = self.read_node()
+                explicit[key] = self.read_node()
+            self.get_event()
+            value.update(merged)
+            value.update(explicit)
+        else:
+            raise ConstructorError(None, None, f'unexpected event {event}', event.start_mark)
+
+        if event.anchor is not None:
+            self.anchors[event.anchor] = value
+        return value
+
+    def dispose(self):
+        self.loader.dispose()
+
+
+def read_price_list(stream):
+    """
+    Read a partner price list from a YAML stream without loading the whole document.
+
+    The header keys ('shop', 'categories') are read eagerly; the 'goods' sequence is returned
+    as a generator which reads one good at a time from the event stream, so memory does not
+    depend on the number of goods. The header keys must precede 'goods' in the document.
+
+    Args:
+        stream (bytes | str | file): The YAML document.
+
+    Returns:
+        dict: The header keys of the price list with 'goods' replaced by a generator of goods.
+
+    Raises:
+        ValueError: If the document is not a mapping or the header follows the goods.
+    """
+    reader = _EventReader(stream)
+    # StreamStartEvent, DocumentStartEvent
+    reader.get_event()
+    reader.get_event()
+    if not isinstance(reader.get_event(), MappingStartEvent):
+        reader.dispose()
+        raise ValueError('Прайс-лист должен быть словарем')
+
+    data = {}
+    while not isinstance(reader.peek_event(), MappingEndEvent):
+        key = reader.read_node()
+        if key == 'goods':
+            break
+        data[key] = reader.read_node()
+    else:
+        reader.dispose()
+        data.setdefault('goods', [])
+        return data
+
+    if not {'shop', 'categories'}.issubset(data):
+        reader.dispose()
+        raise ValueError('Ключи shop и categories должны предшествовать списку goods')
+
+    def iter_goods():
+        try:
+            if not isinstance(reader.get_event(), SequenceStartEvent):
+                raise ValueError('goods должен быть списком')
+            while not isinstance(reader.peek_event(), SequenceEndEvent):
+                yield reader.read_node()
+            # остаток документа (ключи после goods) не используется
+            while not isinstance(reader.get_event(), (DocumentEndEvent, StreamEndEvent)):
+                pass
+        finally:
+            reader.dispose()
+
+    data['goods'] = iter_goods()
+    return data
@@ -0,0 +1,151 @@
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, F, Sum, IntegerField, OuterRef, Subquery
+from django.utils import timezone
+
+from backend.basket import get_stock, check_stock, update_order_totals
+from backend.catalog import update_quantities
+from backend.importer import bump_export_versions
+from backend.models import Shop, Order, OrderItem, ProductInfo
+
+
+class OutOfStock(Exception):
+    pass
+
+
+def _by_product(quantities):
+    # количество для каждой строки ProductInfo в одном UPDATE
+    return Case(*(When(id=product_info_id, then=Value(quantity)) for product_info_id, quantity in quantities.items()),
+                output_field=IntegerField())
+
+
+def _refresh_catalog(product_info_ids):
+    # выгрузки партнеров содержат остатки: версии каталога магазинов увеличиваются в той же транзакции,
+    # что и остатки, и кэшированные выгрузки (и их ETag) предыдущей версии больше не отдаются
+    bump_export_versions(Shop.objects.filter(product_infos__id__in=product_info_ids))
+    # остатки в каталоге обновляются после фиксации транзакции, чтобы не держать блокировки строк товаров;
+    # меняется только количество - одним UPDATE, без пересборки документов и сброса кэша ответов
+    transaction.on_commit(partial(update_quantities, product_info_ids))
+
+
+def reserve_stock(order_id):
+    """
+    Take the goods of an order from the stock.
+
+    All goods are taken by one UPDATE with the conditional decrement quantity = quantity - n
+    (only rows with quantity >= n of open shops are updated), so concurrent checkouts never
+    oversell and no locks are held except the row locks of the UPDATE itself.
+    If any product is short, nothing is taken.
+
+    Args:
+        order_id (int): The ID of the order.
+
+    Returns:
+        dict: The errors by product_info ID (empty if the goods are reserved).
+    """
+    quantities = dict(OrderItem.objects.filter(order_id=order_id).values_list('product_info_id', 'quantity'))
+    if not quantities:
+        return {}
+    ordered = _by_product(quantities)
+    try:
+        with transaction.atomic():
+            # условие на остаток - по самой строке товара (без соединения с магазином: иначе Django переносит
+            # условия в подзапрос, и после ожидания блокировки строки остаток не перепроверяется)
+            reserved = ProductInfo.objects.filter(
+                id__in=quantities, quantity__gte=ordered, shop_id__in=Shop.objects.filter(state=True).values('id'),
+            ).update(quantity=F('quantity') - ordered)
+            if reserved != len(quantities):
+                raise OutOfStock
+    except OutOfStock:
+        stock = get_stock(quantities)
+        errors = {}
+        for product_info_id, quantity in quantities.items():
+            error = check_stock(stock.get(product_info_id), quantity)
+            if error:
+                errors[product_info_id] = error
+        # остаток мог увеличиться после неудачного списания
+        return errors or dict.fromkeys(quantities, 'Недостаточно товара')
+    _refresh_catalog(list(quantities))
+    return {}
+
+
+def release_stock(order_ids):
+    """
+    Return the goods of orders to the stock (once per order).
+
+    Args:
+        order_ids (list): The IDs of the orders.
+
+    Returns:
+        int: The number of orders whose goods are returned.
+    """
+    with transaction.atomic():
+        order_ids = list(Order.objects.select_for_update().filter(
+            id__in=order_ids, stock_reserved=True).values_list('id', flat=True))
+        if not order_ids:
+            return 0
+        Order.objects.filter(id__in=order_ids).update(stock_reserved=False, reserved_until=None)
+        quantities = dict(OrderItem.objects.filter(order_id__in=order_ids).values(
+            'product_info_id').annotate(total=Sum('quantity')).values_list('product_info_id', 'total'))
+        if quantities:
+            ProductInfo.objects.filter(id__in=quantities).update(quantity=F('quantity') + _by_product(quantities))
+            _refresh_catalog(list(quantities))
+    return len(order_ids)
+
+
+def checkout(user_id, order_id, contact_id):
+    """
+    Place an order from the basket: the goods are reserved until settings.ORDER_RESERVATION_TTL,
+    the current prices of the goods are stored in the lines.
+
+    Args:
+        user_id (int): The ID of the user.
+        order_id (int): The ID of the basket.
+        contact_id (int): The ID of the contact.
+
+    Returns:
+        tuple: (whether the order is placed, errors by product_info ID).
+    """
+    with transaction.atomic():
+        is_updated = Order.objects.filter(user_id=user_id, id=order_id, state='basket').update(
+            contact_id=contact_id, state='new', stock_reserved=True,
+            reserved_until=timezone.now() + timedelta(seconds=settings.ORDER_RESERVATION_TTL))
+        if not is_updated:
+            return False, {}
+        errors = reserve_stock(order_id)
+        if errors:
+            transaction.set_rollback(True)
+            return False, errors
+        # цены позиций фиксируются на момент заказа
+        OrderItem.objects.filter(order_id=order_id).update(
+            price=Subquery(ProductInfo.objects.filter(id=OuterRef('product_info_id')).values('price')))
+        update_order_totals([order_id])
+    return True, {}
+
+
+def release_expired_orders(batch_size=None):
+    """
+    Cancel the orders not confirmed until the end of the reservation and return their goods to the stock.
+
+    Orders locked by concurrent transactions (being confirmed) are skipped until the next run.
+
+    Args:
+        batch_size (int): The maximum number of orders canceled by one transaction.
+
+    Returns:
+        int: The number of canceled orders.
+    """
+    batch_size = batch_size or settings.PRICE_LIST_IMPORT_BATCH_SIZE
+    canceled = 0
+    while True:
+        with transaction.atomic():
+            order_ids = list(Order.objects.select_for_update(skip_locked=True).filter(
+                state='new', reserved_until__lt=timezone.now()).values_list('id', flat=True)[:batch_size])
+            Order.objects.filter(id__in=order_ids).update(state='canceled')
+            release_stock(order_ids)
+        canceled += len(order_ids)
+        if len(order_ids) < batch_size:
+            return canceled
@@ -0,0 +1,105 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+# версия каталога для кэша ответов: общая для всех процессов, увеличивается при любом изменении каталога
+VERSION_KEY = 'responses:catalog_version'
+
+
+def _seed_version():
+    # после вытеснения ключа версия начинается с текущего времени в микросекундах, а не с 0:
+    # иначе новые версии совпали бы со старыми, и снова отдавались бы их ответы, еще не истекшие в кэше
+    cache.add(VERSION_KEY, time.time_ns() // 1000, timeout=None)
+
+
+def get_version():
+    """
+    Return the current version of the catalog responses.
+
+    Returns:
+        int: The version.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        _seed_version()
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _incr_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        _seed_version()
+
+
+def bump_version():
+    """
+    Make the cached catalog responses stale (after the commit of the current transaction,
+    so the responses of the new version are rendered from the committed data).
+
+    Returns:
+        None
+    """
+    transaction.on_commit(_incr_version)
+
+
+def get_cache_key(view_name, request, version):
+    """
+    Build the cache key of a response.
+
+    Args:
+        view_name (str): The name of the endpoint.
+        request (Request): The request (query parameters are normalized: sorted names and values).
+        version (int): The version of the catalog.
+
+    Returns:
+        str: The cache key.
+    """
+    params = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+    # ссылки next/previous пагинации абсолютные - ответы разных хостов и схем кэшируются отдельно
+    base_url = request.build_absolute_uri(request.path)
+    digest = hashlib.sha1(
+        f'{base_url}|{request.accepted_media_type}|{urlencode(params)}'.encode('utf-8')).hexdigest()
+    return f'responses:{view_name}:{version}:{digest}'
+
+
+class CachedResponseMixin:
+    """
+    Cache the rendered responses of a read-only list endpoint for the current catalog version.
+
+    A cached response is returned before the view queries the database or serializes anything;
+    the versions are bumped by backend.catalog and backend.importer when the catalog changes,
+    the responses of old versions expire after settings.RESPONSE_CACHE_TIMEOUT.
+    The browsable API is not cached (its pages depend on the user).
+
+    Attributes:
+    - response_cache_name: The name of the endpoint in the cache keys.
+    """
+    response_cache_name = None
+
+    def get(self, request, *args, **kwargs):
+        if not settings.RESPONSE_CACHE_ENABLED or request.accepted_renderer.format == 'api':
+            return super().get(request, *args, **kwargs)
+
+        key = get_cache_key(self.response_cache_name or type(self).__name__, request, get_version())
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            # ключ кэша зависит от формата ответа: промежуточные кэши должны различать ответы по Accept
+            patch_vary_headers(response, ['Accept'])
+            return response
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            response.add_post_render_callback(
+                lambda rendered: cache.set(key, (rendered.content, rendered['Content-Type']),
+                                           settings.RESPONSE_CACHE_TIMEOUT))
+        return response
@@ -155,7 +155,8 @@ class FixBasketView(OpenApiViewExtension):
                             name='BasketViewPutOk',
                             fields={
                                 'Status': serializers.BooleanField(),
-                                'Создано объектов': serializers.CharField(),
+                                'Обновлено объектов': serializers.IntegerField(),
+                                'Errors': serializers.DictField(child=serializers.CharField()),
                             },
                     ),
                     (403, 'application/json'): StatusAuthErrSerializer,
@@ -191,6 +192,10 @@ class FixPartnerExport(OpenApiViewExtension):
         @extend_schema(
             tags=['Partner'],
             summary='Export partner price in YAML format',
+            parameters=[
+                OpenApiParameter('stream', OpenApiTypes.BOOL, OpenApiParameter.QUERY, required=False,
+                                 description='Stream the price list in the response instead of queueing a task'),
+            ],
             responses={
                 200: inline_serializer(
                         name='PartnerExportResponseOk',
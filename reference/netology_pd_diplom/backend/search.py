@@ -0,0 +1,73 @@
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db.models import F, FloatField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Replace
+
+from backend.models import CatalogEntry, ProductParameter
+
+
+def search_vector():
+    """
+    Build the expression of the search document of a catalog entry.
+
+    The name of the product has the weight A, the model - B and the values of the parameters - C.
+    The parts of the model (apple/iphone/xs-max) are indexed as separate words.
+
+    Returns:
+        CombinedSearchVector: The expression for CatalogEntry.search_vector.
+    """
+    config = settings.SEARCH_CONFIG
+    values = ProductParameter.objects.filter(product_info_id=OuterRef('pk')).order_by().values(
+        'product_info_id').annotate(values=StringAgg('value', ' ')).values('values')
+    return (SearchVector('name', weight='A', config=config) +
+            SearchVector(Replace('model', Value('/'), Value(' ')), weight='B', config=config) +
+            SearchVector(Subquery(values), weight='C', config=config))
+
+
+def update_search_vectors(ids, batch_size=None):
+    """
+    Recalculate the search documents of catalog entries.
+
+    Args:
+        ids (iterable): The IDs of the entries (product infos).
+        batch_size (int): The number of rows updated by one statement.
+
+    Returns:
+        int: The number of updated rows.
+    """
+    batch_size = batch_size or settings.PRICE_LIST_IMPORT_BATCH_SIZE
+    ids = iter(ids)
+    updated = 0
+    while batch := list(islice(ids, batch_size)):
+        updated += CatalogEntry.objects.filter(pk__in=batch).update(search_vector=search_vector())
+    return updated
+
+
+def search_catalog(queryset, text):
+    """
+    Filter catalog entries by a search string and annotate them with the relevance ('rank').
+
+    The text is matched against the search document (websearch syntax: words, "phrases", -exclusions);
+    if nothing is found, the product names similar to the words of the text are returned (typos).
+
+    Args:
+        queryset (QuerySet): Catalog entries.
+        text (str): The search string.
+
+    Returns:
+        QuerySet: The found entries with the 'rank' annotation.
+    """
+    # модели в документе разбиты на слова (см. search_vector)
+    query = SearchQuery(text.replace('/', ' '), config=settings.SEARCH_CONFIG, search_type='websearch')
+    # ранг приводится к double precision, чтобы значение в курсоре совпадало со значением в БД
+    found = queryset.filter(search_vector=query).annotate(
+        rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
+    if found.exists():
+        return found
+
+    # опечатки: похожие по триграммам названия товаров (индекс catalog_entry_name_trgm)
+    return queryset.filter(name__trigram_word_similar=text).annotate(
+        rank=Cast(TrigramWordSimilarity(text, 'name'), FloatField()))
@@ -2,12 +2,15 @@ from typing import Type
 
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver, Signal
 from django_rest_passwordreset.signals import reset_password_token_created
 
-from backend.models import ConfirmEmailToken, User
-from backend.celery_tasks import send_email
+from backend import lookups, catalog, response_cache, reservations
+from backend.models import ConfirmEmailToken, User, Shop, Category, Parameter, Product, ProductInfo, ProductParameter, \
+    Order
+from backend.celery_tasks import send_email, refresh_catalog_names
+from backend.importer import bump_export_versions
 
 new_user_registered = Signal()
 
@@ -65,3 +68,101 @@ def new_order_signal(user_id, **kwargs):
         sender=settings.EMAIL_HOST_USER,
         recipients=[user.email],
     )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Parameter)
+@receiver(post_save, sender=Product)
+def lookup_changed_signal(sender, instance, created, **kwargs):
+    """
+    сбрасываем кэши справочников при изменении категории, параметра или товара
+    """
+    # новая запись не делает устаревшими закэшированные соответствия
+    if not created:
+        lookups.invalidate()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Parameter)
+@receiver(post_save, sender=Product)
+def catalog_names_changed_signal(sender, instance, created, **kwargs):
+    """
+    обновляем записи каталога при изменении названий категории, параметра или товара
+    """
+    if created:
+        return
+    # документы всех позиций с этим названием пересчитываются в задаче Celery после фиксации транзакции, а не в запросе
+    refresh_catalog_names.delay_on_commit(sender._meta.model_name, instance.id)
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Parameter)
+@receiver(post_save, sender=Product)
+def export_names_changed_signal(sender, instance, created, **kwargs):
+    """
+    увеличиваем версию каталога магазинов, в выгрузки которых входит название магазина, категории, товара или параметра
+    """
+    if created:
+        return
+    if sender is Shop:
+        shops = Shop.objects.filter(id=instance.id)
+    elif sender is Category:
+        shops = Shop.objects.filter(categories=instance.id)
+    elif sender is Parameter:
+        shops = Shop.objects.filter(product_infos__product_parameters__parameter_id=instance.id)
+    else:
+        shops = Shop.objects.filter(product_infos__product_id=instance.id)
+    bump_export_versions(shops)
+
+
+@receiver(post_save, sender=ProductInfo)
+@receiver(post_save, sender=ProductParameter)
+def catalog_entry_changed_signal(sender, instance, **kwargs):
+    """
+    обновляем запись каталога при сохранении позиции или ее параметра
+    (пакетный импорт обновляет записи сам, см. backend.importer)
+    """
+    catalog.update_entries([instance.id if sender is ProductInfo else instance.product_info_id])
+
+
+@receiver(post_save, sender=Shop)
+def shop_state_changed_signal(sender, instance, created, **kwargs):
+    """
+    скрываем или показываем позиции магазина в каталоге при изменении статуса
+    """
+    if not created:
+        catalog.set_shop_state([instance.id], instance.state)
+
+
+@receiver(post_save, sender=Order)
+def order_state_changed_signal(sender, instance, created, **kwargs):
+    """
+    возвращаем товары отмененного заказа на склад, подтвержденный заказ больше не отменяется по сроку резерва
+    """
+    if instance.state == 'canceled':
+        reservations.release_stock([instance.id])
+    elif instance.state not in ('basket', 'new') and instance.reserved_until:
+        Order.objects.filter(id=instance.id).update(reserved_until=None)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Parameter)
+@receiver(post_delete, sender=Product)
+def lookup_deleted_signal(sender, instance, **kwargs):
+    """
+    сбрасываем кэши справочников при удалении категории, параметра или товара
+    """
+    lookups.invalidate()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Shop)
+def catalog_response_changed_signal(sender, instance, **kwargs):
+    """
+    сбрасываем кэш ответов каталога (списки категорий и магазинов) при изменении категории или магазина
+    """
+    response_cache.bump_version()
+
@@ -3,7 +3,8 @@ from django_rest_passwordreset.views import reset_password_request_token, reset_
 
 from backend.views import PartnerUpdate, RegisterAccount, LoginAccount, CategoryView, ShopView, ProductInfoView, \
     BasketView, \
-    AccountDetails, ContactView, OrderView, PartnerState, PartnerOrders, ConfirmAccount, PartnerExport, ResultsView
+    AccountDetails, ContactView, OrderView, PartnerState, PartnerOrders, ConfirmAccount, PartnerExport, ResultsView, \
+    ResultsDownloadView
 
 app_name = 'backend'
 urlpatterns = [
@@ -24,5 +25,6 @@ urlpatterns = [
     path('basket', BasketView.as_view(), name='basket'),
     path('order', OrderView.as_view(), name='order'),
     path('results', ResultsView.as_view(), name='results'),
+    path('results/<path:name>', ResultsDownloadView.as_view(), name='results-download'),
 
 ]
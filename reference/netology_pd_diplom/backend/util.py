@@ -1,3 +1,8 @@
+import re
+from functools import lru_cache
+
+import redis
+
 # реализация функции strtobool из модуля distutils.util, 
 # который в Python 3.12 более не поддерживается 
 # (PEP 632 - https://peps.python.org/pep-0632/#migration-advice)
@@ -14,4 +19,56 @@ def strtobool(val):
     elif val in ('n', 'no', 'f', 'false', 'off', '0'):
         return 0
     else:
-        raise ValueError(f"invalid truth value {val!r}")
\ No newline at end of file
+        raise ValueError(f"invalid truth value {val!r}")
+
+# числовое значение параметра товара: целое или десятичная дробь (с точкой или запятой)
+NUMBER_PATTERN = r'^\s*[-+]?[0-9]+([.,][0-9]+)?\s*$'
+
+
+def parse_number(val):
+    """Convert the value of a product parameter to a number.
+
+    Returns a float for values like '6', '6.5' or '6,5' and None
+    for anything else ('1920x1080', 'красный').
+    """
+    if val is None or not re.match(NUMBER_PATTERN, str(val)):
+        return None
+    return float(str(val).strip().replace(',', '.'))
+
+
+def accepts_gzip(header):
+    """Check whether the Accept-Encoding header allows a gzip-compressed response.
+
+    The q-values are taken into account: 'gzip;q=0' refuses gzip, '*' accepts
+    gzip unless gzip is listed explicitly.
+    """
+    qvalues = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        qvalue = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[coding] = qvalue
+    return qvalues.get('gzip', qvalues.get('x-gzip', qvalues.get('*', 0.0))) > 0
+
+
+@lru_cache
+def get_redis(url):
+    """
+    Return the Redis client of the process for a URL (the connections are pooled and reused).
+
+    Args:
+        url (str): The URL of the Redis database.
+
+    Returns:
+        Redis: The client (responses are decoded to str).
+    """
+    return redis.Redis.from_url(url, decode_responses=True)
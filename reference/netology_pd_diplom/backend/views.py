@@ -1,4 +1,4 @@
-from backend.util import strtobool
+from backend.util import strtobool, accepts_gzip
 from rest_framework.request import Request
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
@@ -6,26 +6,39 @@ from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
 from django.conf import settings
 from django.db import IntegrityError
-from django.db.models import Q, Sum, F
-from django.http import JsonResponse
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponse, HttpResponseNotModified, FileResponse
 from django.urls import reverse
-from requests import get
+from django.utils.http import parse_etags
+from django.utils.text import compress_sequence
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.authtoken.models import Token
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.renderers import JSONRenderer
 from rest_framework_yaml.renderers import YAMLRenderer
 from rest_framework import serializers
 from ujson import loads as load_json
 from drf_spectacular.utils import extend_schema, inline_serializer, OpenApiParameter, OpenApiTypes
 
-from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, ConfirmEmailToken, STATE_CHOICES
+from backend.models import Shop, Category, Product, Parameter, ProductParameter, Order, \
+    Contact, ConfirmEmailToken, CatalogEntry, STATE_CHOICES
 from backend.serializers import UserSerializer, CategorySerializer, ShopSerializer, ProductInfoSerializer, \
-    OrderItemSerializer, OrderSerializer, ContactSerializer
+    OrderSerializer, ContactSerializer, BasketItemSerializer, BasketItemUpdateSerializer
 from backend.signals import new_user_registered, new_order
 from netology_pd_diplom.celery_app import get_task
 from backend.celery_tasks import send_email, partner_export, partner_update
+from backend.artifacts import get_storage, is_artifact, get_owner_id, get_content_type, parse_range, iter_file
+from backend.renderers import NDJSONRenderer, CSVRenderer
+from backend.pagination import KeysetPagination
+from backend.search import search_catalog
+from backend.catalog import set_shop_state
+from backend.basket import get_store
+from backend.reservations import checkout
+from backend.response_cache import CachedResponseMixin
+from backend.filters import parse_parameter_filters, filter_by_parameters, filter_by_offer, get_facets
+from backend.exporters import iter_cached_export, get_cached_export, export_etag, EXPORT_CONTENT_TYPES
 from backend.schema import StatusSerializer, StatusAuthErrSerializer, ItemsSerializer, \
     ConfirmEmailSerializer, NewTaskSerializer, OrderViewSerializer
 
@@ -238,10 +251,11 @@ class LoginAccount(APIView):
         200: CategorySerializer
     },
 )
-class CategoryView(ListAPIView):
+class CategoryView(CachedResponseMixin, ListAPIView):
     """
     Класс для просмотра категорий
     """
+    response_cache_name = 'categories'
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
@@ -253,10 +267,11 @@ class CategoryView(ListAPIView):
         200: ShopSerializer
     },
 )
-class ShopView(ListAPIView):
+class ShopView(CachedResponseMixin, ListAPIView):
     """
     Класс для просмотра списка магазинов
     """
+    response_cache_name = 'shops'
     queryset = Shop.objects.filter(state=True)
     serializer_class = ShopSerializer
 
@@ -267,61 +282,109 @@ class ShopView(ListAPIView):
     parameters=[
         OpenApiParameter('shop_id', OpenApiTypes.INT, OpenApiParameter.QUERY, required=False),
         OpenApiParameter('category_id', OpenApiTypes.INT, OpenApiParameter.QUERY, required=False),
+        OpenApiParameter('price__gte', OpenApiTypes.INT, OpenApiParameter.QUERY, required=False),
+        OpenApiParameter('price__lte', OpenApiTypes.INT, OpenApiParameter.QUERY, required=False),
+        OpenApiParameter('in_stock', OpenApiTypes.BOOL, OpenApiParameter.QUERY, required=False,
+                         description='Только товары в наличии'),
+        OpenApiParameter('q', OpenApiTypes.STR, OpenApiParameter.QUERY, required=False,
+                         description='Поиск по названию, модели и значениям параметров'),
+        OpenApiParameter('param[<name>]', OpenApiTypes.STR, OpenApiParameter.QUERY, required=False,
+                         description='Значение параметра (param[Цвет]=красный), '
+                                     'или диапазон: param[<name>]__gte, __gt, __lte, __lt'),
+        OpenApiParameter('ordering', OpenApiTypes.STR, OpenApiParameter.QUERY, required=False,
+                         enum=['id', 'price', '-price', 'price_rrc', '-price_rrc', 'rank']),
     ],
     responses={
         200: ProductInfoSerializer
     },
 )
-class ProductInfoView(APIView):
+class ProductInfoView(CachedResponseMixin, ListAPIView):
     """
         A class for searching products.
 
+        The products are served from the catalog read model (CatalogEntry): one indexed query
+        returns the pre-rendered documents, without joins, prefetches and serializers.
+        Rendered responses are cached until the catalog changes (CachedResponseMixin).
+
         Methods:
         - get: Retrieve the product information based on the specified filters.
+          The first page also contains 'facets': the numbers of goods per parameter value.
 
         Attributes:
-        - None
+        - serializer_class: The serializer the documents of the catalog are rendered with (for the schema).
+        - pagination_class: Keyset pagination (next/previous cursors).
+        - orderings: The supported values of the 'ordering' query parameter.
         """
-
-    def get(self, request: Request, *args, **kwargs):
+    response_cache_name = 'products'
+    serializer_class = ProductInfoSerializer
+    pagination_class = KeysetPagination
+    # сортировки по индексированным полям, последнее поле уникально
+    orderings = {
+        'id': ('pk',),
+        'price': ('price', 'pk'),
+        '-price': ('-price', '-pk'),
+        'price_rrc': ('price_rrc', 'pk'),
+        '-price_rrc': ('-price_rrc', '-pk'),
+        # только вместе с q
+        'rank': ('-rank', 'pk'),
+    }
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        page = self.paginate_queryset(queryset)
+        response = self.get_paginated_response([entry.document for entry in page])
+        # фасеты считаются для первой страницы, набор результатов следующих страниц тот же
+        if not request.query_params.get(self.paginator.cursor_query_param):
+            response.data['facets'] = get_facets(queryset)
+        return response
+
+    def get_queryset(self):
         """
                Retrieve the product information based on the specified filters.
 
-               Args:
-               - request (Request): The Django request object.
-               
                Parameters:
                - shop_id
                - category_id
+               - price__gte, price__lte
+               - in_stock
+               - param[<name>], param[<name>]__gte, __gt, __lte, __lt
+               - q: The search string (the product name, the model and the parameter values).
+               - ordering: By default the search results are ordered by relevance.
 
                Returns:
-               - Response: The response containing the product information.
+               - QuerySet: The catalog entries ordered by a unique key for keyset pagination.
                """
-        query = Q(shop__state=True)
-        shop_id = request.query_params.get('shop_id')
-        category_id = request.query_params.get('category_id')
+        query = Q(active=True)
+        shop_id = self.request.query_params.get('shop_id')
+        category_id = self.request.query_params.get('category_id')
 
         if shop_id:
             query = query & Q(shop_id=shop_id)
 
         if category_id:
-            query = query & Q(product__category_id=category_id)
-
-        # фильтруем и отбрасываем дуликаты
-        queryset = ProductInfo.objects.filter(
-            query).select_related(
-            'shop', 'product__category').prefetch_related(
-            'product_parameters__parameter').distinct()
+            query = query & Q(category_id=category_id)
 
-        serializer = ProductInfoSerializer(queryset, many=True)
+        queryset = filter_by_offer(CatalogEntry.objects.filter(query), self.request.query_params)
+        queryset = filter_by_parameters(queryset, parse_parameter_filters(self.request.query_params))
+        search = self.request.query_params.get('q', '').strip()
+        ordering = self.request.query_params.get('ordering')
+        if search:
+            queryset = search_catalog(queryset, search)
+            ordering = ordering or 'rank'
+        elif ordering == 'rank':
+            ordering = None
+        ordering = self.orderings.get(ordering, self.orderings['id'])
 
-        return Response(serializer.data)
+        return queryset.only('price', 'price_rrc', 'document').order_by(*ordering)
 
 
 class BasketView(APIView):
     """
     A class for managing the user's shopping basket.
 
+    The basket is kept by the store selected by settings.BASKET_STORE (see backend.basket);
+    the IDs of the basket lines are the IDs of the order lines (OrderItem) with every store.
+
     Methods:
     - get: Retrieve the items in the user's basket.
     - post: Add an item to the user's basket.
@@ -345,20 +408,16 @@ class BasketView(APIView):
                 """
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
-        basket = Order.objects.filter(
-            user_id=request.user.id, state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-
-        serializer = OrderSerializer(basket, many=True)
-        return Response(serializer.data)
+        return Response(get_store().get(request.user.id))
 
     # редактировать корзину
     def post(self, request, *args, **kwargs):
         """
                Add an items to the user's basket.
 
+               All items are checked and added in one transaction: nothing is added if any item is unknown
+               or out of stock; the quantity of a product already in the basket is increased.
+
                Args:
                - request (Request): The Django request object.
 
@@ -378,23 +437,13 @@ class BasketView(APIView):
             except ValueError:
                 return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'})
             else:
-                basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-                objects_created = 0
-                for order_item in items_dict:
-                    order_item.update({'order': basket.id})
-                    serializer = OrderItemSerializer(data=order_item)
-                    if serializer.is_valid():
-                        try:
-                            serializer.save()
-                        except IntegrityError as error:
-                            return JsonResponse({'Status': False, 'Errors': str(error)})
-                        else:
-                            objects_created += 1
-
-                    else:
-
-                        return JsonResponse({'Status': False, 'Errors': serializer.errors})
+                serializer = BasketItemSerializer(data=items_dict, many=True)
+                if not serializer.is_valid():
+                    return JsonResponse({'Status': False, 'Errors': serializer.errors})
 
+                objects_created, errors = get_store().add_items(request.user.id, serializer.validated_data)
+                if errors:
+                    return JsonResponse({'Status': False, 'Errors': errors})
                 return JsonResponse({'Status': True, 'Создано объектов': objects_created})
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
@@ -414,17 +463,9 @@ class BasketView(APIView):
 
         items = request.data.get('items')
         if items:
-            items_list = items.split(',')
-            basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-            query = Q()
-            objects_deleted = False
-            for order_item_id in items_list:
-                if order_item_id.isdigit():
-                    query = query | Q(order_id=basket.id, id=order_item_id)
-                    objects_deleted = True
-
-            if objects_deleted:
-                deleted_count = OrderItem.objects.filter(query).delete()[0]
+            items_list = [int(order_item_id) for order_item_id in items.split(',') if order_item_id.isdigit()]
+            if items_list:
+                deleted_count = get_store().delete_items(request.user.id, items_list)
                 return JsonResponse({'Status': True, 'Удалено объектов': deleted_count})
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
@@ -433,6 +474,9 @@ class BasketView(APIView):
         """
                Update the items in the user's basket.
 
+               The quantities are checked against the stock and written by one statement; the lines
+               that can not be updated are returned in Errors by their IDs, the other lines are updated.
+
                Args:
                - request (Request): The Django request object.
 
@@ -452,14 +496,14 @@ class BasketView(APIView):
             except ValueError:
                 return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'})
             else:
-                basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-                objects_updated = 0
-                for order_item in items_dict:
-                    if type(order_item['id']) == int and type(order_item['quantity']) == int:
-                        objects_updated += OrderItem.objects.filter(order_id=basket.id, id=order_item['id']).update(
-                            quantity=order_item['quantity'])
-
-                return JsonResponse({'Status': True, 'Обновлено объектов': objects_updated})
+                serializer = BasketItemUpdateSerializer(data=items_dict, many=True)
+                if not serializer.is_valid():
+                    return JsonResponse({'Status': False, 'Errors': serializer.errors})
+
+                outcomes = get_store().update_items(request.user.id, serializer.validated_data)
+                errors = {line_id: error for line_id, error in outcomes.items() if error}
+                return JsonResponse({'Status': True, 'Обновлено объектов': len(outcomes) - len(errors),
+                                     'Errors': errors})
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
 
@@ -512,9 +556,8 @@ class PartnerUpdate(APIView):
             except ValidationError as e:
                 return JsonResponse({'Status': False, 'Error': str(e)})
             else:
-                stream = get(url).content
-
-                async_task = partner_update.delay(stream, request.user.id)
+                # прайс-лист загружается в воркере Celery
+                async_task = partner_update.delay(url, request.user.id)
 
                 return JsonResponse({'Status': True, 'Task_id': async_task.id})
 
@@ -523,13 +566,19 @@ class PartnerUpdate(APIView):
 
 # экспорт товаров партнера
 class PartnerExport(APIView):
-    renderer_classes = [YAMLRenderer]
+    renderer_classes = [YAMLRenderer, JSONRenderer, NDJSONRenderer, CSVRenderer]
     throttle_scope = 'export'
 
     def get(self, request, *args, **kwargs):
         """
         Export partner price in YAML format.
 
+        The format (yaml, json, ndjson or csv) is negotiated by the 'format' query parameter or the Accept header.
+        With the 'stream' query parameter the price list is not queued as a Celery task but streamed
+        in the response in a single pass with constant memory use, compressed with gzip
+        if the client accepts it (Accept-Encoding). Streamed exports are cached per catalog version and served with an ETag,
+        so repeated and conditional (If-None-Match) requests do not render the catalog again.
+
         Parameters:
             request (HttpRequest): The HTTP request object.
             args (tuple): Positional arguments.
@@ -540,6 +589,7 @@ class PartnerExport(APIView):
                 If the user is not authenticated, returns a JSON response with status False and an error message.
                 If the user is not a shop, returns a JSON response with status False and an error message.
                 Otherwise, returns a JSON response with status True, the task ID, and the URL for the results.
+                In the streaming mode returns a StreamingHttpResponse with the price list.
         """
 
         if not request.user.is_authenticated:
@@ -548,7 +598,34 @@ class PartnerExport(APIView):
         if request.user.type != 'shop':
             return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
 
-        async_task = partner_export.delay(request.user.id)
+        # потоковая выгрузка прайс-листа в ответе без сохранения результата в Celery
+        if strtobool(request.query_params.get('stream', 'false')):
+            shop = Shop.objects.filter(user_id=request.user.id).first()
+            if shop is None:
+                return JsonResponse({'Status': False, 'Error': 'Магазин не найден'}, status=404)
+            export_format = request.accepted_renderer.format
+            compress = accepts_gzip(request.headers.get('Accept-Encoding', ''))
+            etag = export_etag(shop, export_format, compress)
+            etags = parse_etags(request.headers.get('If-None-Match', ''))
+            if etag in etags or '*' in etags:
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+
+            content = get_cached_export(shop, export_format, compress)
+            if content is not None:
+                response = HttpResponse(content, content_type=EXPORT_CONTENT_TYPES[export_format])
+            else:
+                response = StreamingHttpResponse(iter_cached_export(shop, export_format, compress),
+                                                 content_type=EXPORT_CONTENT_TYPES[export_format])
+            if compress:
+                response['Content-Encoding'] = 'gzip'
+            response['Vary'] = 'Accept-Encoding'
+            response['ETag'] = etag
+            response['Content-Disposition'] = f'attachment; filename="price_list_{shop.id}.{export_format}"'
+            return response
+
+        async_task = partner_export.delay(request.user.id, request.accepted_renderer.format)
 
         return JsonResponse({'Status': True, 'Task_id': async_task.task_id, 'url': reverse('backend:results')})
 
@@ -628,7 +705,10 @@ class PartnerState(APIView):
         state = request.data.get('state')
         if state:
             try:
-                Shop.objects.filter(user_id=request.user.id).update(state=strtobool(state))
+                state = strtobool(state)
+                shop_ids = list(Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True))
+                Shop.objects.filter(id__in=shop_ids).update(state=state)
+                set_shop_state(shop_ids, state)
                 return JsonResponse({'Status': True})
             except ValueError as error:
                 return JsonResponse({'Status': False, 'Errors': str(error)})
@@ -666,8 +746,7 @@ class PartnerOrders(APIView):
         order = Order.objects.filter(
             ordered_items__product_info__shop__user_id=request.user.id).exclude(state='basket').prefetch_related(
             'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
+            'ordered_items__product_info__product_parameters__parameter').select_related('contact').distinct()
 
         serializer = OrderSerializer(order, many=True)
         return Response(serializer.data)
@@ -709,7 +788,8 @@ class PartnerOrders(APIView):
 
         order = Order.objects.get(id=order_id)
         order.state = order_state
-        order.save()
+        # остальные поля (резерв товаров) меняются только условными обновлениями backend.reservations
+        order.save(update_fields=['state'])
 
         send_email.delay_on_commit(
             title=f'Статус Вашего заказа {order_id} изменился',
@@ -909,8 +989,7 @@ class OrderView(APIView):
         order = Order.objects.filter(
             user_id=request.user.id).exclude(state='basket').prefetch_related(
             'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
+            'ordered_items__product_info__product_parameters__parameter').select_related('contact')
 
         serializer = OrderSerializer(order, many=True)
         return Response(serializer.data)
@@ -928,6 +1007,10 @@ class OrderView(APIView):
         """
                Put an order and send a notification.
 
+               The goods of the basket are taken from the stock; the order is not placed if any product is short
+               (the errors are returned by product_info ID). Not confirmed orders are canceled
+               after settings.ORDER_RESERVATION_TTL.
+
                Args:
                - request (Request): The Django request object.
 
@@ -939,16 +1022,19 @@ class OrderView(APIView):
 
         if {'id', 'contact'}.issubset(request.data):
             if request.data['id'].isdigit():
+                # корзина из хранилища корзин записывается в БД перед оформлением
+                basket_store = get_store()
+                basket_store.save(request.user.id)
                 try:
-                    is_updated = Order.objects.filter(
-                        user_id=request.user.id, id=request.data['id']).update(
-                        contact_id=request.data['contact'],
-                        state='new')
+                    is_updated, errors = checkout(request.user.id, request.data['id'], request.data['contact'])
                 except IntegrityError as error:
                     print(error)
                     return JsonResponse({'Status': False, 'Errors': 'Неправильно указаны аргументы'})
                 else:
+                    if errors:
+                        return JsonResponse({'Status': False, 'Errors': errors})
                     if is_updated:
+                        basket_store.clear(request.user.id)
                         new_order.send(sender=self.__class__, user_id=request.user.id)
                         return JsonResponse({'Status': True})
 
@@ -974,7 +1060,7 @@ class ResultsView(APIView):
                 If the user is not authenticated, returns a JSON response with status False and an error message.
                 If the required arguments are not specified, returns a JSON response with status False and an error message.
                 If the task with the specified ID is not found, returns a JSON response with status False and an error message.
-                Otherwise, returns a JSON response with status True, the task ID, the state of the task, and the results (if task finished successfully) or the error message (if task failed).
+                Otherwise, returns a JSON response with status True, the task ID, the state of the task, and the results (if task finished successfully), the progress (if task is in PROGRESS state) or the error message (if task failed).
         """
         
         if not request.user.is_authenticated:
@@ -988,11 +1074,89 @@ class ResultsView(APIView):
         except:
             return JsonResponse({'Status': False, 'Errors': f'Не удалось найти задачу с идентификатором {request.data['task_id']}'})
 
+        results = task.result if task.state in ('SUCCESS', 'PROGRESS') else str(task.result)
+        # большой результат хранится в файле - возвращается ссылка на его загрузку
+        if task.state == 'SUCCESS' and is_artifact(results):
+            results = {
+                'url': request.build_absolute_uri(reverse('backend:results-download', args=[results['artifact']])),
+                'size': results['size'],
+                'content_type': results['content_type'],
+                'expires': results['expires'],
+            }
+
         return JsonResponse(
             {
                 'Status': True, 
                 'Task_id': request.data['task_id'], 
                 'State': task.state, 
-                'Results': (task.result if task.state == 'SUCCESS' else str(task.result))
+                # для выполняющегося импорта прайс-листа (PROGRESS) возвращается ход выполнения
+                'Results': results
             }
-        )
\ No newline at end of file
+        )
+
+
+# файлы отдаются в своем формате независимо от заголовка Accept
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class ResultsDownloadView(APIView):
+    """
+    Download the output of a task stored in the task results storage.
+    """
+    throttle_scope = 'celery_tasks'
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, name, *args, **kwargs):
+        """
+        Download the output of a task.
+
+        A single byte range (the Range header) is supported for resuming downloads;
+        the whole file is compressed with gzip if the client accepts it.
+
+        Args:
+            request (Request): The Django request object.
+            name (str): The name of the file in the task results storage.
+
+        Returns:
+            HttpResponse: The file (200), a part of the file (206) or an error.
+                If the user is not authenticated, returns a JSON response with status False and an error message.
+                If the file does not belong to the user or has been deleted, returns a 404 JSON response.
+                If the range is not satisfiable, returns a 416 response.
+        """
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+
+        storage = get_storage()
+        if '..' in name or get_owner_id(name) != request.user.id or not storage.exists(name):
+            return JsonResponse({'Status': False, 'Errors': 'Файл не найден'}, status=404)
+
+        size = storage.size(name)
+        content_type = get_content_type(name)
+        try:
+            byte_range = parse_range(request.headers.get('Range', ''), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        fp = storage.open(name, 'rb')
+        if byte_range:
+            start, end = byte_range
+            fp.seek(start)
+            response = StreamingHttpResponse(iter_file(fp, end - start + 1), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = end - start + 1
+        elif accepts_gzip(request.headers.get('Accept-Encoding', '')):
+            response = StreamingHttpResponse(compress_sequence(iter_file(fp, size)), content_type=content_type)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = FileResponse(fp, content_type=content_type)
+        response['Accept-Ranges'] = 'bytes'
+        response['Vary'] = 'Accept-Encoding'
+        response['Content-Disposition'] = f'attachment; filename="{name.rpartition("/")[2]}"'
+        return response
\ No newline at end of file
@@ -0,0 +1,63 @@
+"""
+Сравнение форматов выгрузки прайс-листа магазина: время генерации и размер (без сжатия и с gzip).
+
+Usage:
+    python -m benchmarks.bench_export [--size 100000] [--formats yaml json ndjson csv]
+
+Benchmark runs against a throwaway test database created from the configured one.
+Every format is rendered in a single streaming pass; the compressed size is counted
+while streaming, so the documents are never held in memory.
+"""
+import argparse
+import zlib
+
+from benchmarks.utils import setup_django, teardown_django, make_price_list, timer, count_queries
+
+
+def measure(shop, export_format):
+    """
+    Render the export and return its raw and gzip-compressed sizes.
+    """
+    from backend.exporters import iter_encoded_export
+
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    raw_size = compressed_size = 0
+    for data in iter_encoded_export(shop, export_format):
+        raw_size += len(data)
+        compressed_size += len(compressor.compress(data))
+    compressed_size += len(compressor.flush())
+    return raw_size, compressed_size
+
+
+def run(size, formats):
+    from backend.importer import import_price_list
+    from backend.models import Shop
+
+    import_price_list(make_price_list(size), None)
+    shop = Shop.objects.get(name='Benchmark')
+
+    print(f'{"goods":>8} {"format":>7} {"seconds":>9} {"queries":>8} {"goods/sec":>10} {"MiB":>8} {"gzip MiB":>9}')
+    for export_format in formats:
+        results = {}
+        with count_queries(results), timer(results, 'seconds'):
+            raw_size, compressed_size = measure(shop, export_format)
+        seconds = results['seconds']
+        print(f'{size:>8} {export_format:>7} {seconds:>9.2f} {results["queries"]:>8} {size / seconds:>10.0f} '
+              f'{raw_size / 2 ** 20:>8.2f} {compressed_size / 2 ** 20:>9.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--formats', nargs='+', default=['yaml', 'json', 'ndjson', 'csv'])
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        run(args.size, args.formats)
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Сравнение построчного и пакетного импорта прайс-листа,
+а также повторной синхронизации прайс-листа с измененными остатками.
+
+Usage:
+    python -m benchmarks.bench_import [--sizes 1000 10000 100000] [--legacy-limit 100000]
+
+Benchmark runs against a throwaway test database created from the configured one.
+"""
+import argparse
+
+from benchmarks.utils import setup_django, teardown_django, make_price_list, timer, count_queries
+
+
+def legacy_import(data, user_id):
+    """
+    The row-by-row import used by partner_update before the bulk engine (kept for comparison only).
+    """
+    from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter
+
+    shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=user_id)
+    for category in data['categories']:
+        category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
+        category_object.shops.add(shop.id)
+        category_object.save()
+    ProductInfo.objects.filter(shop_id=shop.id).delete()
+    for item in data['goods']:
+        product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
+
+        product_info = ProductInfo.objects.create(product_id=product.id,
+                                                  external_id=item['id'],
+                                                  model=item['model'],
+                                                  price=item['price'],
+                                                  price_rrc=item['price_rrc'],
+                                                  quantity=item['quantity'],
+                                                  shop_id=shop.id)
+        for name, value in item['parameters'].items():
+            parameter_object, _ = Parameter.objects.get_or_create(name=name)
+            ProductParameter.objects.create(product_info_id=product_info.id,
+                                            parameter_id=parameter_object.id,
+                                            value=value)
+
+
+def run(sizes, legacy_limit):
+    from backend.importer import import_price_list
+    from backend.models import Shop, Product, Parameter
+
+    print(f'{"goods":>8} {"path":>7} {"seconds":>9} {"queries":>9} {"goods/sec":>10}')
+    for size in sizes:
+        data = make_price_list(size)
+        paths = [('bulk', import_price_list)]
+        if size <= legacy_limit:
+            paths.insert(0, ('legacy', legacy_import))
+        for name, func in paths:
+            # каждый путь стартует с пустого каталога
+            Shop.objects.all().delete()
+            Product.objects.all().delete()
+            Parameter.objects.all().delete()
+            results = {}
+            with count_queries(results), timer(results, 'seconds'):
+                func(data, None)
+            seconds = results['seconds']
+            print(f'{size:>8} {name:>7} {seconds:>9.2f} {results["queries"]:>9} {size / seconds:>10.0f}')
+
+        # повторная загрузка того же прайс-листа с измененными остатками у 1% товаров
+        for item in data['goods'][::100]:
+            item['quantity'] += 1
+        results = {}
+        with count_queries(results), timer(results, 'seconds'):
+            import_price_list(data, None)
+        seconds = results['seconds']
+        print(f'{size:>8} {"resync":>7} {seconds:>9.2f} {results["queries"]:>9} {size / seconds:>10.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--legacy-limit', type=int, default=100000,
+                        help='skip the row-by-row path for price lists larger than this')
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        run(args.sizes, args.legacy_limit)
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Сравнение загрузки всего YAML-документа прайс-листа и потокового чтения товаров.
+
+Usage:
+    python -m benchmarks.bench_parse [--source ../../data/shop1.yaml] [--sizes 1000 10000 100000]
+
+The goods of the source price list are replicated with new ids up to the requested size.
+Peak memory is measured with tracemalloc in a separate pass, so it does not affect the timings.
+"""
+import argparse
+import os
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import yaml
+
+from benchmarks.utils import timer
+
+DEFAULT_SOURCE = Path(__file__).resolve().parents[3] / 'data' / 'shop1.yaml'
+
+
+def write_scaled_price_list(source, goods_count, fp):
+    """
+    Write a price list with goods_count goods built from the goods of the source price list.
+    """
+    with open(source, encoding='utf-8') as f:
+        data = yaml.safe_load(f)
+    goods = data.pop('goods')
+    fp.write(yaml.safe_dump(data, allow_unicode=True, sort_keys=False))
+    fp.write('goods:\n')
+    for index in range(goods_count):
+        item = dict(goods[index % len(goods)], id=1000000 + index)
+        fp.write(yaml.safe_dump([item], allow_unicode=True, sort_keys=False))
+
+
+def load_full(path):
+    """
+    The previous way: load the whole document with the pure Python full loader.
+    """
+    with open(path, 'rb') as f:
+        data = yaml.load(f, Loader=yaml.Loader)
+    return sum(1 for _ in data['goods'])
+
+
+def load_stream(path):
+    from backend.price_list import read_price_list
+
+    with open(path, 'rb') as f:
+        data = read_price_list(f)
+        return sum(1 for _ in data['goods'])
+
+
+def peak_memory(func, path):
+    tracemalloc.start()
+    try:
+        func(path)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(source, sizes):
+    print(f'{"goods":>8} {"loader":>7} {"seconds":>9} {"goods/sec":>10} {"peak MiB":>9}')
+    for size in sizes:
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.yaml', delete=False) as fp:
+            write_scaled_price_list(source, size, fp)
+        try:
+            for name, func in (('full', load_full), ('stream', load_stream)):
+                results = {}
+                with timer(results, 'seconds'):
+                    assert func(fp.name) == size
+                seconds = results['seconds']
+                peak = peak_memory(func, fp.name) / 2 ** 20
+                print(f'{size:>8} {name:>7} {seconds:>9.2f} {size / seconds:>10.0f} {peak:>9.2f}')
+        finally:
+            os.unlink(fp.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DEFAULT_SOURCE)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+    run(args.source, args.sizes)
+
+
+if __name__ == '__main__':
+    main()
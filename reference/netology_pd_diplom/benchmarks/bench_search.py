@@ -0,0 +1,74 @@
+"""
+Задержка полнотекстового поиска по каталогу (?q=): первая страница результатов с сортировкой по релевантности.
+
+Usage:
+    python -m benchmarks.bench_search [--size 1000000] [--repeat 20] [--queries "Товар 123456" ...]
+
+Benchmark runs against a throwaway PostgreSQL test database created from the configured one.
+The price list is imported by the regular pipeline, so the search documents are built the same way
+as in production. Every query is executed --repeat times; the median and the worst time are reported.
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.utils import setup_django, teardown_django, make_price_list, timer
+
+DEFAULT_QUERIES = [
+    # редкое слово вместе с частым
+    'Товар 123456',
+    # модель
+    'model/512',
+    # частое значение параметра
+    'красный 1920x1080',
+    # опечатка (похожие названия по триграммам)
+    'Тавар',
+]
+
+
+def search(text, page_size):
+    from backend.models import CatalogEntry
+    from backend.search import search_catalog
+
+    queryset = search_catalog(CatalogEntry.objects.filter(active=True), text)
+    return list(queryset.order_by('-rank', 'pk').values_list('document', flat=True)[:page_size])
+
+
+def run(size, repeat, queries, page_size):
+    from django.db import connection
+    from backend.importer import import_price_list
+
+    results = {}
+    with timer(results, 'seconds'):
+        import_price_list(make_price_list(size), None)
+    print(f'imported {size} goods in {results["seconds"]:.1f} s')
+    with connection.cursor() as cursor:
+        cursor.execute('VACUUM ANALYZE backend_catalogentry')
+
+    print(f'{"query":>20} {"rows":>5} {"median ms":>10} {"max ms":>8}')
+    for text in queries:
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = search(text, page_size)
+            times.append((time.perf_counter() - started) * 1000)
+        print(f'{text:>20} {len(rows):>5} {statistics.median(times):>10.2f} {max(times):>8.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--queries', nargs='+', default=DEFAULT_QUERIES)
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        run(args.size, args.repeat, args.queries, args.page_size)
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
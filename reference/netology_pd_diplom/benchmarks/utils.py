@@ -0,0 +1,89 @@
+import os
+import random
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    """
+    Configure Django and create a throwaway test database for the benchmark.
+
+    Returns:
+        str: The name of the old database (to be passed to teardown_django).
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'netology_pd_diplom.settings')
+    import django
+    django.setup()
+
+    from django.db import connection
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    return old_name
+
+
+def teardown_django(old_name):
+    """
+    Drop the test database created by setup_django.
+    """
+    from django.db import connection
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def make_price_list(goods_count, shop='Benchmark', categories_count=20, parameters_count=6, seed=0):
+    """
+    Generate a synthetic price list in the format of data/shop1.yaml.
+
+    Args:
+        goods_count (int): The number of goods.
+        shop (str): The name of the shop.
+        categories_count (int): The number of categories.
+        parameters_count (int): The number of parameters of every good.
+        seed (int): The random seed.
+
+    Returns:
+        dict: The price list with 'shop', 'categories' and 'goods' keys.
+    """
+    rnd = random.Random(seed)
+    categories = [{'id': 1000 + index, 'name': f'Категория {index}'} for index in range(categories_count)]
+    parameters = [f'Параметр {index}' for index in range(parameters_count)]
+    goods = []
+    for index in range(goods_count):
+        price = rnd.randint(100, 200000)
+        goods.append({
+            'id': 1000000 + index,
+            'category': categories[index % categories_count]['id'],
+            'model': f'model/{index % 997}',
+            'name': f'Товар {index}',
+            'price': price,
+            'price_rrc': price + rnd.randint(0, 10000),
+            'quantity': rnd.randint(0, 50),
+            'parameters': {name: rnd.choice(('красный', 'черный', 6.1, 256, '1920x1080')) for name in parameters},
+        })
+    return {'shop': shop, 'categories': categories, 'goods': goods}
+
+
+@contextmanager
+def timer(results, name):
+    """
+    Measure the wall time of the block and store it in results[name].
+    """
+    started = time.perf_counter()
+    yield
+    results[name] = time.perf_counter() - started
+
+
+@contextmanager
+def count_queries(results, name='queries'):
+    """
+    Count the SQL statements executed inside the block and store the number in results[name].
+    """
+    from django.db import connection
+
+    results[name] = 0
+
+    def wrapper(execute, sql, params, many, context):
+        results[name] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield
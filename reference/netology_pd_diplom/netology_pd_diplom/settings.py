@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+
+from celery.schedules import crontab
 from dotenv import load_dotenv
 
 # загрузить переменные окружения из файла ".env"
@@ -40,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_rest_passwordreset',
@@ -47,6 +50,7 @@ INSTALLED_APPS = [
     'cacheops',
     'silk',
     'backend',
+    'backend.extensions',
 ]
 
 MIDDLEWARE = [
@@ -185,6 +189,102 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Настройки Celery
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://127.0.0.1:6379/1')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://127.0.0.1:6379/2')
+# периодические задачи (celery beat)
+CELERY_BEAT_SCHEDULE = {
+    'cleanup-task-results': {
+        'task': 'backend.celery_tasks.cleanup_task_results',
+        'schedule': 60 * 60,
+    },
+    'dump-catalog': {
+        'task': 'backend.celery_tasks.dump_catalog',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'flush-baskets': {
+        'task': 'backend.celery_tasks.flush_baskets',
+        'schedule': int(os.getenv('BASKET_FLUSH_INTERVAL', 60)),
+    },
+    'release-expired-reservations': {
+        'task': 'backend.celery_tasks.release_expired_reservations',
+        'schedule': 10 * 60,
+    },
+}
+
+# Большие результаты задач (выгрузки, отчеты) хранятся в файлах, в бэкенде Celery - только ссылка на файл
+TASK_RESULTS_ROOT = os.getenv('TASK_RESULTS_ROOT', os.path.join(BASE_DIR, 'task_results'))
+# время хранения результатов, секунд
+TASK_RESULTS_TTL = int(os.getenv('TASK_RESULTS_TTL', 24 * 60 * 60))
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'task_results': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'location': TASK_RESULTS_ROOT},
+    },
+    'catalog_dumps': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'location': os.getenv('CATALOG_DUMP_ROOT', os.path.join(BASE_DIR, 'catalog_dumps'))},
+    },
+}
+
+# Ночная выгрузка каталога площадки: максимальное число позиций в файле и срок хранения выгрузок, дней
+CATALOG_DUMP_SHARD_SIZE = int(os.getenv('CATALOG_DUMP_SHARD_SIZE', 100000))
+CATALOG_DUMP_KEEP = int(os.getenv('CATALOG_DUMP_KEEP', 7))
+
+# Настройки импорта прайс-листов партнеров
+# число товаров, записываемых в БД одним пакетом
+PRICE_LIST_IMPORT_BATCH_SIZE = int(os.getenv('PRICE_LIST_IMPORT_BATCH_SIZE', 1000))
+# число товаров в блоке параллельного импорта (прайс-листы длиннее одного блока импортируются несколькими воркерами)
+PRICE_LIST_IMPORT_CHUNK_SIZE = int(os.getenv('PRICE_LIST_IMPORT_CHUNK_SIZE', 20000))
+# таймауты (подключение, чтение) загрузки прайс-листа, секунд
+PRICE_LIST_FETCH_TIMEOUT = (
+    float(os.getenv('PRICE_LIST_FETCH_CONNECT_TIMEOUT', 5)),
+    float(os.getenv('PRICE_LIST_FETCH_READ_TIMEOUT', 30)),
+)
+# максимальный размер прайс-листа, байт
+PRICE_LIST_MAX_SIZE = int(os.getenv('PRICE_LIST_MAX_SIZE', 200 * 1024 * 1024))
+# размер прайс-листа, до которого он хранится в памяти, а не во временном файле, байт
+PRICE_LIST_SPOOL_SIZE = 5 * 1024 * 1024
+# число соединений в пуле HTTP-сессии воркера
+PRICE_LIST_FETCH_POOL_SIZE = 10
+# максимальное число одновременных загрузок с одного хоста и задержка повтора задачи, секунд
+PRICE_LIST_FETCH_HOST_CONCURRENCY = int(os.getenv('PRICE_LIST_FETCH_HOST_CONCURRENCY', 2))
+PRICE_LIST_FETCH_RETRY_DELAY = 10
+# Redis счетчиков одновременных загрузок (общий для всех воркеров); пустая строка - счетчики в кэше Django
+PRICE_LIST_FETCH_REDIS = os.getenv('PRICE_LIST_FETCH_REDIS', 'redis://127.0.0.1:6379/4')
+# число позиций, читаемых из курсора БД за раз при потоковой выгрузке прайс-листа
+PARTNER_EXPORT_CHUNK_SIZE = int(os.getenv('PARTNER_EXPORT_CHUNK_SIZE', 2000))
+# кэширование выгрузок прайс-листов по версии каталога: максимальный размер выгрузки, байт, и время хранения, секунд
+PARTNER_EXPORT_CACHE_MAX_SIZE = int(os.getenv('PARTNER_EXPORT_CACHE_MAX_SIZE', 20 * 1024 * 1024))
+PARTNER_EXPORT_CACHE_TIMEOUT = 24 * 60 * 60
+# максимальное число записей в каждом кэше справочников (категории, параметры, товары) процесса
+LOOKUP_CACHE_SIZE = int(os.getenv('LOOKUP_CACHE_SIZE', 100000))
+# конфигурация полнотекстового поиска PostgreSQL (язык словаря)
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'russian')
+# кэш готовых ответов каталога (категории, магазины, товары) до изменения каталога
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 60 * 60))
+# максимальное число значений одного параметра в фасетах каталога
+PRODUCT_FACET_VALUES_LIMIT = int(os.getenv('PRODUCT_FACET_VALUES_LIMIT', 50))
+
+# Хранилище корзин покупателей: 'db' - таблицы заказов, 'redis' - активные корзины в Redis
+# (в БД записываются при оформлении заказа и задачей flush-baskets), срок хранения корзины в Redis, секунд
+BASKET_STORE = os.getenv('BASKET_STORE', 'db')
+BASKET_REDIS = os.getenv('BASKET_REDIS', 'redis://127.0.0.1:6379/5')
+BASKET_TTL = int(os.getenv('BASKET_TTL', 7 * 24 * 60 * 60))
+# срок резерва товаров оформленного заказа до подтверждения магазином, секунд
+ORDER_RESERVATION_TTL = int(os.getenv('ORDER_RESERVATION_TTL', 24 * 60 * 60))
+
+# Кэш Django (общий для веб-приложения и воркеров Celery)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_REDIS', 'redis://127.0.0.1:6379/4'),
+    }
+}
 
 # Настройки drf_spectacular
 SPECTACULAR_SETTINGS = {
@@ -1,10 +1,21 @@
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
 import pytest
+import redis
+from django.core.cache import cache
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from rest_framework.response import Response
 from model_bakery import baker
 from rest_framework.authtoken.models import Token
+from silk.collector import DataCollector
+from backend import lookups
+from backend.basket import RedisBasketStore
+from backend.celery_tasks import refresh_catalog_names
 from backend.models import User, Category, Shop, OrderItem, ProductInfo, \
     Order, Product, Category, Parameter, ProductParameter, Contact
 
@@ -18,6 +29,52 @@ NEW_USER_PROFILE_INFO = {
     }
 
 
+@pytest.fixture(autouse=True)
+def clear_caches(settings):
+    # тесты используют кэш в памяти процесса, а не общий Redis (очистка затронула бы другие процессы);
+    # кэши живут дольше теста, а данные БД откатываются после каждого теста
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                   'LOCATION': 'tests'}}
+    cache.clear()
+    lookups.clear()
+    yield
+    lookups.clear()
+
+
+@pytest.fixture
+def without_silk(settings):
+    # счетчики запросов учитывают только запросы приложения: профилировщик silk записывает каждый запрос API
+    # в свои таблицы и выполняет EXPLAIN для каждого SQL (в том числе после запроса API - до сброса его контекста)
+    settings.MIDDLEWARE = [middleware for middleware in settings.MIDDLEWARE
+                           if middleware != 'silk.middleware.SilkyMiddleware']
+    DataCollector().clear()
+    yield
+    DataCollector().clear()
+
+
+@pytest.fixture
+def catalog_refresh_in_process(monkeypatch):
+    # задача пересчета каталога после переименования, поставленная при фиксации транзакции,
+    # выполняется в процессе теста (без брокера Celery)
+    monkeypatch.setattr(refresh_catalog_names, 'delay', lambda *args: refresh_catalog_names.apply(args=args))
+
+
+@pytest.fixture
+def redis_basket_store(settings):
+    # корзины тестов - в отдельной базе Redis, очищаемой до и после теста (общее множество измененных корзин
+    # содержит только корзины теста); без Redis тест пропускается
+    settings.BASKET_STORE = 'redis'
+    settings.BASKET_REDIS = os.getenv('TEST_BASKET_REDIS', 'redis://127.0.0.1:6379/15')
+    client = redis.Redis.from_url(settings.BASKET_REDIS, socket_connect_timeout=1)
+    try:
+        client.flushdb()
+    except redis.ConnectionError:
+        pytest.skip('хранилище корзин Redis недоступно')
+    yield RedisBasketStore()
+    client.flushdb()
+    client.close()
+
+
 @pytest.fixture
 def api_client():
     return APIClient()
@@ -100,6 +157,15 @@ def user_new_shop():
     return user
 
 
+@pytest.fixture
+def user_shop_owner():
+    # владелец магазина для тестов, где участвует и покупатель (user_buyer): адрес почты должен отличаться
+    user = User.objects.create_user(email='shop-diplom-24@mail.ru', is_active=True, **NEW_USER_PROFILE_INFO)
+    user.type = 'shop'
+    user.save()
+    return user
+
+
 @pytest.fixture
 def user_buyer_token(user_buyer):
     token, _ = Token.objects.get_or_create(user=user_buyer)
@@ -107,9 +173,9 @@ def user_buyer_token(user_buyer):
 
 
 @pytest.fixture
-def user_shop(user_new_shop, shop_factory):
-    shop_factory(user=user_new_shop, state=True)
-    return user_new_shop
+def user_shop(user_shop_owner, shop_factory):
+    shop_factory(user=user_shop_owner, state=True)
+    return user_shop_owner
 
 
 @pytest.fixture
@@ -153,4 +219,78 @@ def basket(user_buyer, shop_products, order_factory, order_item_factory, contact
     basket = order_factory(user=user_buyer, contact=contact, state='basket')    
     for product in shop_products:
         order_item_factory(order=basket, product_info=product.product_infos.first(), quantity=1)
-    return basket
\ No newline at end of file
+    return basket
+
+
+class PriceListRequestHandler(BaseHTTPRequestHandler):
+    """
+    Обработчик тестового HTTP-сервера: отдает ответы из словаря server.routes
+    """
+
+    def do_GET(self):
+        route = self.server.routes.get(self.path)
+        if route is None:
+            self.send_error(404)
+            return
+        self.server.requests.append((self.path, dict(self.headers)))
+        status_code, headers, body, delay = route
+        time.sleep(delay)
+        self.send_response(status_code)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def price_list_server():
+    """
+    Локальный HTTP-сервер вместо сервера партнера.
+
+    Маршруты добавляются вызовом server.route(path, body, status_code=200, headers=None, delay=0),
+    который возвращает полный URL маршрута.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PriceListRequestHandler)
+    server.daemon_threads = True
+    server.routes = {}
+    server.requests = []
+
+    def route(path, body=b'', status_code=200, headers=None, delay=0):
+        server.routes[path] = (status_code, {'Content-Length': str(len(body)), **(headers or {})}, body, delay)
+        return f'http://127.0.0.1:{server.server_port}{path}'
+
+    server.route = route
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def task_results_storage(settings, tmp_path):
+    # файлы результатов задач сохраняются во временный каталог теста
+    settings.STORAGES = {
+        **settings.STORAGES,
+        'task_results': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': str(tmp_path)},
+        },
+    }
+    return tmp_path
+
+
+@pytest.fixture
+def catalog_dumps_storage(settings, tmp_path):
+    # выгрузки каталога сохраняются во временный каталог теста
+    settings.STORAGES = {
+        **settings.STORAGES,
+        'catalog_dumps': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': str(tmp_path)},
+        },
+    }
+    return tmp_path
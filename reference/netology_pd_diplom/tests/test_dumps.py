@@ -0,0 +1,37 @@
+import gzip
+import hashlib
+import json
+
+import pytest
+from backend.celery_tasks import dump_catalog
+from backend.importer import import_price_list
+from backend.models import Shop
+from tests.test_import import make_price_list
+
+
+@pytest.mark.django_db
+class TestCatalogDump:
+
+    # выгрузка каталога активных магазинов блоками с манифестом
+    def test_dump_catalog(self, settings, catalog_dumps_storage):
+        settings.CATALOG_DUMP_SHARD_SIZE = 4
+        import_price_list(make_price_list(10, shop='Магазин 1'), None)
+        import_price_list(make_price_list(3, shop='Магазин 2'), None)
+        import_price_list(make_price_list(5, shop='Магазин 3'), None)
+        Shop.objects.filter(name='Магазин 3').update(state=False)
+
+        manifest = dump_catalog.apply().get()
+        assert manifest['rows'] == 13
+        # магазин 1 разбит на три диапазона, магазин 2 - один блок
+        assert [shard['rows'] for shard in manifest['shards']] == [4, 4, 2, 3]
+        assert json.loads((catalog_dumps_storage / manifest['name'] / 'manifest.json').read_text()) == manifest
+
+        names = []
+        for shard in manifest['shards']:
+            content = (catalog_dumps_storage / manifest['name'] / shard['file']).read_bytes()
+            assert hashlib.sha256(content).hexdigest() == shard['sha256']
+            lines = gzip.decompress(content).decode('utf-8').splitlines()
+            assert len(lines) == shard['rows']
+            names.extend((json.loads(line)['shop'], json.loads(line)['name']) for line in lines)
+        assert len(set(names)) == 13
+        assert 'Магазин 3' not in {shop for shop, _ in names}
@@ -0,0 +1,264 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import yaml
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from backend import lookups
+from backend.importer import import_price_list, iter_batches, PriceListImporter
+from backend.price_list import read_price_list
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter
+
+
+postgres_only = pytest.mark.skipif(connection.vendor != 'postgresql', reason='требуется PostgreSQL')
+
+
+def make_price_list(goods_count, shop='Связной'):
+    return {
+        'shop': shop,
+        'categories': [{'id': 224, 'name': 'Смартфоны'}, {'id': 15, 'name': 'Аксессуары'}],
+        'goods': [
+            {
+                'id': 4216000 + index,
+                'category': 224 if index % 2 else 15,
+                'model': f'apple/iphone/{index}',
+                'name': f'Смартфон {index}',
+                'price': 1000 + index,
+                'price_rrc': 1100 + index,
+                'quantity': index % 10,
+                'parameters': {'Цвет': 'красный', 'Диагональ (дюйм)': 6.5},
+            }
+            for index in range(goods_count)
+        ],
+    }
+
+
+PRICE_LIST_YAML = '''
+shop: Связной
+categories:
+  - id: 224
+    name: Смартфоны
+goods:
+  - id: 4216292
+    category: 224
+    model: apple/iphone/xs-max
+    name: Смартфон Apple iPhone XS Max 512GB (золотистый)
+    price: 110000
+    price_rrc: 116990
+    quantity: 14
+    parameters: &params
+      "Диагональ (дюйм)": 6.5
+      "Разрешение (пикс)": 2688x1242
+      "Встроенная память (Гб)": 512
+      "Цвет": золотистый
+  - id: 4216313
+    category: 224
+    model: apple/iphone/xr
+    name: Смартфон Apple iPhone XR 256GB (красный)
+    price: 65000
+    price_rrc: 69990
+    quantity: 9
+    parameters: *params
+'''
+
+
+class TestPriceListReader:
+
+    # потоковое чтение дает тот же результат, что и загрузка всего документа
+    def test_read_price_list(self):
+        data = read_price_list(PRICE_LIST_YAML.encode())
+        assert data['shop'] == 'Связной'
+        assert data['categories'] == [{'id': 224, 'name': 'Смартфоны'}]
+        assert not isinstance(data['goods'], list)
+        assert list(data['goods']) == yaml.safe_load(PRICE_LIST_YAML)['goods']
+
+
+    # ключи слияния (<<) разворачиваются так же, как в yaml.safe_load
+    def test_read_price_list_merge_keys(self):
+        document = PRICE_LIST_YAML.replace('    parameters: *params', """    parameters:
+      <<: *params
+      "Цвет": красный
+      "Встроенная память (Гб)": 256""")
+        data = read_price_list(document.encode())
+        goods = list(data['goods'])
+        assert goods == yaml.safe_load(document)['goods']
+        assert goods[1]['parameters']['Цвет'] == 'красный'
+        assert goods[1]['parameters']['Диагональ (дюйм)'] == 6.5
+
+
+    # заголовок прайс-листа должен предшествовать товарам
+    def test_read_price_list_header_after_goods(self):
+        with pytest.raises(ValueError):
+            read_price_list('goods: []\nshop: Связной\ncategories: []\n')
+
+
+@pytest.mark.django_db
+class TestPriceListImport:
+
+    # импорт прайс-листа
+    def test_import(self, user_new_shop):
+        result = import_price_list(make_price_list(10), user_new_shop.id)
+        assert result == {'added': 10, 'changed': 0, 'removed': 0, 'unchanged': 0}
+        shop = Shop.objects.get(user=user_new_shop)
+        assert ProductInfo.objects.filter(shop=shop).count() == 10
+        assert Product.objects.count() == 10
+        assert Parameter.objects.count() == 2
+        assert ProductParameter.objects.count() == 20
+        assert set(shop.categories.values_list('id', flat=True)) == {224, 15}
+        assert ProductParameter.objects.filter(parameter__name='Диагональ (дюйм)').first().value == '6.5'
+
+
+    # импорт прайс-листа из YAML
+    def test_import_yaml(self, user_new_shop):
+        result = import_price_list(read_price_list(PRICE_LIST_YAML.encode()), user_new_shop.id, batch_size=1)
+        assert result['added'] == 2
+        assert ProductParameter.objects.filter(parameter__name='Разрешение (пикс)').count() == 2
+
+
+    # повторный импорт использует существующие товары и параметры
+    def test_reimport(self, user_new_shop):
+        import_price_list(make_price_list(10), user_new_shop.id)
+        import_price_list(make_price_list(10), user_new_shop.id)
+        assert ProductInfo.objects.count() == 10
+        assert Product.objects.count() == 10
+        assert Parameter.objects.count() == 2
+
+
+    # синхронизация: добавленные, измененные, удаленные и неизмененные товары
+    def test_sync(self, user_new_shop):
+        import_price_list(make_price_list(10), user_new_shop.id)
+        ids = dict(ProductInfo.objects.values_list('external_id', 'id'))
+        data = make_price_list(11)
+        # товар 4216000 удален из прайс-листа, 4216010 добавлен
+        data['goods'] = data['goods'][1:]
+        data['goods'][0]['quantity'] = 100
+        data['goods'][1]['parameters'] = {'Цвет': 'черный'}
+        result = import_price_list(data, user_new_shop.id)
+        assert result == {'added': 1, 'changed': 2, 'removed': 1, 'unchanged': 7}
+        assert not ProductInfo.objects.filter(external_id=4216000).exists()
+        # неизмененные и измененные позиции сохраняют свои идентификаторы
+        assert all(ProductInfo.objects.get(external_id=external_id).id == ids[external_id]
+                   for external_id in range(4216001, 4216010))
+        assert ProductInfo.objects.get(external_id=4216001).quantity == 100
+        assert dict(ProductParameter.objects.filter(product_info__external_id=4216002).values_list(
+            'parameter__name', 'value')) == {'Цвет': 'черный'}
+
+
+    # повторяющийся в пакете товар записывается один раз, действует последнее вхождение
+    def test_import_duplicate_ids(self, user_new_shop):
+        data = make_price_list(3)
+        duplicate = dict(data['goods'][0], price=5000)
+        data['goods'].append(duplicate)
+        result = import_price_list(data, user_new_shop.id)
+        assert result == {'added': 3, 'changed': 0, 'removed': 0, 'unchanged': 0}
+        assert ProductInfo.objects.get(external_id=duplicate['id']).price == 5000
+
+
+    # при изменении только остатков записываются только измененные позиции
+    def test_sync_stock_only_writes(self, user_new_shop):
+        import_price_list(make_price_list(100), user_new_shop.id)
+        data = make_price_list(100)
+        data['goods'][5]['quantity'] += 1
+        with CaptureQueriesContext(connection) as queries:
+            result = import_price_list(data, user_new_shop.id)
+        assert result == {'added': 0, 'changed': 1, 'removed': 0, 'unchanged': 99}
+        writes = [query['sql'] for query in queries if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        # связи категорий с магазином и одно обновление позиции
+        assert len([sql for sql in writes if 'backend_productinfo' in sql]) == 1
+        assert not [sql for sql in writes if 'backend_productparameter' in sql]
+
+
+    # число запросов зависит от числа пакетов, а не от числа товаров
+    def test_import_queries_bounded(self, user_new_shop):
+        with CaptureQueriesContext(connection) as one_batch:
+            import_price_list(make_price_list(20, shop='Магазин 1'), user_new_shop.id, batch_size=20)
+        with CaptureQueriesContext(connection) as ten_batches:
+            import_price_list(make_price_list(200, shop='Магазин 2'), None, batch_size=20)
+        # не более 13 запросов на пакет: выборка, вставка и повторная выборка товаров и параметров,
+        # выборка позиций и их параметров, вставка и обновление позиций, удаление и вставка параметров позиций
+        assert len(ten_batches) - len(one_batch) <= 9 * 13
+
+
+    # блоки одного прайс-листа, импортируемые параллельно, не создают дубликатов товаров и параметров
+    @postgres_only
+    @pytest.mark.django_db(transaction=True)
+    def test_import_parallel_chunks(self, user_new_shop):
+        data = make_price_list(200)
+        for index, item in enumerate(data['goods']):
+            item['name'] = f'Смартфон {index % 5}'
+        shop = Shop.objects.create(name=data['shop'], user=user_new_shop)
+        PriceListImporter(shop).import_categories(data['categories'])
+        chunks = list(iter_batches(data['goods'], 20))
+        barrier = threading.Barrier(len(chunks))
+
+        def import_chunk(chunk):
+            barrier.wait()
+            try:
+                return PriceListImporter(shop, batch_size=5).import_goods(chunk)['added']
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(len(chunks)) as executor:
+            assert sum(executor.map(import_chunk, chunks)) == 200
+        assert Product.objects.count() == len({(item['name'], item['category']) for item in data['goods']})
+        assert Parameter.objects.count() == 2
+
+
+    # загрузка прайс-листов из каталога командой load_pricelists
+    def test_load_pricelists_command(self, tmp_path, capsys):
+        (tmp_path / 'shop1.yaml').write_text(PRICE_LIST_YAML, encoding='utf-8')
+        (tmp_path / 'shop2.yaml').write_text(PRICE_LIST_YAML.replace('Связной', 'Евросеть'), encoding='utf-8')
+        (tmp_path / 'broken.yaml').write_text('shop: [', encoding='utf-8')
+        call_command('load_pricelists', str(tmp_path), workers=1)
+        out, err = capsys.readouterr()
+        assert 'shop1.yaml: добавлено 2' in out
+        assert 'ошибок: 1' in out
+        assert 'broken.yaml' in err
+        assert set(Shop.objects.values_list('name', flat=True)) == {'Связной', 'Евросеть'}
+        assert ProductInfo.objects.count() == 4
+
+
+    # загрузка прайс-листов в параллельных процессах (spawn)
+    @postgres_only
+    @pytest.mark.django_db(transaction=True)
+    def test_load_pricelists_command_workers(self, tmp_path, capsys):
+        (tmp_path / 'shop1.yaml').write_text(PRICE_LIST_YAML, encoding='utf-8')
+        (tmp_path / 'shop2.yaml').write_text(PRICE_LIST_YAML.replace('Связной', 'Евросеть'), encoding='utf-8')
+        call_command('load_pricelists', str(tmp_path), workers=2)
+        out, err = capsys.readouterr()
+        assert 'ошибок: 0' in out
+        assert not err
+        assert set(Shop.objects.values_list('name', flat=True)) == {'Связной', 'Евросеть'}
+        assert ProductInfo.objects.count() == 4
+
+
+    # повторный импорт берет товары и параметры из кэша справочников без запросов к БД
+    def test_reimport_uses_lookups(self, user_new_shop, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            import_price_list(make_price_list(10), user_new_shop.id)
+        hits = {name: counters['hits'] for name, counters in lookups.stats().items()}
+        with CaptureQueriesContext(connection) as queries:
+            import_price_list(make_price_list(10), user_new_shop.id)
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        assert not [sql for sql in selects if 'FROM "backend_product"' in sql or 'FROM "backend_parameter"' in sql]
+        assert not [query['sql'] for query in queries if 'INSERT INTO "backend_category"' in query['sql']]
+        stats = lookups.stats()
+        assert stats['products']['hits'] - hits['products'] == 10
+        assert stats['parameters']['hits'] - hits['parameters'] == 2
+
+
+    # изменение и удаление записей справочников сбрасывает кэш
+    def test_lookups_invalidation(self, user_new_shop, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            import_price_list(make_price_list(10), user_new_shop.id)
+        assert len(lookups.parameters) == 2
+        parameter = Parameter.objects.get(name='Цвет')
+        parameter.name = 'Цвет корпуса'
+        parameter.save()
+        assert len(lookups.parameters) == 0
+        import_price_list(make_price_list(10), user_new_shop.id)
+        assert Parameter.objects.filter(name='Цвет').exists()
+        Category.objects.filter(id=15).delete()
+        assert len(lookups.products) == 0
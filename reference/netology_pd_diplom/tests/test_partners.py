@@ -1,16 +1,33 @@
+import csv
+import gzip
+import io
+import json
+import os
+import time
+from tempfile import SpooledTemporaryFile
+
 import pytest
+import yaml
 from django.urls import reverse
 from rest_framework import status
-from backend.models import Shop, Order
+from backend import fetch
+from backend.celery_tasks import partner_update, partner_export
+from backend.fetch import fetch_price_list, host_slot, PriceListFetchError, HostBusy
+from backend.artifacts import cleanup_artifacts
+from backend.exporters import export_shop_queryset, get_cached_export
+from backend.importer import import_price_list
+from backend.models import Shop, Order, ProductInfo, Category
+from backend.serializers import PartnerExportSerializer
+from tests.test_import import PRICE_LIST_YAML, make_price_list
 
 @pytest.mark.django_db
 class TestPartner:
 
     # обновить прайс партнера - проверка
-    def test_partner_update(self, api_client, user_new_shop_token):
+    def test_partner_update(self, api_client, user_new_shop_token, price_list_server):
         url = reverse('backend:partner-update')
         api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_new_shop_token.key)
-        data = {'url': 'https://raw.githubusercontent.com/bku4erov/py-diplom/master/data/shop1.yaml'}
+        data = {'url': price_list_server.route('/shop1.yaml', PRICE_LIST_YAML.encode())}
         resp = api_client.post(url, data)
         assert resp.status_code == status.HTTP_200_OK
         resp_json = resp.json()
@@ -18,6 +35,122 @@ class TestPartner:
         assert resp_json.get('Task_id')
 
 
+    # загрузка и импорт прайс-листа в задаче Celery
+    def test_partner_update_task(self, user_new_shop, price_list_server):
+        url = price_list_server.route('/shop1.yaml', PRICE_LIST_YAML.encode())
+        result = partner_update.apply(args=(url, user_new_shop.id)).get()
+        assert result['added'] == 2
+        assert ProductInfo.objects.filter(shop__user=user_new_shop).count() == 2
+
+
+    # повторная загрузка неизмененного прайс-листа
+    @pytest.mark.parametrize('etag', ('"v1"', None))
+    def test_partner_update_unchanged(self, user_new_shop, price_list_server, etag):
+        url = price_list_server.route('/shop1.yaml', PRICE_LIST_YAML.encode(), headers={'ETag': etag} if etag else {})
+        partner_update.apply(args=(url, user_new_shop.id)).get()
+        shop = Shop.objects.get(user=user_new_shop)
+        assert shop.url == url
+        if etag:
+            # сервер отвечает 304 на условный запрос
+            assert shop.price_list_etag == etag
+            price_list_server.route('/shop1.yaml', status_code=304)
+        ProductInfo.objects.filter(shop=shop).update(quantity=0)
+        result = partner_update.apply(args=(url, user_new_shop.id)).get()
+        assert result == {'status': 'unchanged'}
+        assert price_list_server.requests[-1][1].get('If-None-Match') == etag
+        assert not ProductInfo.objects.filter(shop=shop).exclude(quantity=0).exists()
+
+
+    # параллельный импорт прайс-листа блоками (group/chord)
+    def test_partner_update_parallel(self, settings, user_new_shop, price_list_server, task_results_storage):
+        settings.PRICE_LIST_IMPORT_CHUNK_SIZE = 1
+        url = price_list_server.route('/shop1.yaml', PRICE_LIST_YAML.encode())
+        result = partner_update.apply(args=(url, user_new_shop.id)).get()
+        assert result == {'added': 2, 'changed': 0, 'removed': 0, 'unchanged': 0}
+        shop = Shop.objects.get(user=user_new_shop)
+        assert ProductInfo.objects.filter(shop=shop).count() == 2
+        assert list(shop.categories.values_list('id', flat=True)) == [224]
+        # блоки передаются задачам файлами, которые удаляются после импорта
+        assert not list((task_results_storage / 'imports').iterdir())
+
+
+    # параллельный импорт удаляет позиции магазина, отсутствующие в прайс-листе
+    def test_partner_update_parallel_removes_missing(self, settings, user_new_shop, price_list_server,
+                                                     task_results_storage):
+        import_price_list(make_price_list(3), user_new_shop.id)
+        settings.PRICE_LIST_IMPORT_CHUNK_SIZE = 1
+        url = price_list_server.route('/shop1.yaml', PRICE_LIST_YAML.encode())
+        result = partner_update.apply(args=(url, user_new_shop.id)).get()
+        assert result == {'added': 2, 'changed': 0, 'removed': 3, 'unchanged': 0}
+        assert set(ProductInfo.objects.values_list('external_id', flat=True)) == {4216292, 4216313}
+
+
+    # ход выполнения импорта в результатах задачи
+    def test_partner_update_progress(self, api_client, user_shop_token):
+        progress = {'chunks_done': 1, 'chunks_total': 4, 'rows_done': 100, 'rows_total': 400,
+                    'rows_per_sec': 50.0, 'eta': 6.0}
+        partner_update.backend.store_result('import-in-progress', progress, 'PROGRESS')
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_shop_token.key)
+        resp = api_client.generic('GET', reverse('backend:results'), '{"task_id": "import-in-progress"}',
+                                  content_type='application/json')
+        resp_json = resp.json()
+        assert resp_json.get('State') == 'PROGRESS'
+        assert resp_json.get('Results') == progress
+
+
+    # ограничение размера загружаемого прайс-листа
+    def test_fetch_price_list_too_large(self, settings, price_list_server):
+        settings.PRICE_LIST_MAX_SIZE = 100
+        url = price_list_server.route('/large.yaml', b'x' * 101)
+        with pytest.raises(PriceListFetchError):
+            fetch_price_list(url)
+        # без заголовка Content-Length размер проверяется при чтении
+        url = price_list_server.route('/chunked.yaml', b'x' * 101, headers={'Content-Length': ''})
+        with pytest.raises(PriceListFetchError):
+            fetch_price_list(url)
+
+
+    # таймаут чтения прайс-листа
+    def test_fetch_price_list_timeout(self, settings, price_list_server):
+        settings.PRICE_LIST_FETCH_TIMEOUT = (1, 0.2)
+        url = price_list_server.route('/slow.yaml', PRICE_LIST_YAML.encode(), delay=1)
+        with pytest.raises(PriceListFetchError):
+            fetch_price_list(url)
+
+
+    # обрыв соединения во время чтения прайс-листа: временный файл закрывается
+    def test_fetch_price_list_broken_body(self, monkeypatch, price_list_server):
+        files = []
+
+        class RecordedFile(SpooledTemporaryFile):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                files.append(self)
+
+        monkeypatch.setattr(fetch, 'SpooledTemporaryFile', RecordedFile)
+        url = price_list_server.route('/broken.yaml', PRICE_LIST_YAML.encode()[:10],
+                                      headers={'Content-Length': '1000'})
+        with pytest.raises(PriceListFetchError):
+            fetch_price_list(url)
+        assert len(files) == 1 and files[0].closed
+
+
+    # ограничение числа одновременных загрузок с одного хоста (счетчики в Redis и в кэше Django)
+    @pytest.mark.parametrize('counters', ['redis', 'cache'])
+    def test_fetch_host_concurrency(self, settings, counters):
+        settings.PRICE_LIST_FETCH_HOST_CONCURRENCY = 1
+        if counters == 'cache':
+            settings.PRICE_LIST_FETCH_REDIS = ''
+        with host_slot('http://partner.example/1.yaml'):
+            with pytest.raises(HostBusy):
+                with host_slot('http://partner.example/2.yaml'):
+                    pass
+            with host_slot('http://other.example/1.yaml'):
+                pass
+        with host_slot('http://partner.example/2.yaml'):
+            pass
+
+
     # получить статус партнера - проверка
     def test_partner_state_get(self, api_client, user_shop_token):
         url = reverse('backend:partner-state')
@@ -65,4 +198,155 @@ class TestPartner:
         assert resp.status_code == status.HTTP_200_OK
         resp_json = resp.json()
         assert resp_json.get('Status') is True
-        assert Order.objects.filter(id=shop_orders[0].id).first().state == 'sent'
\ No newline at end of file
+        assert Order.objects.filter(id=shop_orders[0].id).first().state == 'sent'
+
+    # потоковая выгрузка прайс-листа в YAML и JSON
+    @pytest.mark.parametrize('export_format, load', [('yaml', yaml.safe_load), ('json', json.loads)])
+    def test_partner_export_stream(self, api_client, user_new_shop_token, export_format, load):
+        import_price_list(make_price_list(25), user_new_shop_token.user_id)
+        shop = Shop.objects.get(user_id=user_new_shop_token.user_id)
+        url = reverse('backend:partner-export')
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_new_shop_token.key)
+        resp = api_client.get(url, {'stream': 'true', 'format': export_format})
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.streaming
+        data = load(b''.join(resp.streaming_content).decode('utf-8'))
+        expected = json.loads(json.dumps(PartnerExportSerializer(shop).data))
+        assert data['shop'] == expected['shop']
+        assert data['categories'] == expected['categories']
+        # порядок параметров товара в ответе сериализатора без prefetch не определен
+        for good in data['goods'] + expected['goods']:
+            good['parameters'].sort(key=str)
+        assert sorted(data['goods'], key=lambda good: good['id']) == \
+            sorted(expected['goods'], key=lambda good: good['id'])
+
+
+    # число запросов выгрузки не зависит от числа товаров
+    def test_partner_export_queries(self, user_new_shop, without_silk, django_assert_num_queries):
+        import_price_list(make_price_list(1000), user_new_shop.id)
+        # магазин, категории, позиции с товарами и категориями, параметры позиций с названиями
+        with django_assert_num_queries(4):
+            data = PartnerExportSerializer(export_shop_queryset().get(user=user_new_shop)).data
+        assert len(data['goods']) == 1000
+        assert sorted(data['goods'][0]['parameters'], key=str) == [{'Диагональ (дюйм)': '6.5'}, {'Цвет': 'красный'}]
+
+
+    # выгрузка кэшируется по версии каталога и отдается с ETag
+    def test_partner_export_cache(self, api_client, user_new_shop_token):
+        import_price_list(make_price_list(5), user_new_shop_token.user_id)
+        url = reverse('backend:partner-export')
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_new_shop_token.key)
+        resp = api_client.get(url, {'stream': 'true'})
+        content = b''.join(resp.streaming_content)
+        etag = resp['ETag']
+
+        # повторная выгрузка берется из кэша
+        resp = api_client.get(url, {'stream': 'true'})
+        assert not resp.streaming
+        assert resp.content == content
+        assert resp['ETag'] == etag
+
+        # условный запрос
+        resp = api_client.get(url, {'stream': 'true'}, HTTP_IF_NONE_MATCH=etag)
+        assert resp.status_code == status.HTTP_304_NOT_MODIFIED
+
+        # импорт прайс-листа увеличивает версию каталога
+        import_price_list(make_price_list(6), user_new_shop_token.user_id)
+        resp = api_client.get(url, {'stream': 'true'}, HTTP_IF_NONE_MATCH=etag)
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp['ETag'] != etag
+        assert len(yaml.safe_load(b''.join(resp.streaming_content))['goods']) == 6
+
+
+    # выгрузка в задаче Celery использует кэш выгрузок, переименование категории делает его устаревшим
+    def test_partner_export_task_cache(self, user_new_shop, task_results_storage):
+        import_price_list(make_price_list(5), user_new_shop.id)
+        shop = Shop.objects.get(user=user_new_shop)
+        result = partner_export.apply(args=(user_new_shop.id,)).get()
+        assert get_cached_export(shop, 'yaml') == (task_results_storage / result['artifact']).read_bytes()
+
+        category = Category.objects.get(id=224)
+        category.name = 'Телефоны'
+        category.save()
+        shop.refresh_from_db()
+        assert get_cached_export(shop, 'yaml') is None
+        result = partner_export.apply(args=(user_new_shop.id,)).get()
+        data = yaml.safe_load((task_results_storage / result['artifact']).read_bytes())
+        assert {'id': 224, 'name': 'Телефоны'} in data['categories']
+
+
+    # результат выгрузки сохраняется в файл, ResultsView возвращает ссылку на него
+    def test_partner_export_task_result(self, api_client, user_new_shop_token, task_results_storage):
+        import_price_list(make_price_list(5), user_new_shop_token.user_id)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_new_shop_token.key)
+        resp = api_client.get(reverse('backend:partner-export'))
+        task_id = resp.json()['Task_id']
+        partner_export.backend.store_result(
+            task_id, partner_export.apply(args=(user_new_shop_token.user_id,)).get(), 'SUCCESS')
+
+        resp = api_client.generic('GET', reverse('backend:results'), json.dumps({'task_id': task_id}),
+                                  content_type='application/json')
+        results = resp.json()['Results']
+        assert set(results) == {'url', 'size', 'content_type', 'expires'}
+
+        resp = api_client.get(results['url'])
+        assert resp.status_code == status.HTTP_200_OK
+        content = b''.join(resp.streaming_content)
+        assert len(content) == results['size']
+        assert len(yaml.safe_load(content)['goods']) == 5
+
+        # докачка и сжатие
+        resp = api_client.get(results['url'], HTTP_RANGE='bytes=10-')
+        assert resp.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert resp['Content-Range'] == f'bytes 10-{len(content) - 1}/{len(content)}'
+        assert b''.join(resp.streaming_content) == content[10:]
+        resp = api_client.get(results['url'], HTTP_RANGE=f'bytes={len(content)}-')
+        assert resp.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        resp = api_client.get(results['url'], HTTP_ACCEPT_ENCODING='gzip')
+        assert resp['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(b''.join(resp.streaming_content)) == content
+
+
+    # файлы результатов удаляются по истечении срока хранения
+    def test_cleanup_task_results(self, user_new_shop, task_results_storage):
+        import_price_list(make_price_list(5), user_new_shop.id)
+        result = partner_export.apply(args=(user_new_shop.id, 'json')).get()
+        path = task_results_storage / result['artifact']
+        assert cleanup_artifacts() == 0
+        os.utime(path, (time.time() - 2 * 24 * 60 * 60,) * 2)
+        assert cleanup_artifacts() == 1
+        assert not path.exists()
+
+
+    # сжатие выгрузки с учетом q-значений Accept-Encoding
+    @pytest.mark.parametrize('accept_encoding, compressed', [
+        ('gzip', True), ('deflate, gzip;q=0.5', True), ('*', True), ('gzip;q=0', False),
+        ('*, gzip;q=0', False), ('identity', False), ('', False),
+    ])
+    def test_partner_export_accept_encoding(self, api_client, user_new_shop_token, accept_encoding, compressed):
+        import_price_list(make_price_list(3), user_new_shop_token.user_id)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_new_shop_token.key)
+        resp = api_client.get(reverse('backend:partner-export'), {'stream': 'true'},
+                              HTTP_ACCEPT_ENCODING=accept_encoding)
+        assert (resp.get('Content-Encoding') == 'gzip') is compressed
+        content = b''.join(resp.streaming_content)
+        assert len(yaml.safe_load(gzip.decompress(content) if compressed else content)['goods']) == 3
+
+
+    # выгрузка в NDJSON и CSV со сжатием gzip
+    def test_partner_export_ndjson_csv(self, api_client, user_new_shop_token):
+        import_price_list(make_price_list(3), user_new_shop_token.user_id)
+        url = reverse('backend:partner-export')
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_new_shop_token.key)
+
+        resp = api_client.get(url, {'stream': 'true', 'format': 'ndjson'}, HTTP_ACCEPT_ENCODING='gzip')
+        assert resp['Content-Encoding'] == 'gzip'
+        lines = gzip.decompress(b''.join(resp.streaming_content)).decode('utf-8').splitlines()
+        assert [json.loads(line)['name'] for line in lines] == ['Смартфон 0', 'Смартфон 1', 'Смартфон 2']
+
+        resp = api_client.get(url, {'stream': 'true', 'format': 'csv'})
+        rows = list(csv.DictReader(io.StringIO(b''.join(resp.streaming_content).decode('utf-8'))))
+        assert len(rows) == 3
+        assert rows[1] == {'id': rows[1]['id'], 'category': 'Смартфоны', 'model': 'apple/iphone/1', 'name': 'Смартфон 1',
+                           'price': '1001', 'price_rrc': '1101', 'quantity': '1',
+                           'Диагональ (дюйм)': '6.5', 'Цвет': 'красный'}
@@ -1,8 +1,35 @@
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+from django.contrib.postgres.search import SearchQuery
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from backend.models import User, Shop, Product, Order, OrderItem
+from backend.models import User, Shop, Category, Product, ProductInfo, ProductParameter, CatalogEntry, Order, OrderItem
 from backend.serializers import ProductInfoSerializer
+from backend.importer import import_price_list
+from backend import response_cache, basket as basket_module
+from backend.catalog import update_entries, update_quantities
+from backend.celery_tasks import flush_baskets, release_expired_reservations
+from backend.reservations import checkout
+from tests.test_import import make_price_list
+
+postgres_only = pytest.mark.skipif(connection.vendor != 'postgresql', reason='требуется PostgreSQL')
+
+
+def has_pg_trgm():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
 
 
 @pytest.mark.django_db
@@ -41,8 +68,8 @@ class TestShop:
         resp = api_client.get(url)
         assert resp.status_code == status.HTTP_200_OK
         resp_json = resp.json()
-        assert len(resp_json) == Product.objects.count()
-        assert set(ProductInfoSerializer.Meta.fields) <= set(resp_json[0].keys())
+        assert len(resp_json['results']) == Product.objects.count()
+        assert set(ProductInfoSerializer.Meta.fields) <= set(resp_json['results'][0].keys())
 
 
     # получить список продуктов с использованием фильтра
@@ -52,7 +79,327 @@ class TestShop:
         resp = api_client.get(f'{url}?shop_id=0&category_id=0')
         assert resp.status_code == status.HTTP_200_OK
         resp_json = resp.json()
-        assert len(resp_json) == 0
+        assert len(resp_json['results']) == 0
+
+
+    # постраничный вывод продуктов по курсору
+    @pytest.mark.parametrize('ordering', ['id', 'price', '-price', 'price_rrc', '-price_rrc'])
+    def test_products_pagination(self, api_client, user_new_shop, ordering):
+        import_price_list(make_price_list(25), user_new_shop.id)
+        url = reverse('backend:products')
+        resp = api_client.get(url, {'limit': 10, 'ordering': ordering})
+        pages = [resp.json()]
+        while pages[-1]['next']:
+            pages.append(api_client.get(pages[-1]['next']).json())
+        assert [len(page['results']) for page in pages] == [10, 10, 5]
+        assert pages[0]['previous'] is None
+        prices = [item['price'] for page in pages for item in page['results']]
+        assert prices == sorted(prices, reverse=ordering.startswith('-'))
+        assert len({item['id'] for page in pages for item in page['results']}) == 25
+
+        # возврат на предыдущую страницу
+        previous = api_client.get(pages[2]['previous']).json()
+        assert previous['results'] == pages[1]['results']
+        assert previous['next'] and previous['previous']
+
+        # новая позиция перед текущей страницей не сдвигает следующую
+        import_price_list(make_price_list(26), user_new_shop.id)
+        assert api_client.get(pages[1]['next']).json()['results'][:5] == pages[2]['results']
+
+
+    # полнотекстовый поиск продуктов: название, модель и значения параметров, сортировка по релевантности
+    @postgres_only
+    def test_products_full_text_search(self, api_client, user_new_shop):
+        price_list = make_price_list(10)
+        price_list['goods'][3]['name'] = 'Смартфон Apple iPhone XS Max'
+        price_list['goods'][5]['model'] = 'iphone/xs'
+        price_list['goods'][7]['parameters']['Цвет'] = 'золотистый'
+        import_price_list(price_list, user_new_shop.id)
+        url = reverse('backend:products')
+
+        resp = api_client.get(url, {'q': 'iphone xs'})
+        assert resp.status_code == status.HTTP_200_OK
+        # совпадение в названии (вес A) выше совпадения в модели (вес B)
+        assert [item['model'] for item in resp.json()['results']] == ['apple/iphone/3', 'iphone/xs']
+
+        resp = api_client.get(url, {'q': 'золотистые'})
+        assert [item['model'] for item in resp.json()['results']] == ['apple/iphone/7']
+
+        # поисковый документ обновляется при импорте измененного прайс-листа
+        price_list['goods'][7]['parameters']['Цвет'] = 'серебристый'
+        import_price_list(price_list, user_new_shop.id)
+        assert not CatalogEntry.objects.filter(search_vector=SearchQuery('золотистый', config='russian')).exists()
+        assert [item['model'] for item in api_client.get(url, {'q': 'серебристый'}).json()['results']] == \
+               ['apple/iphone/7']
+
+
+    # постраничный вывод результатов поиска по курсору (ранг и id)
+    @postgres_only
+    def test_products_search_pagination(self, api_client, user_new_shop):
+        price_list = make_price_list(12)
+        for item in price_list['goods'][:6]:
+            item['name'] = 'Смартфон красный'
+        import_price_list(price_list, user_new_shop.id)
+        url = reverse('backend:products')
+        pages = [api_client.get(url, {'q': 'смартфон красный', 'limit': 5}).json()]
+        while pages[-1]['next']:
+            pages.append(api_client.get(pages[-1]['next']).json())
+        ids = [item['id'] for page in pages for item in page['results']]
+        assert [len(page['results']) for page in pages] == [5, 5, 2]
+        assert len(set(ids)) == 12
+        # товары с совпадением в названии идут первыми
+        names = [item['product']['name'] for page in pages for item in page['results']]
+        assert names[:6] == ['Смартфон красный'] * 6
+        assert api_client.get(pages[1]['previous']).json()['results'] == pages[0]['results']
+
+
+    # поиск с опечаткой находит похожие названия (pg_trgm)
+    @postgres_only
+    def test_products_search_typo(self, api_client, user_new_shop):
+        if not has_pg_trgm():
+            pytest.skip('расширение pg_trgm не установлено')
+        price_list = make_price_list(3)
+        price_list['goods'][1]['name'] = 'Смартфон Apple iPhone XS Max'
+        import_price_list(price_list, user_new_shop.id)
+        resp = api_client.get(reverse('backend:products'), {'q': 'iphnoe'})
+        assert [item['model'] for item in resp.json()['results']] == ['apple/iphone/1']
+
+
+    # фильтрация продуктов по значениям параметров и числовым диапазонам
+    def test_products_parameter_filters(self, api_client, user_new_shop):
+        price_list = make_price_list(10)
+        for index, item in enumerate(price_list['goods']):
+            item['parameters'] = {'Цвет': ('красный', 'черный', 'белый')[index % 3], 'Диагональ (дюйм)': 5 + index / 2}
+        import_price_list(price_list, user_new_shop.id)
+        url = reverse('backend:products')
+
+        def models(params):
+            resp = api_client.get(url, params)
+            assert resp.status_code == status.HTTP_200_OK
+            return sorted(int(item['model'].rpartition('/')[2]) for item in resp.json()['results'])
+
+        assert models({'param[Цвет]': 'красный'}) == [0, 3, 6, 9]
+        assert models({'param[Цвет]': ['красный', 'белый']}) == [0, 2, 3, 5, 6, 8, 9]
+        assert models({'param[Диагональ (дюйм)]__gte': '6', 'param[Диагональ (дюйм)]__lt': '7,5'}) == [2, 3, 4]
+        assert models({'param[Цвет]': 'черный', 'param[Диагональ (дюйм)]__gt': 6}) == [4, 7]
+        assert models({'param[Вес]': '1'}) == []
+        assert api_client.get(url, {'param[Диагональ (дюйм)]__gte': 'шесть'}).status_code == \
+               status.HTTP_400_BAD_REQUEST
+
+        # числовые значения заполняются командой для записей, сохраненных без них
+        ProductParameter.objects.update(value_number=None)
+        call_command('update_parameter_numbers', stdout=io.StringIO())
+        assert models({'param[Диагональ (дюйм)]__lte': '5.5'}) == [0, 1]
+
+
+    # счетчики значений параметров (фасеты) для текущего набора результатов
+    def test_products_facets(self, api_client, user_new_shop, without_silk, django_assert_max_num_queries):
+        price_list = make_price_list(6)
+        for index, item in enumerate(price_list['goods']):
+            item['parameters'] = {'Цвет': ('красный', 'черный')[index % 2], 'Память': (64, 128, 256)[index % 3]}
+        import_price_list(price_list, user_new_shop.id)
+        url = reverse('backend:products')
+
+        resp = api_client.get(url, {'limit': 2})
+        facets = resp.json()['facets']
+        assert facets == {'Цвет': {'красный': 3, 'черный': 3}, 'Память': {'128': 2, '256': 2, '64': 2}}
+        # на следующих страницах фасеты не пересчитываются
+        assert 'facets' not in api_client.get(resp.json()['next']).json()
+
+        # фасеты учитывают фильтры
+        resp = api_client.get(url, {'param[Цвет]': 'красный'})
+        assert resp.json()['facets'] == {'Цвет': {'красный': 3}, 'Память': {'128': 1, '256': 1, '64': 1}}
+
+        # ID параметров фильтра (если их нет в кэше), страница и подсчет фасетов - один агрегирующий запрос
+        with django_assert_max_num_queries(3) as queries:
+            api_client.get(url, {'param[Цвет]': 'черный'})
+        assert [query['sql'] for query in queries.captured_queries if 'COUNT(' in query['sql']] == [
+            queries.captured_queries[-1]['sql']]
+
+
+    # фильтрация продуктов по диапазону цен и наличию
+    def test_products_price_filters(self, api_client, user_new_shop, catalog_refresh_in_process,
+                                    django_capture_on_commit_callbacks):
+        import_price_list(make_price_list(20), user_new_shop.id)
+        url = reverse('backend:products')
+        resp = api_client.get(url, {'price__gte': 1005, 'price__lte': 1012, 'in_stock': 'true', 'ordering': '-price'})
+        assert resp.status_code == status.HTTP_200_OK
+        # quantity = index % 10, позиция 1010 не в наличии
+        assert [item['price'] for item in resp.json()['results']] == [1012, 1011, 1009, 1008, 1007, 1006, 1005]
+        assert len(api_client.get(url, {'in_stock': 'false'}).json()['results']) == 20
+        assert api_client.get(url, {'price__gte': 'дорого'}).status_code == status.HTTP_400_BAD_REQUEST
+
+        # категория позиции следует за категорией товара
+        product = Product.objects.get(name='Смартфон 1')
+        product.category_id = 15
+        # записи каталога обновляются задачей Celery после фиксации транзакции
+        with django_capture_on_commit_callbacks(execute=True):
+            product.save()
+        resp = api_client.get(url, {'category_id': 15})
+        assert 'Смартфон 1' in {item['product']['name'] for item in resp.json()['results']}
+
+
+    # переименование категории пересчитывает документы каталога в задаче Celery после фиксации транзакции
+    def test_catalog_category_rename(self, user_new_shop, catalog_refresh_in_process,
+                                     django_capture_on_commit_callbacks):
+        import_price_list(make_price_list(4), user_new_shop.id)
+        category = Category.objects.get(id=224)
+        category.name = 'Телефоны'
+        with django_capture_on_commit_callbacks() as callbacks:
+            category.save()
+        assert not CatalogEntry.objects.filter(document__product__category='Телефоны').exists()
+        for callback in callbacks:
+            callback()
+        assert CatalogEntry.objects.filter(document__product__category='Телефоны').count() == 2
+
+
+    # изменение остатков обновляет количество в каталоге одним UPDATE без сброса кэша ответов
+    def test_catalog_update_quantities(self, user_new_shop, without_silk, django_assert_num_queries,
+                                       django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            import_price_list(make_price_list(3), user_new_shop.id)
+        entries = {entry.pk: entry for entry in CatalogEntry.objects.all()}
+        changed = list(entries)[:2]
+        version = response_cache.get_version()
+        ProductInfo.objects.filter(id__in=entries).update(quantity=7)
+        with django_capture_on_commit_callbacks() as callbacks, django_assert_num_queries(1):
+            assert update_quantities(changed) == 2
+        assert callbacks == []
+        assert response_cache.get_version() == version
+        for entry in CatalogEntry.objects.all():
+            quantity = 7 if entry.pk in changed else entries[entry.pk].quantity
+            assert entry.quantity == quantity
+            assert entry.document == {**entries[entry.pk].document, 'quantity': quantity}
+
+
+    # продукты выдаются из каталога одним запросом без соединений таблиц
+    def test_products_catalog_entries(self, api_client, user_new_shop, user_new_shop_token, without_silk):
+        import_price_list(make_price_list(30), user_new_shop.id)
+        url = reverse('backend:products')
+        with CaptureQueriesContext(connection) as queries:
+            resp = api_client.get(url, {'limit': 10, 'ordering': 'price'})
+        first_page = resp.json()['results']
+        assert len(first_page) == 10
+        assert first_page[0] == json.loads(json.dumps(
+            ProductInfoSerializer(ProductInfo.objects.get(id=first_page[0]['id'])).data))
+        page_queries = [query['sql'] for query in queries if 'backend_catalogentry' in query['sql']]
+        # страница и фасеты
+        assert len(page_queries) == 2
+        assert 'JOIN' not in page_queries[0]
+
+        # позиции магазина, не принимающего заказы, не выдаются
+        user_new_shop.shop.state = False
+        user_new_shop.shop.save()
+        assert api_client.get(url).json()['results'] == []
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_new_shop_token.key)
+        api_client.post(reverse('backend:partner-state'), {'state': 'true'})
+        assert len(api_client.get(url, {'limit': 50}).json()['results']) == 30
+
+        # изменение позиции и параметра обновляет документ
+        product_info = ProductInfo.objects.get(id=first_page[0]['id'])
+        product_info.price = 1
+        product_info.save()
+        ProductParameter.objects.filter(product_info=product_info, parameter__name='Цвет').first().delete()
+        update_entries([product_info.id])
+        document = api_client.get(url, {'ordering': 'price'}).json()['results'][0]
+        assert document['price'] == 1
+        assert document['product_parameters'] == [{'parameter': 'Диагональ (дюйм)', 'value': '6.5'}]
+
+        # удаленные позиции удаляются из каталога
+        import_price_list(make_price_list(5), user_new_shop.id)
+        assert CatalogEntry.objects.count() == 5
+
+
+    # повторные запросы каталога отдаются из кэша ответов до изменения каталога
+    def test_products_response_cache(self, api_client, user_new_shop, user_new_shop_token, without_silk,
+                                     django_assert_num_queries, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            import_price_list(make_price_list(5), user_new_shop.id)
+        url = reverse('backend:products')
+        first = api_client.get(url, {'ordering': 'price', 'in_stock': 'true'})
+        # порядок параметров запроса не важен, ORM и сериализаторы не используются
+        with django_assert_num_queries(0):
+            cached = api_client.get(f'{url}?in_stock=true&ordering=price')
+        assert cached.status_code == status.HTTP_200_OK
+        assert cached.json() == first.json()
+        categories = api_client.get(reverse('backend:categories')).json()
+        with django_assert_num_queries(0):
+            assert api_client.get(reverse('backend:categories')).json() == categories
+
+        # импорт прайс-листа делает кэш устаревшим
+        with django_capture_on_commit_callbacks(execute=True):
+            import_price_list(make_price_list(7), user_new_shop.id)
+        assert len(api_client.get(url, {'ordering': 'price', 'in_stock': 'true'}).json()['results']) == 6
+
+        # как и изменение статуса магазина
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_new_shop_token.key)
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.post(reverse('backend:partner-state'), {'state': 'false'})
+        api_client.credentials()
+        assert api_client.get(url, {'ordering': 'price', 'in_stock': 'true'}).json()['results'] == []
+        assert api_client.get(reverse('backend:shops')).json()['results'] == []
+
+
+    # абсолютные ссылки пагинации не попадают из кэша в ответы другого хоста
+    def test_products_response_cache_host(self, api_client, user_new_shop, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            import_price_list(make_price_list(5), user_new_shop.id)
+        url = reverse('backend:products')
+        first = api_client.get(url, {'limit': 2}, HTTP_HOST='shop.example.com').json()
+        assert first['next'].startswith('http://shop.example.com/')
+        other = api_client.get(url, {'limit': 2}, HTTP_HOST='api.example.com').json()
+        assert other['next'].startswith('http://api.example.com/')
+        secure = api_client.get(url, {'limit': 2}, HTTP_HOST='shop.example.com', secure=True).json()
+        assert secure['next'].startswith('https://shop.example.com/')
+
+
+    # ответ из кэша отдается с теми же заголовками, что и сформированный ответ (Vary: Accept, Allow)
+    def test_products_response_cache_headers(self, api_client, user_new_shop, without_silk,
+                                             django_assert_num_queries):
+        import_price_list(make_price_list(3), user_new_shop.id)
+        url = reverse('backend:products')
+        rendered = api_client.get(url, HTTP_ACCEPT='application/json')
+        with django_assert_num_queries(0):
+            cached = api_client.get(url, HTTP_ACCEPT='application/json')
+        assert cached['Vary'] == rendered['Vary'] == 'Accept'
+        assert cached['Allow'] == rendered['Allow']
+        assert cached['Content-Type'] == rendered['Content-Type']
+
+
+    # после вытеснения версии из кэша версии не повторяются
+    def test_response_cache_version_evicted(self):
+        version = response_cache.get_version()
+        response_cache._incr_version()
+        assert response_cache.get_version() == version + 1
+        cache.delete(response_cache.VERSION_KEY)
+        assert response_cache.get_version() > version + 1
+
+
+    # частые комбинации фильтров и сортировок используют индексы
+    @postgres_only
+    @pytest.mark.parametrize('params, index', [
+        ({'shop_id': None, 'ordering': 'price'}, 'catalog_entry_shop_price'),
+        ({'category_id': 224, 'ordering': '-price'}, 'catalog_entry_category_price'),
+        ({'in_stock': 'true', 'ordering': 'price'}, 'catalog_entry_in_stock_price'),
+        ({'price__gte': 1500, 'price__lte': 1600, 'ordering': 'price'}, 'catalog_entry_price'),
+        ({'ordering': 'price_rrc'}, 'catalog_entry_price_rrc'),
+    ])
+    def test_products_query_plan(self, api_client, params, index):
+        for shop_index in range(10):
+            import_price_list(make_price_list(300, shop=f'Магазин {shop_index}'), None)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        if 'shop_id' in params:
+            params['shop_id'] = Shop.objects.get(name='Магазин 3').id
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = api_client.get(reverse('backend:products'), params)
+        assert resp.status_code == status.HTTP_200_OK
+        sql = next(query['sql'] for query in queries if 'FROM "backend_catalogentry"' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}')
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        assert f'Index Scan using {index}' in plan or f'Index Scan Backward using {index}' in plan, plan
 
 
     # добавить товары в корзину
@@ -76,6 +423,40 @@ class TestShop:
         assert OrderItem.objects.filter(order=Order.objects.filter(state='basket',user=user_buyer).first()).count() == 2
 
 
+    # повторное добавление товара увеличивает количество, ошибка в одной позиции отменяет все добавление
+    def test_basket_post_bulk(self, api_client, user_buyer, user_buyer_token, shop_products, without_silk,
+                              django_assert_max_num_queries):
+        product_infos = [product.product_infos.first() for product in shop_products]
+        for product_info in product_infos:
+            product_info.quantity = 10
+            product_info.save()
+        url = reverse('backend:basket')
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_buyer_token.key)
+        api_client.post(url, {'items': json.dumps([{'product_info': product_infos[0].id, 'quantity': 2}])})
+
+        items = [{'product_info': product_info.id, 'quantity': 3} for product_info in product_infos]
+        items.append({'product_info': product_infos[1].id, 'quantity': 1})
+        # токен, блокировка корзины, остатки - одним запросом, позиции - одним upsert, итоги заказа
+        with django_assert_max_num_queries(7) as queries:
+            resp = api_client.post(url, {'items': json.dumps(items)})
+        sqls = [query['sql'] for query in queries.captured_queries]
+        assert len([sql for sql in sqls if sql.startswith('SELECT') and 'FROM "backend_productinfo"' in sql]) == 1
+        assert len([sql for sql in sqls if sql.startswith('INSERT INTO "backend_orderitem"')]) == 1
+        assert resp.json() == {'Status': True, 'Создано объектов': 3}
+        basket = Order.objects.get(state='basket', user=user_buyer)
+        assert dict(basket.ordered_items.values_list('product_info_id', 'quantity')) == {
+            product_infos[0].id: 5, product_infos[1].id: 4, product_infos[2].id: 3}
+
+        for wrong_item in ({'product_info': product_infos[0].id, 'quantity': 6},
+                           {'product_info': 10 ** 9, 'quantity': 1},
+                           {'product_info': product_infos[1].id, 'quantity': 0}):
+            resp = api_client.post(url, {'items': json.dumps([
+                {'product_info': product_infos[2].id, 'quantity': 1}, wrong_item])})
+            assert resp.json()['Status'] is False
+        assert dict(basket.ordered_items.values_list('product_info_id', 'quantity')) == {
+            product_infos[0].id: 5, product_infos[1].id: 4, product_infos[2].id: 3}
+
+
     # изменить число товаров в корзине
     def test_basket_update(self, api_client, user_buyer_token, shop_products, basket):
         url = reverse('backend:basket')
@@ -99,6 +480,32 @@ class TestShop:
             assert OrderItem.objects.filter(id=order_item_id).first().quantity == 8
 
 
+    # количества обновляются одним запросом, позиции без достаточного остатка возвращаются с ошибкой
+    def test_basket_update_bulk(self, api_client, user_buyer_token, shop_products, basket, without_silk,
+                                django_assert_max_num_queries):
+        ordered_items = list(basket.ordered_items.select_related('product_info'))
+        for ordered_item in ordered_items:
+            ordered_item.product_info.quantity = 5
+            ordered_item.product_info.save()
+        url = reverse('backend:basket')
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_buyer_token.key)
+        items = [{'id': ordered_items[0].id, 'quantity': 4},
+                 {'id': ordered_items[1].id, 'quantity': 6},
+                 {'id': ordered_items[2].id, 'quantity': 5},
+                 {'id': 10 ** 9, 'quantity': 1}]
+        # токен, блокировка корзины, позиции с остатками, одно обновление позиций, итоги заказа
+        with django_assert_max_num_queries(7) as queries:
+            resp = api_client.put(url, {'items': json.dumps(items)})
+        assert len([query for query in queries.captured_queries
+                    if query['sql'].startswith('UPDATE "backend_orderitem"')]) == 1
+        resp_json = resp.json()
+        assert resp_json['Status'] is True
+        assert resp_json['Обновлено объектов'] == 2
+        assert set(resp_json['Errors']) == {str(ordered_items[1].id), str(10 ** 9)}
+        assert dict(basket.ordered_items.values_list('id', 'quantity')) == {
+            ordered_items[0].id: 4, ordered_items[1].id: 1, ordered_items[2].id: 5}
+
+
     # удалить товары из корзины
     def test_basket_del_items(self, api_client, user_buyer_token, shop_products, basket):
         url = reverse('backend:basket')
@@ -128,6 +535,81 @@ class TestShop:
         assert len(resp_json[0].get('ordered_items')) == basket.ordered_items.count()
 
 
+    # корзина в Redis: изменения не пишутся в БД до оформления заказа
+    def test_basket_redis(self, api_client, user_buyer, user_buyer_token, shop_products, basket, redis_basket_store):
+        product_infos = [product.product_infos.first() for product in shop_products]
+        for product_info in product_infos:
+            product_info.quantity = 10
+            product_info.save()
+        url = reverse('backend:basket')
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_buyer_token.key)
+
+        # корзина загружается из БД, ID позиций - ID позиций заказа, как в хранилище в БД
+        line_ids = dict(basket.ordered_items.values_list('product_info_id', 'id'))
+        resp_json = api_client.get(url).json()
+        assert resp_json[0]['id'] == basket.id
+        assert {item['id']: item['quantity'] for item in resp_json[0]['ordered_items']} == {
+            line_ids[product_info.id]: 1 for product_info in product_infos}
+
+        resp = api_client.post(url, {'items': json.dumps([{'product_info': product_infos[0].id, 'quantity': 2}])})
+        assert resp.json() == {'Status': True, 'Создано объектов': 1}
+        resp = api_client.put(url, {'items': json.dumps([{'id': line_ids[product_infos[1].id], 'quantity': 11},
+                                                         {'id': line_ids[product_infos[2].id], 'quantity': 4}])})
+        assert resp.json()['Errors'] == {str(line_ids[product_infos[1].id]): 'Недостаточно товара: в наличии 10'}
+        resp = api_client.delete(url, {'items': str(line_ids[product_infos[1].id])})
+        assert resp.json() == {'Status': True, 'Удалено объектов': 1}
+        expected = {line_ids[product_infos[0].id]: 3, line_ids[product_infos[2].id]: 4}
+        # цены позиций - на момент добавления или изменения количества, а не текущие цены каталога
+        prices = {line_ids[product_info.id]: product_info.price for product_info in product_infos}
+        ProductInfo.objects.filter(id=product_infos[0].id).update(price=F('price') + 100)
+        update_entries([product_infos[0].id])
+        resp_json = api_client.get(url).json()
+        assert {item['id']: item['quantity'] for item in resp_json[0]['ordered_items']} == expected
+        assert {item['id']: item['price'] for item in resp_json[0]['ordered_items']} == {
+            line_id: prices[line_id] for line_id in expected}
+        assert resp_json[0]['total_sum'] == sum(prices[line_id] * quantity for line_id, quantity in expected.items())
+        assert dict(basket.ordered_items.values_list('id', 'quantity')) == {
+            line_ids[product_info.id]: 1 for product_info in product_infos}
+
+        # периодическая запись: позиции в БД с теми же ID и ценами
+        assert flush_baskets() == 1
+        assert dict(basket.ordered_items.values_list('id', 'quantity')) == expected
+        assert Order.objects.get(id=basket.id).total_sum == resp_json[0]['total_sum']
+
+        # новая позиция получает ID позиции заказа сразу и сохраняет его при оформлении заказа
+        resp = api_client.post(url, {'items': json.dumps([{'product_info': product_infos[1].id, 'quantity': 5}])})
+        new_line = next(item for item in api_client.get(url).json()[0]['ordered_items'] if item['id'] not in expected)
+        assert new_line['quantity'] == 5
+        resp = api_client.post(reverse('backend:order'), {'id': str(basket.id), 'contact': str(basket.contact.pk)})
+        assert resp.json()['Status'] is True
+        assert dict(basket.ordered_items.values_list('id', 'quantity')) == {**expected, new_line['id']: 5}
+        assert api_client.get(url).json() == []
+
+
+    # параллельное добавление того же товара в корзину Redis не превышает остаток
+    def test_basket_redis_add_race(self, monkeypatch, user_buyer, shop_products, redis_basket_store):
+        product_info = shop_products[0].product_infos.first()
+        product_info.quantity = 5
+        product_info.save()
+        items_key = basket_module.ITEMS_KEY.format(user_id=user_buyer.id)
+        get_stock = basket_module.get_stock
+        calls = []
+
+        def get_stock_with_concurrent_add(*args, **kwargs):
+            # другой запрос добавляет товар между чтением корзины и записью
+            if not calls:
+                redis_basket_store.redis.hincrby(items_key, product_info.id, 3)
+            calls.append(args)
+            return get_stock(*args, **kwargs)
+
+        monkeypatch.setattr(basket_module, 'get_stock', get_stock_with_concurrent_add)
+        written, errors = redis_basket_store.add_items(user_buyer.id, [{'product_info': product_info.id, 'quantity': 3}])
+        # транзакция повторена, остаток проверен с учетом параллельно добавленного количества
+        assert len(calls) == 2
+        assert (written, errors) == (0, {product_info.id: 'Недостаточно товара: в наличии 5'})
+        assert redis_basket_store.redis.hgetall(items_key) == {str(product_info.id): '3'}
+
+
     # получить заказы пользователя
     def test_order_get(self, api_client, user_buyer_token, shop_products, shop_orders):
         url = reverse('backend:order')
@@ -149,4 +631,129 @@ class TestShop:
         resp_json = resp.json()
         assert {'Status',}.issubset(resp_json.keys())
         assert resp_json.get('Status') is True
-        Order.objects.get(id=basket.id).state == 'new'
\ No newline at end of file
+        Order.objects.get(id=basket.id).state == 'new'
+
+    # оформление заказа списывает товары, отмена и истечение резерва возвращают их на склад
+    def test_order_reservation(self, api_client, user_buyer_token, user_shop_token, shop_products, basket,
+                               django_capture_on_commit_callbacks):
+        product_infos = {item.product_info_id: item.product_info for item in basket.ordered_items.all()}
+        for product_info in product_infos.values():
+            product_info.quantity = 2
+            product_info.save()
+        OrderItem.objects.filter(order=basket, product_info_id=min(product_infos)).update(quantity=3)
+        url = reverse('backend:order')
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_buyer_token.key)
+        data = {'id': str(basket.id), 'contact': str(basket.contact.pk)}
+        resp = api_client.post(url, data)
+        assert resp.json() == {'Status': False, 'Errors': {str(min(product_infos)): 'Недостаточно товара: в наличии 2'}}
+        assert Order.objects.get(id=basket.id).state == 'basket'
+        assert set(ProductInfo.objects.filter(id__in=product_infos).values_list('quantity', flat=True)) == {2}
+
+        shop = product_infos[min(product_infos)].shop
+        assert Shop.objects.get(id=shop.id).catalog_version == shop.catalog_version
+
+        OrderItem.objects.filter(order=basket, product_info_id=min(product_infos)).update(quantity=2)
+        with django_capture_on_commit_callbacks(execute=True):
+            resp = api_client.post(url, data)
+        assert resp.json()['Status'] is True
+        order = Order.objects.get(id=basket.id)
+        assert order.state == 'new' and order.stock_reserved and order.reserved_until
+        assert dict(ProductInfo.objects.filter(id__in=product_infos).values_list('id', 'quantity')) == {
+            product_info_id: 0 if product_info_id == min(product_infos) else 1 for product_info_id in product_infos}
+        assert CatalogEntry.objects.get(product_info_id=min(product_infos)).document['quantity'] == 0
+        # выгрузки партнера с прежними остатками устаревают
+        assert Shop.objects.get(id=shop.id).catalog_version == shop.catalog_version + 1
+
+        # отмена магазином (повторная отмена не возвращает товары еще раз)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_shop_token.key)
+        for _ in range(2):
+            resp = api_client.put(reverse('backend:partner-orders'), {'id': order.id, 'state': 'canceled'})
+            assert resp.json()['Status'] is True
+        assert set(ProductInfo.objects.filter(id__in=product_infos).values_list('quantity', flat=True)) == {2}
+        assert not Order.objects.get(id=order.id).stock_reserved
+        assert Shop.objects.get(id=shop.id).catalog_version == shop.catalog_version + 2
+
+        # неподтвержденный заказ отменяется по истечении резерва, подтвержденный - нет
+        orders = []
+        for _ in range(2):
+            new_basket = Order.objects.create(user_id=order.user_id, state='basket')
+            OrderItem.objects.create(order=new_basket, product_info_id=min(product_infos), quantity=1)
+            assert checkout(order.user_id, new_basket.id, None) == (True, {})
+            orders.append(new_basket)
+        orders[1].state = 'confirmed'
+        orders[1].save()
+        Order.objects.filter(id__in=[order.id for order in orders]).update(reserved_until=timezone.now())
+        assert release_expired_reservations() == 1
+        assert Order.objects.get(id=orders[0].id).state == 'canceled'
+        assert Order.objects.get(id=orders[1].id).state == 'confirmed'
+        assert ProductInfo.objects.get(id=min(product_infos)).quantity == 1
+
+
+    # одновременные оформления заказов на товар с малым остатком: без перепродажи и длительных ожиданий
+    @postgres_only
+    @pytest.mark.django_db(transaction=True)
+    def test_checkout_concurrency(self, shop_products):
+        stock, orders_number, workers = 5, 300, 30
+        product_info = shop_products[0].product_infos.first()
+        product_info.quantity = stock
+        product_info.save()
+        users = User.objects.bulk_create([User(email=f'buyer{index}@example.com') for index in range(orders_number)])
+        orders = Order.objects.bulk_create([Order(user=user, state='basket') for user in users])
+        OrderItem.objects.bulk_create([OrderItem(order=order, product_info=product_info, quantity=1)
+                                       for order in orders])
+        barrier = threading.Barrier(workers)
+
+        def place_orders(orders):
+            barrier.wait()
+            results = []
+            try:
+                for order in orders:
+                    started = time.perf_counter()
+                    placed, _ = checkout(order.user_id, order.id, None)
+                    results.append((placed, time.perf_counter() - started))
+            finally:
+                connections.close_all()
+            return results
+
+        with ThreadPoolExecutor(workers) as executor:
+            results = [result for results in executor.map(place_orders, [orders[index::workers]
+                                                                        for index in range(workers)])
+                       for result in results]
+
+        assert sum(placed for placed, _ in results) == stock
+        assert ProductInfo.objects.get(id=product_info.id).quantity == 0
+        assert Order.objects.filter(state='new', stock_reserved=True).count() == stock
+        assert max(seconds for _, seconds in results) < 5
+
+
+    # итоги заказа хранятся в заказе и не меняются после изменения цен товаров
+    def test_order_totals(self, api_client, user_buyer_token, shop_products, basket):
+        product_infos = [product.product_infos.first() for product in shop_products]
+        for price, product_info in zip((100, 200, 300), product_infos):
+            product_info.price, product_info.quantity = price, 10
+            product_info.save()
+        OrderItem.objects.filter(order=basket).delete()
+        url = reverse('backend:basket')
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + user_buyer_token.key)
+        api_client.post(url, {'items': json.dumps([{'product_info': product_info.id, 'quantity': 2}
+                                                   for product_info in product_infos])})
+        lines = dict(basket.ordered_items.values_list('product_info_id', 'id'))
+        api_client.put(url, {'items': json.dumps([{'id': lines[product_infos[0].id], 'quantity': 1}])})
+        api_client.delete(url, {'items': str(lines[product_infos[2].id])})
+        resp_json = api_client.get(url).json()
+        assert (resp_json[0]['total_sum'], resp_json[0]['items_count']) == (100 * 1 + 200 * 2, 3)
+        assert {item['price'] for item in resp_json[0]['ordered_items']} == {100, 200}
+
+        # цены фиксируются при оформлении заказа
+        product_infos[1].price = 250
+        product_infos[1].save()
+        resp = api_client.post(reverse('backend:order'), {'id': str(basket.id), 'contact': str(basket.contact.pk)})
+        assert resp.json()['Status'] is True
+        product_infos[1].price = 1000
+        product_infos[1].save()
+        resp_json = api_client.get(reverse('backend:order')).json()
+        assert (resp_json[0]['total_sum'], resp_json[0]['items_count']) == (100 * 1 + 250 * 2, 3)
+
+        Order.objects.filter(id=basket.id).update(total_sum=0, items_count=0)
+        call_command('update_order_totals', stdout=io.StringIO())
+        assert Order.objects.filter(id=basket.id, total_sum=600, items_count=3).exists()